@@ -1,11 +1,26 @@
+import asyncio
+import re
+import threading
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from routers.registerUser import router as registerUserRouter
 from routers.referral_routes import router as referralRouter
 from routers.clan_routes import router as clanRouter
+from routers.admin_routes import router as adminRouter
+from database.connection_pool import connection_pool
+from database.write_queue import write_queue
+from database.slow_query_log import slow_query_log
+from database.async_queries import shutdown_db_executor
+from services.clan_cache import cache_stats, invalidation_channel
+from services.referral_system import start_expiry_sweeper, stop_expiry_sweeper
+from services.leaderboard import leaderboard, start_leaderboard_reconciler, stop_leaderboard_reconciler
+from services.json_response import FastJSONResponse
+from services.metrics import CONTENT_TYPE, MetricsMiddleware, render, stats_family
+from init_db import initialize_database
 
-app = FastAPI(title="Clan Saga API")
+app = FastAPI(title="Clan Saga API", default_response_class=FastJSONResponse)
 
 # Add CORS middleware
 app.add_middleware(
@@ -15,11 +30,14 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
 )
+# Added last so it is outermost and its timings include CORS handling
+app.add_middleware(MetricsMiddleware, routes=app.routes)
 
 # Include routers
 app.include_router(registerUserRouter, prefix="/api/users", tags=["Users"])
 app.include_router(referralRouter, prefix="/api/referrals", tags=["Referrals"])
 app.include_router(clanRouter, prefix="/api/clans", tags=["Clans"])
+app.include_router(adminRouter, prefix="/api/admin", tags=["Admin"])
 
 
 @app.get('/')
@@ -30,7 +48,74 @@ async def root():
 @app.get('/api/health')
 async def health_check():
     """Health check endpoint for monitoring"""
-    return {"status": "healthy", "version": "1.0.0"}
+    return {
+        "status": "healthy",
+        "version": "1.0.0",
+        "db_pool": connection_pool.stats(),
+        "write_queue": write_queue.stats(),
+        "caches": cache_stats(),
+        "leaderboard": leaderboard.stats(),
+    }
+
+
+def thread_counts() -> dict:
+    """Live threads grouped by name with the worker number stripped (db_3 -> db)"""
+    counts = {}
+    for thread in threading.enumerate():
+        group = re.sub(r"[-_]?\d+$", "", thread.name) or thread.name
+        counts[(group,)] = counts.get((group,), 0) + 1
+    return counts
+
+
+@app.get('/api/metrics')
+async def metrics():
+    """Prometheus metrics: request latencies, query timings, caches, pools and background work"""
+    caches = cache_stats()
+    cache_families = [
+        stats_family(f"clansaga_cache_{stat}_total", f"Cache {stat}",
+                     {(name,): stats[stat] for name, stats in caches.items()}, ("cache",), "counter")
+        for stat in ("hits", "misses", "evictions", "expirations", "invalidations")
+    ] + [stats_family("clansaga_cache_entries", "Entries held by each cache",
+                      {(name,): stats["size"] for name, stats in caches.items()}, ("cache",))]
+    pool = connection_pool.stats()
+    writes = write_queue.stats()
+    body = render(
+        *cache_families,
+        stats_family("clansaga_db_pool_connections_in_use", "Read connections checked out", {(): pool["in_use"]}),
+        stats_family("clansaga_db_pool_checkouts_total", "Read connection checkouts", {(): pool["checkouts"]},
+                     kind="counter"),
+        stats_family("clansaga_db_pool_timeouts_total", "Checkouts that timed out", {(): pool["timeouts"]},
+                     kind="counter"),
+        stats_family("clansaga_db_pool_wait_seconds_total", "Time spent waiting for a read connection",
+                     {(): pool["wait_time_total"]}, kind="counter"),
+        stats_family("clansaga_write_queue_pending", "Writes waiting for the writer thread", {(): writes["queued"]}),
+        stats_family("clansaga_write_queue_writes_total", "Writes committed or rolled back by the writer",
+                     {(): writes["writes"]}, kind="counter"),
+        stats_family("clansaga_write_queue_batches_total", "Transactions committed by the writer",
+                     {(): writes["batches"]}, kind="counter"),
+        stats_family("clansaga_db_slow_queries_total", "Statement calls over the slow query threshold",
+                     {(): slow_query_log.stats()["recorded"]}, kind="counter"),
+        stats_family("clansaga_threads", "Live threads by name", thread_counts(), ("name",)),
+        stats_family("clansaga_asyncio_tasks", "Tasks on the event loop", {(): len(asyncio.all_tasks())}),
+    )
+    return Response(body, media_type=CONTENT_TYPE)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    initialize_database()
+    start_expiry_sweeper()
+    start_leaderboard_reconciler()
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    stop_expiry_sweeper()
+    stop_leaderboard_reconciler()
+    shutdown_db_executor()
+    write_queue.close()
+    invalidation_channel.close()
+    connection_pool.close_all()
 
 
 if __name__ == "__main__":
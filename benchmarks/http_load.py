@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""End-to-end HTTP load test for the API.
+
+Seeds a throwaway database, then runs concurrent virtual clients against app.app
+with a weighted mix of the real user flows (register, create a clan, join by
+invite, list clans, member lists, look up a user's clan, leave). Prints
+throughput and p50/p95/p99 latency per route and can save them as JSON to
+compare runs between commits.
+
+    python -m benchmarks.http_load --users 20000 --clans 500 --clients 32 --duration 20 \\
+        --output results.json --compare previous.json
+
+--transport inprocess (default) calls the ASGI app directly, so only the app is
+measured. --transport socket starts uvicorn in a subprocess and talks HTTP/1.1
+over keep-alive local sockets, which adds the server's HTTP parsing.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# route label -> relative weight in the traffic mix
+DEFAULT_MIX = {
+    "available_clans": 30,
+    "clan_members": 20,
+    "user_clan": 20,
+    "register_user": 10,
+    "join_clan": 10,
+    "leave_clan": 5,
+    "create_clan": 5,
+}
+
+
+def wallet(i: int) -> str:
+    return f"0x{i:040x}"
+
+
+def seed_database(database: str, users: int, clans: int, member_ratio: float) -> dict:
+    """Create the schema and fill it; returns the state the clients start from"""
+    from init_db import migrate
+    migrate(database)
+
+    now = datetime.now()
+    conn = sqlite3.connect(database)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executemany(
+        "INSERT INTO Users (user_id, wallet_address, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        ((i, wallet(i), now, now) for i in range(1, users + 1)))
+    conn.executemany(
+        "INSERT INTO Clans (clan_id, clan_name, created_at, updated_at, clan_leader_id) VALUES (?, ?, ?, ?, ?)",
+        ((c, f"clan {c}", now, now, c) for c in range(1, clans + 1)))
+    conn.executemany(
+        "INSERT INTO Referrals (referral_code, created_at, is_active, user_id, clan_id, expires_at) "
+        "VALUES (?, ?, TRUE, ?, ?, ?)",
+        ((f"invite-{c}", now, c, c, now + timedelta(days=7)) for c in range(1, clans + 1)))
+    conn.execute("UPDATE Users SET clan_id = user_id WHERE user_id <= ?", (clans,))
+
+    # Every clan gets members round-robin from the users after the leaders
+    member_count = int((users - clans) * member_ratio)
+    members = list(range(clans + 1, clans + 1 + member_count))
+    conn.executemany("UPDATE Users SET clan_id = ? WHERE user_id = ?",
+                     ((i % clans + 1, i) for i in members))
+    conn.commit()
+    conn.close()
+
+    return {
+        "members": [wallet(i) for i in members],
+        "free_wallets": [wallet(i) for i in range(clans + 1 + member_count, users + 1)],
+        "invite_codes": [f"invite-{c}" for c in range(1, clans + 1)],
+        "clan_ids": list(range(1, clans + 1)),
+        "next_wallet": users + 1,
+    }
+
+
+class InProcessTransport:
+    """Calls the ASGI app directly in this event loop"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def start(self):
+        await self.app.router.startup()
+
+    async def stop(self):
+        await self.app.router.shutdown()
+
+    async def request(self, method: str, path: str, body=None):
+        path, _, query = path.partition("?")
+        payload = json.dumps(body).encode() if body is not None else b""
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+            "query_string": query.encode(), "root_path": "",
+            "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(payload)).encode())],
+            "client": ("127.0.0.1", 0), "server": ("bench", 80),
+        }
+        sent = False
+        status = None
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            await asyncio.Event().wait()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+    def client(self):
+        return self
+
+
+class SocketTransport:
+    """Runs uvicorn in a subprocess; each virtual client keeps one keep-alive connection"""
+
+    def __init__(self, env: dict):
+        self.env = env
+        self.port = None
+        self.server = None
+
+    async def start(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self.server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=PROJECT_DIR, env=self.env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+                writer.close()
+                return
+            except OSError:
+                await asyncio.sleep(0.1)
+        raise RuntimeError("uvicorn did not start")
+
+    async def stop(self):
+        self.server.terminate()
+        self.server.wait(10)
+
+    def client(self):
+        return SocketClient(self.port)
+
+
+class SocketClient:
+    def __init__(self, port: int):
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method: str, path: str, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return status, await self.reader.readexactly(length)
+
+
+class Scenario:
+    """The shared world the virtual clients act on, and one method per route in the mix"""
+
+    def __init__(self, state: dict, rng: random.Random):
+        self.state = state
+        self.rng = rng
+
+    def _take(self, name: str):
+        items = self.state[name]
+        if not items:
+            return None
+        index = self.rng.randrange(len(items))
+        items[index], items[-1] = items[-1], items[index]
+        return items.pop()
+
+    def _new_wallet(self) -> str:
+        self.state["next_wallet"] += 1
+        return wallet(self.state["next_wallet"])
+
+    async def register_user(self, client):
+        address = self._new_wallet()
+        status, _ = await client.request("POST", "/api/users/register_user", {"wallet_address": address})
+        if status == 200:
+            self.state["free_wallets"].append(address)
+        return status
+
+    async def create_clan(self, client):
+        address = self._take("free_wallets")
+        if address is None:
+            return await self.register_user(client)
+        status, body = await client.request("POST", "/api/clans/create_clan",
+                                            {"clan_name": f"clan of {address[-6:]}", "creator_wallet": address})
+        if status == 200:
+            created = json.loads(body)
+            self.state["clan_ids"].append(created["clan_id"])
+            self.state["invite_codes"].append(created["invite_code"])
+        else:
+            self.state["free_wallets"].append(address)
+        return status
+
+    async def join_clan(self, client):
+        address = self._take("free_wallets")
+        if address is None or not self.state["invite_codes"]:
+            return await self.register_user(client)
+        code = self.rng.choice(self.state["invite_codes"])
+        status, _ = await client.request("POST", "/api/clans/join_clan",
+                                         {"wallet_address": address, "invite_code": code})
+        self.state["members" if status == 200 else "free_wallets"].append(address)
+        return status
+
+    async def leave_clan(self, client):
+        address = self._take("members")
+        if address is None:
+            return await self.join_clan(client)
+        status, _ = await client.request("POST", "/api/clans/leave_clan", {"wallet_address": address})
+        self.state["free_wallets" if status == 200 else "members"].append(address)
+        return status
+
+    async def available_clans(self, client):
+        sort = self.rng.choice(("clan_id", "created_at", "member_count"))
+        status, _ = await client.request("GET", f"/api/clans/available_clans?limit=50&sort={sort}&order=desc")
+        return status
+
+    async def clan_members(self, client):
+        clan_id = self.rng.choice(self.state["clan_ids"])
+        status, _ = await client.request("GET", f"/api/clans/clan/{clan_id}/members")
+        return status
+
+    async def user_clan(self, client):
+        pool = self.state["members"] or self.state["free_wallets"]
+        status, _ = await client.request("GET", f"/api/clans/user_clan/{self.rng.choice(pool)}")
+        return status
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(latencies: dict, errors: dict, elapsed: float) -> dict:
+    """Per-route and overall count, error count, throughput and latency percentiles in ms"""
+    def stats(values, failed):
+        values = sorted(values)
+        return {
+            "requests": len(values),
+            "errors": failed,
+            "throughput": round(len(values) / elapsed, 1),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        }
+
+    routes = {route: stats(values, errors.get(route, 0)) for route, values in sorted(latencies.items())}
+    everything = [value for values in latencies.values() for value in values]
+    routes["total"] = stats(everything, sum(errors.values()))
+    return routes
+
+
+async def run_load(transport, scenario: Scenario, mix: dict, clients: int, duration: float, warmup: float) -> dict:
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    latencies = {route: [] for route in routes}
+    errors = {}
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def virtual_client():
+        client = transport.client()
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                return
+            route = scenario.rng.choices(routes, weights)[0]
+            status = await getattr(scenario, route)(client)
+            finished = time.perf_counter()
+            if now >= measure_from:
+                latencies[route].append(finished - now)
+                if status >= 400:
+                    errors[route] = errors.get(route, 0) + 1
+
+    await asyncio.gather(*(virtual_client() for _ in range(clients)))
+    return summarize(latencies, errors, time.perf_counter() - measure_from)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(results: dict, baseline: dict = None):
+    header = f"{'route':18} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    if baseline:
+        header += f" {'p95 vs base':>12} {'req/s vs base':>14}"
+    print(header)
+    for route, stats in results.items():
+        line = (f"{route:18} {stats['requests']:9d} {stats['errors']:7d} {stats['throughput']:9.1f} "
+                f"{stats['p50_ms']:8.2f} {stats['p95_ms']:8.2f} {stats['p99_ms']:8.2f}")
+        before = (baseline or {}).get(route)
+        if before and before["p95_ms"] and before["throughput"]:
+            line += (f" {(stats['p95_ms'] / before['p95_ms'] - 1) * 100:+11.1f}%"
+                     f" {(stats['throughput'] / before['throughput'] - 1) * 100:+13.1f}%")
+        print(line)
+
+
+def parse_mix(text: str) -> dict:
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (text or "").split(",")):
+        route, _, weight = part.partition("=")
+        if route not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown route {route}; expected one of {', '.join(DEFAULT_MIX)}")
+        mix[route] = float(weight)
+    return {route: weight for route, weight in mix.items() if weight > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000, help="users to seed")
+    parser.add_argument("--clans", type=int, default=500, help="clans to seed")
+    parser.add_argument("--member-ratio", type=float, default=0.5, help="share of non-leaders seeded into clans")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent virtual clients")
+    parser.add_argument("--duration", type=float, default=15, help="seconds to measure")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds to run before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(""),
+                        help="route weights to override, e.g. register_user=20,leave_clan=0")
+    parser.add_argument("--transport", choices=("inprocess", "socket"), default="inprocess")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the traffic")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "load.db")
+        # The app reads its settings at import, so point it at the seeded database first
+        os.environ["CLANSAGA_DATABASE_URL"] = f"sqlite://{database}"
+        print(f"Seeding {args.users} users and {args.clans} clans")
+        state = seed_database(database, args.users, args.clans, args.member_ratio)
+
+        if args.transport == "socket":
+            transport = SocketTransport(dict(os.environ))
+        else:
+            sys.path.insert(0, PROJECT_DIR)
+            from app import app
+            transport = InProcessTransport(app)
+
+        async def run():
+            await transport.start()
+            try:
+                return await run_load(transport, Scenario(state, random.Random(args.seed)), args.mix,
+                                      args.clients, args.duration, args.warmup)
+            finally:
+                await transport.stop()
+
+        print(f"Running {args.clients} clients for {args.duration}s over {args.transport}")
+        results = asyncio.run(run())
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "routes": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)["routes"]
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(report, out, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Cost of turning row dicts into a JSON response body, per 10k rows.
+
+Compares FastAPI's default path (jsonable_encoder, then JSONResponse) with
+FastJSONResponse and with a body that was encoded once and cached, for rows shaped
+like get_clan_members and get_available_clans. Rows are built in memory with
+datetime values, as a connection with detect_types would return them, and again
+with the plain strings sqlite3 returns by default.
+
+    python -m benchmarks.json_serialization --rows 10000
+"""
+import argparse
+import timeit
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from services.json_response import FastJSONResponse, dumps, encoded_json_response
+
+
+def member_rows(count: int, as_strings: bool) -> list:
+    start = datetime(2026, 1, 1)
+    rows = []
+    for i in range(count):
+        created_at = start + timedelta(seconds=i * 37)
+        rows.append({
+            "user_id": i,
+            "wallet_address": f"0x{i:040x}",
+            "username": f"player{i}" if i % 2 else None,
+            "profile_image": None,
+            "created_at": created_at.isoformat(" ") if as_strings else created_at,
+        })
+    return rows
+
+
+def clan_rows(count: int, as_strings: bool) -> list:
+    start = datetime(2026, 1, 1)
+    rows = []
+    for i in range(count):
+        created_at = start + timedelta(seconds=i * 61)
+        rows.append({
+            "clan_id": i,
+            "clan_name": f"Clan {i}",
+            "clan_image": None,
+            "created_at": created_at.isoformat(" ") if as_strings else created_at,
+            "updated_at": created_at.isoformat(" ") if as_strings else created_at,
+            "clan_leader_id": i * 10,
+            "member_count": i % 97,
+            "leader_name": f"leader{i}",
+            "leader_wallet": f"0x{i:040x}",
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    scale = 10000 / args.rows
+
+    print(f"{'payload':32} {'default':>10} {'orjson':>10} {'cached':>10} {'speedup':>8}   (ms per 10k rows)")
+    for label, make_rows, key in (("members", member_rows, "members"), ("available_clans", clan_rows, "clans")):
+        for as_strings in (False, True):
+            payload = {key: make_rows(args.rows, as_strings), "count": args.rows}
+            body = dumps(payload)
+            assert body == JSONResponse(jsonable_encoder(payload)).body or not as_strings
+
+            def timed(call):
+                return min(timeit.repeat(call, number=1, repeat=args.repeat)) * scale * 1000
+
+            default = timed(lambda: JSONResponse(jsonable_encoder(payload)))
+            fast = timed(lambda: FastJSONResponse(payload))
+            cached = timed(lambda: encoded_json_response(body))
+            name = f"{label} ({'str' if as_strings else 'datetime'} dates)"
+            print(f"{name:32} {default:10.2f} {fast:10.2f} {cached:10.3f} {default / fast:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Per-query cost of the precompiled statement registry against plain pydapper.
+
+Builds a throwaway database, then runs a few hot read queries both ways on the
+same connection and prints microseconds per call.
+
+    python -m benchmarks.query_registry --users 20000 --iterations 20000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import timeit
+from pydapper import using
+from init_db import migrate
+from database.database_queries import USER_ID_BY_WALLET
+from database.clan_database_queries import CLAN_BY_ID, WALLET_CONTEXT, CLAN_MEMBERS
+
+
+def seed(database: str, users: int, clan_size: int):
+    conn = sqlite3.connect(database)
+    conn.executemany("INSERT INTO Users (user_id, wallet_address, username) VALUES (?, ?, ?)",
+                     ((i, f"0x{i:040x}", f"user{i}") for i in range(1, users + 1)))
+    conn.executemany("INSERT INTO Clans (clan_id, clan_name, clan_leader_id) VALUES (?, ?, ?)",
+                     ((c, f"clan{c}", (c - 1) * clan_size + 1) for c in range(1, users // clan_size + 1)))
+    conn.execute(f"UPDATE Users SET clan_id = (user_id - 1) / {clan_size} + 1")
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--clan-size", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "bench.db")
+        migrate(database)
+        seed(database, args.users, args.clan_size)
+        conn = sqlite3.connect(database, cached_statements=256)
+        commands = using(conn)
+
+        wallet = f"0x{args.users // 2:040x}"
+        cases = [
+            ("user_exists (row)", USER_ID_BY_WALLET, "row", {"wallet_address": wallet}),
+            ("get_clan_by_id (record)", CLAN_BY_ID, "record", {"clan_id": 7}),
+            ("get_wallet_context (record)", WALLET_CONTEXT, "record", {"wallet_address": wallet}),
+            (f"get_clan_members, {args.clan_size} rows (records)", CLAN_MEMBERS, "records", {"clan_id": 7}),
+        ]
+        print(f"{'query':45} {'pydapper':>10} {'registry':>10} {'speedup':>8}")
+        for label, stmt, method, param in cases:
+            pydapper_call = (lambda: commands.query(stmt.sql, param=param)) if method == "records" \
+                else (lambda: commands.query_first_or_default(stmt.sql, default=None, param=param))
+            registry_call = getattr(stmt, method)
+            assert (pydapper_call() or None) is not None and registry_call(conn, param) is not None
+
+            baseline = min(timeit.repeat(pydapper_call, number=args.iterations, repeat=3)) / args.iterations
+            compiled = min(timeit.repeat(lambda: registry_call(conn, param), number=args.iterations,
+                                         repeat=3)) / args.iterations
+            print(f"{label:45} {baseline * 1e6:8.1f}us {compiled * 1e6:8.1f}us {baseline / compiled:7.1f}x")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Awaitable versions of the query functions for use from async route handlers.
+
+The query functions themselves stay synchronous sqlite3 calls through the statement
+registry and the write queue; they run on a dedicated executor sized to the connection
+pool so a slow query never blocks the event loop and executor threads never queue
+behind each other for a pooled connection.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database.connection_string import pool_size
+from database import database_queries, clan_database_queries
+from services import referral_system, clan_referral_system
+
+_db_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """The shared database executor, created on first use"""
+    global _db_executor
+    with _executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db")
+        return _db_executor
+
+
+async def run_in_db_executor(func, *args, **kwargs):
+    """Run a blocking database call on the database executor and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_db_executor(), functools.partial(func, *args, **kwargs))
+
+
+def to_async(func):
+    """Wrap a blocking database function so it can be awaited"""
+    submit = getattr(func, "submit", None)
+    if submit is not None:
+        # Queued writes are awaited directly rather than parking an executor thread on them
+        @functools.wraps(func)
+        async def write(*args, **kwargs):
+            return await asyncio.wrap_future(submit(*args, **kwargs))
+        return write
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db_executor(func, *args, **kwargs)
+    return wrapper
+
+
+def shutdown_db_executor():
+    """Wait for in-flight queries and stop the executor; the next call starts a fresh one"""
+    global _db_executor
+    with _executor_lock:
+        executor, _db_executor = _db_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+# database_queries
+fetch_user_by_wallet = to_async(database_queries.fetch_user_by_wallet)
+insert_user = to_async(database_queries.insert_user)
+user_exists = to_async(database_queries.user_exists)
+fetch_referral_code = to_async(database_queries.fetch_referral_code)
+store_referral_code = to_async(database_queries.store_referral_code)
+inactivate_referral_token = to_async(database_queries.inactivate_referral_token)
+delete_referral_token = to_async(database_queries.delete_referral_token)
+fetch_all_referral_codes = to_async(database_queries.fetch_all_referral_codes)
+
+# clan_database_queries
+is_user_in_clan = to_async(clan_database_queries.is_user_in_clan)
+insert_clan = to_async(clan_database_queries.insert_clan)
+get_clan_by_id = to_async(clan_database_queries.get_clan_by_id)
+join_clan_by_id = to_async(clan_database_queries.join_clan_by_id)
+get_clan_id_by_invite_code = to_async(clan_database_queries.get_clan_id_by_invite_code)
+get_available_clans = to_async(clan_database_queries.get_available_clans)
+get_user_clan = to_async(clan_database_queries.get_user_clan)
+get_wallet_context = to_async(clan_database_queries.get_wallet_context)
+get_clan_members = to_async(clan_database_queries.get_clan_members)
+get_clan_versions = to_async(clan_database_queries.get_clan_versions)
+remove_user_from_clan = to_async(clan_database_queries.remove_user_from_clan)
+is_clan_leader = to_async(clan_database_queries.is_clan_leader)
+add_users_to_clan = to_async(clan_database_queries.add_users_to_clan)
+remove_users_from_clan = to_async(clan_database_queries.remove_users_from_clan)
+disband_clan = to_async(clan_database_queries.disband_clan)
+
+# referral services that touch the database
+referral_code_handler = to_async(referral_system.referral_code_handler)
+is_active_referral_code = to_async(referral_system.is_active_referral_code)
+redeem_referral = to_async(referral_system.redeem_referral)
+generate_clan_invite_code = to_async(clan_referral_system.generate_clan_invite_code)
+redeem_clan_invite = to_async(clan_referral_system.redeem_clan_invite)
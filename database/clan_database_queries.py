@@ -1,155 +1,458 @@
-from pydapper import connect
-from database.connection_string import connection_string
+import json
+import os
+from database.connection_pool import connection_pool
+from database.statements import statement, compiled
+from database.write_queue import queued_write
+from services.metrics import timed_query
 from models.user_models import Clan
 from datetime import datetime
 
+# Optional cap on members per clan (leader included), checked by the join statements
+# themselves so concurrent joins cannot overshoot it; unset means no cap
+max_clan_members = int(os.getenv("CLANSAGA_MAX_CLAN_MEMBERS") or 0) or None
 
+USER_CLAN_ID = statement(
+    "clan_database_queries.is_user_in_clan",
+    "SELECT clan_id FROM Users WHERE user_id = ?user_id?")
+
+INSERT_CLAN = statement(
+    "clan_database_queries.insert_clan",
+    """
+    INSERT INTO Clans (clan_name, clan_image, created_at, updated_at, clan_leader_id)
+    VALUES (?clan_name?, ?clan_image?, ?created_at?, ?updated_at?, ?clan_leader_id?)
+    """)
+
+CLAN_BY_ID = statement(
+    "clan_database_queries.get_clan_by_id",
+    """
+    SELECT c.*, u.username as leader_name, u.wallet_address as leader_wallet, COALESCE(v.version, 0) as version
+    FROM Clans c
+    JOIN Users u ON c.clan_leader_id = u.user_id
+    LEFT JOIN clan_versions v ON v.clan_id = c.clan_id
+    WHERE c.clan_id = ?clan_id?
+    """)
+
+# Compare-and-set: changes no row unless the user is in no clan and the clan exists and has room
+JOIN_CLAN = statement(
+    "clan_database_queries.join_clan_by_id",
+    """
+    UPDATE Users SET clan_id = ?clan_id?, updated_at = ?updated_at?
+    WHERE user_id = ?user_id? AND clan_id IS NULL
+    AND EXISTS (
+        SELECT 1 FROM Clans
+        WHERE Clans.clan_id = ?clan_id? AND (?max_members? IS NULL OR Clans.member_count < ?max_members?)
+    )
+    """)
+
+CLAN_MEMBER_COUNT = statement(
+    "clan_database_queries.join_clan_by_id.member_count",
+    "SELECT member_count FROM Clans WHERE clan_id = ?clan_id?")
+
+CLAN_ID_BY_INVITE_CODE = statement(
+    "clan_database_queries.get_clan_id_by_invite_code",
+    """
+    SELECT clan_id FROM Referrals
+    WHERE referral_code = ?referral_code? AND is_active = TRUE
+    AND (expires_at IS NULL OR expires_at > ?now?)
+    """)
+
+WALLET_CONTEXT = statement(
+    "clan_database_queries.get_wallet_context",
+    """
+    SELECT u.user_id, c.*, l.username as leader_name, l.wallet_address as leader_wallet,
+           COALESCE(v.version, 0) as version
+    FROM Users u
+    LEFT JOIN Clans c ON c.clan_id = u.clan_id
+    LEFT JOIN Users l ON l.user_id = c.clan_leader_id
+    LEFT JOIN clan_versions v ON v.clan_id = c.clan_id
+    WHERE u.wallet_address = ?wallet_address?
+    """)
+
+CLAN_SCORES_BATCH = statement(
+    "clan_database_queries.get_clan_scores_batch",
+    """
+    SELECT clan_id, clan_name, member_count, invites_redeemed
+    FROM Clans
+    WHERE clan_id > ?after_clan_id?
+    ORDER BY clan_id
+    LIMIT ?batch_size?
+    """)
+
+CLAN_SCORES = statement(
+    "clan_database_queries.get_clan_scores",
+    """
+    SELECT clan_id, clan_name, member_count, invites_redeemed
+    FROM Clans
+    WHERE clan_id IN (SELECT value FROM json_each(?clan_ids?))
+    """)
+
+# Row 0 is the version of the clan listing as a whole
+CLAN_VERSIONS = statement(
+    "clan_database_queries.get_clan_versions",
+    "SELECT clan_id, version FROM clan_versions WHERE clan_id IN (SELECT value FROM json_each(?clan_ids?))")
+
+CLAN_MEMBERS = statement(
+    "clan_database_queries.get_clan_members",
+    """
+    SELECT user_id, wallet_address, username, profile_image, created_at
+    FROM Users
+    WHERE clan_id = ?clan_id?
+    """)
+
+CLANS_BATCH = statement(
+    "clan_database_queries.get_clans_batch",
+    """
+    SELECT c.*, u.username as leader_name, u.wallet_address as leader_wallet
+    FROM Clans c
+    JOIN Users u ON c.clan_leader_id = u.user_id
+    WHERE c.clan_id > ?after_clan_id?
+    ORDER BY c.clan_id
+    LIMIT ?batch_size?
+    """)
+
+CLAN_MEMBERS_BATCH = statement(
+    "clan_database_queries.get_clan_members_batch",
+    """
+    SELECT user_id, wallet_address, username, profile_image, created_at
+    FROM Users
+    WHERE clan_id = ?clan_id? AND user_id > ?after_user_id?
+    ORDER BY user_id
+    LIMIT ?batch_size?
+    """)
+
+LEAVE_CLAN = statement(
+    "clan_database_queries.remove_user_from_clan",
+    "UPDATE Users SET clan_id = NULL, updated_at = ?updated_at? WHERE user_id = ?user_id?")
+
+USERS_BY_WALLETS = statement(
+    "clan_database_queries._users_by_wallet",
+    "SELECT wallet_address, user_id, clan_id FROM Users WHERE wallet_address IN (SELECT value FROM json_each(?wallets?))")
+
+# The unary + keeps the planner on the wallet_address index rather than
+# idx_users_clan_id, which would walk every user without a clan
+ADD_USERS_TO_CLAN = statement(
+    "clan_database_queries.add_users_to_clan",
+    """
+    UPDATE Users SET clan_id = ?clan_id?, updated_at = ?updated_at?
+    WHERE wallet_address IN (SELECT value FROM json_each(?wallets?)) AND +clan_id IS NULL
+    AND EXISTS (SELECT 1 FROM Clans WHERE Clans.clan_id = ?clan_id?)
+    """)
+
+CLAN_LEADER = statement(
+    "clan_database_queries.is_clan_leader",
+    "SELECT clan_leader_id FROM Clans WHERE clan_id = ?clan_id?")
+
+REMOVE_USERS_FROM_CLAN = statement(
+    "clan_database_queries.remove_users_from_clan",
+    """
+    UPDATE Users SET clan_id = NULL, updated_at = ?updated_at?
+    WHERE wallet_address IN (SELECT value FROM json_each(?wallets?)) AND +clan_id = ?clan_id?
+    """)
+
+CLAN_MEMBER_WALLETS = statement(
+    "clan_database_queries.disband_clan.members",
+    "SELECT wallet_address FROM Users WHERE clan_id = ?clan_id?")
+
+CLEAR_CLAN_MEMBERS = statement(
+    "clan_database_queries.disband_clan.clear_members",
+    "UPDATE Users SET clan_id = NULL, updated_at = ?updated_at? WHERE clan_id = ?clan_id?")
+
+DELETE_CLAN_INVITES = statement(
+    "clan_database_queries.disband_clan.delete_invites",
+    "DELETE FROM Referrals WHERE clan_id = ?clan_id?")
+
+DELETE_CLAN = statement(
+    "clan_database_queries.disband_clan.delete_clan",
+    "DELETE FROM Clans WHERE clan_id = ?clan_id?")
+
+
+@timed_query
 def is_user_in_clan(user_id: int) -> bool:
     """Check if a user is already in a clan"""
-    with connect(connection_string) as commands:
-        result = commands.query_single(
-            "SELECT clan_id FROM Users WHERE user_id = ?user_id?",
-            param={"user_id": user_id}
-        )
-        return result and result.get("clan_id") is not None
-
-
-def insert_clan(clan: Clan) -> int:
-    """Insert a new clan and return its ID"""
-    with connect(connection_string) as commands:
-        command = """
-        INSERT INTO Clans (clan_name, clan_image, created_at, updated_at, clan_leader_id)
-        VALUES (?clan_name?, ?clan_image?, ?created_at?, ?updated_at?, ?clan_leader_id?)
-        """
-        commands.execute(
-            command,
-            param={
-                "clan_name": clan.clan_name,
-                "clan_image": clan.clan_image,
-                "created_at": clan.created_at,
-                "updated_at": clan.updated_at,
-                "clan_leader_id": clan.clan_leader_id
-            }
-        )
-        
-        # Get the last inserted id
-        result = commands.query_single("SELECT last_insert_rowid() as clan_id")
-        return result["clan_id"]
+    with connection_pool.connection() as conn:
+        return USER_CLAN_ID.scalar(conn, {"user_id": user_id}) is not None
+
 
+@queued_write
+def insert_clan(conn, clan: Clan) -> int:
+    """Insert a new clan with its leader as the first member and return its ID.
 
+    Raises ValueError, and nothing is written, if the leader is already in a clan.
+    """
+    clan_id = INSERT_CLAN.execute(conn, {
+        "clan_name": clan.clan_name,
+        "clan_image": clan.clan_image,
+        "created_at": clan.created_at,
+        "updated_at": clan.updated_at,
+        "clan_leader_id": clan.clan_leader_id
+    }).lastrowid
+    outcome = _join_clan(conn, clan.clan_leader_id, clan_id)
+    if outcome == "user_not_found":
+        raise ValueError("User not found")
+    if outcome != "joined":
+        raise ValueError("User already belongs to a clan")
+    return clan_id
+
+
+@timed_query
 def get_clan_by_id(clan_id: int):
     """Get clan details by clan ID"""
-    with connect(connection_string) as commands:
-        clan = commands.query_single(
-            """
-            SELECT c.*, u.username as leader_name, u.wallet_address as leader_wallet
-            FROM Clans c
-            JOIN Users u ON c.clan_leader_id = u.user_id
-            WHERE c.clan_id = ?clan_id?
-            """,
-            param={"clan_id": clan_id}
-        )
-        return clan
-
-
-def join_clan_by_id(user_id: int, clan_id: int):
-    """Update a user to join a clan"""
-    with connect(connection_string) as commands:
-        commands.execute(
-            "UPDATE Users SET clan_id = ?clan_id?, updated_at = ?updated_at? WHERE user_id = ?user_id?",
-            param={
-                "clan_id": clan_id,
-                "updated_at": datetime.now(),
-                "user_id": user_id
-            }
-        )
+    with connection_pool.connection() as conn:
+        return CLAN_BY_ID.record(conn, {"clan_id": clan_id})
+
+
+@queued_write
+def join_clan_by_id(conn, user_id: int, clan_id: int) -> str:
+    """Put a user who is in no clan into a clan.
 
+    Returns "joined", "user_not_found", "already_in_clan", "clan_not_found" or "clan_full".
+    """
+    return _join_clan(conn, user_id, clan_id)
 
+
+def _join_clan(conn, user_id: int, clan_id: int) -> str:
+    if JOIN_CLAN.run(conn, {"clan_id": clan_id, "updated_at": datetime.now(), "user_id": user_id,
+                            "max_members": max_clan_members}):
+        return "joined"
+    # Only a refused join pays for reads, to say why
+    user = USER_CLAN_ID.row(conn, {"user_id": user_id})
+    if user is None:
+        return "user_not_found"
+    if user[0] is not None:
+        return "already_in_clan"
+    member_count = CLAN_MEMBER_COUNT.scalar(conn, {"clan_id": clan_id})
+    if member_count is None:
+        return "clan_not_found"
+    if max_clan_members is not None and member_count >= max_clan_members:
+        return "clan_full"
+    raise RuntimeError(f"Join of user {user_id} to clan {clan_id} was refused for no known reason")
+
+
+@timed_query
 def get_clan_id_by_invite_code(invite_code: str) -> int:
     """Get the clan ID associated with an invite code"""
-    with connect(connection_string) as commands:
-        result = commands.query_single(
-            "SELECT clan_id FROM Referrals WHERE referral_code = ?referral_code? AND is_active = TRUE",
-            param={"referral_code": invite_code}
-        )
-        if not result or result.get("clan_id") is None:
-            raise ValueError(f"No active clan found for invite code: {invite_code}")
-        return result["clan_id"]
-
-
-def get_available_clans():
-    """Get all available clans with member counts"""
-    with connect(connection_string) as commands:
-        clans = commands.query(
-            """
-            SELECT c.*, u.username as leader_name, u.wallet_address as leader_wallet,
-                  (SELECT COUNT(*) FROM Users WHERE clan_id = c.clan_id) as member_count
-            FROM Clans c
-            JOIN Users u ON c.clan_leader_id = u.user_id
-            """
-        )
-        return clans
+    with connection_pool.connection() as conn:
+        clan_id = CLAN_ID_BY_INVITE_CODE.scalar(conn, {"referral_code": invite_code, "now": datetime.now()})
+    if clan_id is None:
+        raise ValueError(f"No active clan found for invite code: {invite_code}")
+    return clan_id
+
 
+# Sort keys accepted by get_available_clans; clan_id breaks ties so the order is stable
+CLAN_SORT_COLUMNS = {
+    "clan_id": "c.clan_id",
+    "created_at": "c.created_at",
+    "member_count": "c.member_count",
+}
 
 
+def available_clans_query(limit: int = None, sort: str = "clan_id", descending: bool = False, after: tuple = None,
+                          min_members: int = None, max_members: int = None, leader_wallet: str = None):
+    """Build the SQL and parameters for one page of get_available_clans"""
+    if sort not in CLAN_SORT_COLUMNS:
+        raise ValueError(f"Cannot sort clans by {sort}")
+    sort_column = CLAN_SORT_COLUMNS[sort]
+    direction = "DESC" if descending else "ASC"
+
+    conditions = []
+    param = {}
+    if after is not None:
+        if sort == "clan_id":
+            conditions.append(f"c.clan_id {'<' if descending else '>'} ?after_id?")
+        else:
+            conditions.append(f"({sort_column}, c.clan_id) {'<' if descending else '>'} (?after_value?, ?after_id?)")
+            param["after_value"] = after[0]
+        param["after_id"] = after[1]
+    if min_members is not None:
+        conditions.append("c.member_count >= ?min_members?")
+        param["min_members"] = min_members
+    if max_members is not None:
+        conditions.append("c.member_count <= ?max_members?")
+        param["max_members"] = max_members
+    if leader_wallet is not None:
+        conditions.append("u.wallet_address = ?leader_wallet?")
+        param["leader_wallet"] = leader_wallet
+
+    sql = """
+        SELECT c.*, u.username as leader_name, u.wallet_address as leader_wallet
+        FROM Clans c
+        JOIN Users u ON c.clan_leader_id = u.user_id
+        """
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if sort == "clan_id":
+        sql += f" ORDER BY c.clan_id {direction}"
+    else:
+        sql += f" ORDER BY {sort_column} {direction}, c.clan_id {direction}"
+    if limit is not None:
+        sql += " LIMIT ?limit?"
+        param["limit"] = limit
+    return sql, param
+
+
+@timed_query
+def get_available_clans(limit: int = None, sort: str = "clan_id", descending: bool = False, after: tuple = None,
+                        min_members: int = None, max_members: int = None, leader_wallet: str = None):
+    """Get available clans with member counts, one keyset page at a time.
+
+    `after` is the (sort value, clan_id) of the last row of the previous page.
+    Without a limit every matching clan is returned.
+    """
+    sql, param = available_clans_query(limit, sort, descending, after, min_members, max_members, leader_wallet)
+    with connection_pool.connection() as conn:
+        return compiled(sql).records(conn, param)
+
+
+@timed_query
 def get_user_clan(user_id: int):
     """Get the clan a user belongs to"""
     try:
-        with connect(connection_string) as commands:
-            # First check if user is in a clan
-            user_check = commands.query_single(
-                "SELECT clan_id FROM Users WHERE user_id = ?user_id?",
-                param={"user_id": user_id}
-            )
-            
-            if not user_check or user_check.get("clan_id") is None:
+        with connection_pool.connection() as conn:
+            clan_id = USER_CLAN_ID.scalar(conn, {"user_id": user_id})
+            if clan_id is None:
                 return None
-                
-            # Now get the clan details
-            clan = commands.query_single(
-                """
-                SELECT c.*, u.username as leader_name, u.wallet_address as leader_wallet,
-                    (SELECT COUNT(*) FROM Users WHERE clan_id = c.clan_id) as member_count
-                FROM Clans c
-                JOIN Users u ON c.clan_leader_id = u.user_id
-                WHERE c.clan_id = ?clan_id?
-                """,
-                param={"clan_id": user_check["clan_id"]}
-            )
-            return clan
+            return CLAN_BY_ID.record(conn, {"clan_id": clan_id})
     except Exception as e:
         print(f"Error in get_user_clan: {str(e)}")
         return None
 
+@timed_query
+def get_wallet_context(wallet_address: str):
+    """Get a user's ID together with their clan (if any) in one query; None if the wallet is unknown"""
+    with connection_pool.connection() as conn:
+        return WALLET_CONTEXT.record(conn, {"wallet_address": wallet_address})
+
+@timed_query
+def get_clan_versions(clan_ids: list) -> dict:
+    """clan_id -> version counter, 0 for clans that were never written; clan_id 0 is the whole listing"""
+    with connection_pool.connection() as conn:
+        versions = dict(CLAN_VERSIONS.rows(conn, {"clan_ids": json.dumps(clan_ids)}))
+    return {clan_id: versions.get(clan_id, 0) for clan_id in clan_ids}
+
+@timed_query
 def get_clan_members(clan_id: int):
     """Get all members of a clan"""
-    with connect(connection_string) as commands:
-        members = commands.query(
-            """
-            SELECT user_id, wallet_address, username, profile_image, created_at
-            FROM Users
-            WHERE clan_id = ?clan_id?
-            """,
-            param={"clan_id": clan_id}
-        )
-        return members
-
-def remove_user_from_clan(user_id: int):
+    with connection_pool.connection() as conn:
+        return CLAN_MEMBERS.records(conn, {"clan_id": clan_id})
+
+@timed_query
+def get_clans_batch(after_clan_id: int, batch_size: int):
+    """Get the next batch of clans after a clan ID, for exports"""
+    with connection_pool.connection() as conn:
+        return CLANS_BATCH.records(conn, {"after_clan_id": after_clan_id, "batch_size": batch_size})
+
+
+@timed_query
+def get_clan_scores_batch(after_clan_id: int, batch_size: int) -> list:
+    """(clan_id, clan_name, member_count, invites_redeemed) for the next clans after a clan ID"""
+    with connection_pool.connection() as conn:
+        return CLAN_SCORES_BATCH.rows(conn, {"after_clan_id": after_clan_id, "batch_size": batch_size})
+
+
+@timed_query
+def get_clan_scores(clan_ids: list) -> list:
+    """(clan_id, clan_name, member_count, invites_redeemed) for the listed clans that exist"""
+    with connection_pool.connection() as conn:
+        return CLAN_SCORES.rows(conn, {"clan_ids": json.dumps(clan_ids)})
+
+
+@timed_query
+def get_clan_members_batch(clan_id: int, after_user_id: int, batch_size: int):
+    """Get the next batch of a clan's members after a user ID, for exports"""
+    with connection_pool.connection() as conn:
+        return CLAN_MEMBERS_BATCH.records(
+            conn, {"clan_id": clan_id, "after_user_id": after_user_id, "batch_size": batch_size})
+
+@queued_write
+def remove_user_from_clan(conn, user_id: int):
     """Remove a user from their clan by setting clan_id to NULL"""
-    with connect(connection_string) as commands:
-        commands.execute(
-            "UPDATE Users SET clan_id = NULL, updated_at = ?updated_at? WHERE user_id = ?user_id?",
-            param={
-                "updated_at": datetime.now(),
-                "user_id": user_id
-            }
-        )
+    LEAVE_CLAN.run(conn, {"updated_at": datetime.now(), "user_id": user_id})
+
+
+def _users_by_wallet(conn, wallet_addresses: list) -> dict:
+    """wallet_address -> (user_id, clan_id) for the wallets that exist"""
+    rows = USERS_BY_WALLETS.rows(conn, {"wallets": json.dumps(wallet_addresses)})
+    return {wallet: (user_id, clan_id) for wallet, user_id, clan_id in rows}
+
+
+@queued_write
+def add_users_to_clan(conn, clan_id: int, wallet_addresses: list) -> dict:
+    """Put every listed wallet that is in no clan into the clan with one UPDATE.
+
+    Returns wallet_address -> "added", "already_member", "in_another_clan", "clan_full" or "not_found",
+    or "clan_not_found" for every wallet if the clan no longer exists.
+    """
+    # Runs on the writer, so nothing can change these rows between the read and the UPDATE
+    member_count = CLAN_MEMBER_COUNT.scalar(conn, {"clan_id": clan_id})
+    if member_count is None:
+        return {wallet: "clan_not_found" for wallet in wallet_addresses}
+    users = _users_by_wallet(conn, wallet_addresses)
+    room = None
+    if max_clan_members is not None:
+        room = max_clan_members - member_count
+    results = {}
+    for wallet in dict.fromkeys(wallet_addresses):  # a wallet listed twice takes one place
+        if wallet not in users:
+            results[wallet] = "not_found"
+        elif users[wallet][1] == clan_id:
+            results[wallet] = "already_member"
+        elif users[wallet][1] is not None:
+            results[wallet] = "in_another_clan"
+        elif room is not None and room <= 0:
+            results[wallet] = "clan_full"
+        else:
+            results[wallet] = "added"
+            if room is not None:
+                room -= 1
+
+    added = [wallet for wallet, status in results.items() if status == "added"]
+    if added:
+        ADD_USERS_TO_CLAN.run(conn, {"clan_id": clan_id, "updated_at": datetime.now(), "wallets": json.dumps(added)})
+    return results
+
+
+@queued_write
+def remove_users_from_clan(conn, clan_id: int, wallet_addresses: list) -> dict:
+    """Take every listed member except the leader out of the clan with one UPDATE.
+
+    Returns wallet_address -> "removed", "is_leader", "not_member" or "not_found".
+    """
+    leader_id = CLAN_LEADER.scalar(conn, {"clan_id": clan_id})
+    users = _users_by_wallet(conn, wallet_addresses)
+    results = {}
+    for wallet in wallet_addresses:
+        if wallet not in users:
+            results[wallet] = "not_found"
+        elif users[wallet][1] != clan_id:
+            results[wallet] = "not_member"
+        elif users[wallet][0] == leader_id:
+            results[wallet] = "is_leader"
+        else:
+            results[wallet] = "removed"
+
+    removed = [wallet for wallet, status in results.items() if status == "removed"]
+    if removed:
+        REMOVE_USERS_FROM_CLAN.run(
+            conn, {"clan_id": clan_id, "updated_at": datetime.now(), "wallets": json.dumps(removed)})
+    return results
+
+
+@queued_write
+def disband_clan(conn, clan_id: int) -> list:
+    """Remove every member, the clan's invite codes and the clan itself in one transaction.
+
+    Returns the wallet addresses of the former members.
+    """
+    members = [wallet for wallet, in CLAN_MEMBER_WALLETS.rows(conn, {"clan_id": clan_id})]
+    CLEAR_CLAN_MEMBERS.run(conn, {"clan_id": clan_id, "updated_at": datetime.now()})
+    DELETE_CLAN_INVITES.run(conn, {"clan_id": clan_id})
+    DELETE_CLAN.run(conn, {"clan_id": clan_id})
+    return members
+
 
+@timed_query
 def is_clan_leader(user_id: int, clan_id: int) -> bool:
     """Check if a user is the leader of a specific clan"""
-    with connect(connection_string) as commands:
-        clan = commands.query_single(
-            "SELECT clan_leader_id FROM Clans WHERE clan_id = ?clan_id?",
-            param={"clan_id": clan_id}
-        )
-        return clan and str(clan["clan_leader_id"]) == str(user_id)
\ No newline at end of file
+    with connection_pool.connection() as conn:
+        leader_id = CLAN_LEADER.scalar(conn, {"clan_id": clan_id})
+    return leader_id is not None and str(leader_id) == str(user_id)
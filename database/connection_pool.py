@@ -0,0 +1,161 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from database.connection_string import (
+    connection_string,
+    pool_size,
+    pool_timeout,
+    pool_health_check_interval,
+    read_pragmas,
+)
+
+# Prepared statements kept per connection by the driver: room for every registered
+# statement plus the runtime-built clan listing shapes
+STATEMENT_CACHE_SIZE = 256
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection became free within the pool timeout"""
+
+
+def sqlite_path(dsn: str) -> str:
+    """Turn a pydapper sqlite DSN (sqlite://clansaga.db) into a sqlite3 database path"""
+    if "://" not in dsn:
+        return dsn
+    return dsn.split("://", 1)[1]
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of SQLite connections shared by the query modules.
+
+    The shared pool only serves reads; writes go through database.write_queue.
+    """
+
+    def __init__(self, dsn: str, size: int, timeout: float, health_check_interval: float, pragmas: dict = None):
+        self.database = sqlite_path(dsn)
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pragmas = dict(pragmas or {})
+
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []  # stack of (connection, last_used) so the warmest connection is reused first
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "in_use": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection and apply the configured PRAGMAs"""
+        conn = sqlite3.connect(self.database, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._stats["created"] += 1
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._stats["discarded"] += 1
+
+    def acquire(self) -> sqlite3.Connection:
+        """Check a connection out of the pool, waiting up to the pool timeout for a free slot"""
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeoutError(f"No database connection available after {self.timeout}s")
+        waited = time.perf_counter() - started
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    conn = self._connect()
+                    break
+                candidate, last_used = idle
+                if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(candidate):
+                    conn = candidate
+                else:
+                    self._discard(candidate)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool, rolling back anything left uncommitted"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+
+        with self._lock:
+            self._stats["in_use"] -= 1
+            if healthy:
+                self._idle.append((conn, time.monotonic()))
+        if not healthy:
+            self._discard(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a raw sqlite3 connection for the duration of the block"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self) -> dict:
+        """Snapshot of the pool counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+        stats["size"] = self.size
+        return stats
+
+    def close_all(self):
+        """Close every idle connection, e.g. on shutdown"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+connection_pool = ConnectionPool(
+    connection_string,
+    size=pool_size,
+    timeout=pool_timeout,
+    health_check_interval=pool_health_check_interval,
+    pragmas=read_pragmas,
+)
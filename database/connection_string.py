@@ -1,2 +1,81 @@
 """insert database connection string here check pydapper for connection string template"""
-connection_string = "sqlite://clansaga.db"
\ No newline at end of file
+import os
+
+connection_string = os.getenv("CLANSAGA_DATABASE_URL", "sqlite://clansaga.db")
+
+# Connection pool settings shared by every query module
+pool_size = int(os.getenv("CLANSAGA_DB_POOL_SIZE", "8"))
+pool_timeout = float(os.getenv("CLANSAGA_DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+pool_health_check_interval = float(os.getenv("CLANSAGA_DB_POOL_HEALTH_CHECK", "30"))  # idle seconds before re-checking
+
+# Group commit: the writer thread commits up to write_batch_size queued writes at once,
+# waiting at most write_max_latency seconds after the first for more to arrive
+write_batch_size = int(os.getenv("CLANSAGA_WRITE_BATCH_SIZE", "128"))
+write_max_latency = float(os.getenv("CLANSAGA_WRITE_MAX_LATENCY", "0.002"))
+
+# Slow-query log: statement calls slower than the threshold (seconds) are kept, with their
+# query plan, in a ring buffer of slow_query_log_size entries and appended to
+# slow_query_log_file when it is set. Parameter values are replaced by their types
+# unless CLANSAGA_SLOW_QUERY_REDACT=0.
+slow_query_threshold = float(os.getenv("CLANSAGA_SLOW_QUERY_THRESHOLD", "0.1"))
+slow_query_log_size = int(os.getenv("CLANSAGA_SLOW_QUERY_LOG_SIZE", "200"))
+slow_query_log_file = os.getenv("CLANSAGA_SLOW_QUERY_LOG_FILE") or None
+slow_query_redact = os.getenv("CLANSAGA_SLOW_QUERY_REDACT", "1") not in ("0", "false", "False")
+
+# Storage profiles, selected with CLANSAGA_STORAGE_PROFILE. Every setting can also be
+# overridden on its own, e.g. CLANSAGA_DB_SYNCHRONOUS=FULL.
+#   durable: WAL so readers never wait for the writer, and an fsync on every commit
+#   fast:    WAL with fsync only at checkpoints; a power loss can drop the last
+#            commits but never corrupts the database. Larger cache and mmap
+#   legacy:  the rollback journal SQLite uses by default
+STORAGE_PROFILES = {
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16000,  # KiB
+        "mmap_size": 0,
+        "busy_timeout": 5000,  # ms
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 268435456,  # bytes
+        "busy_timeout": 5000,
+    },
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "busy_timeout": 5000,
+    },
+}
+
+storage_profile = os.getenv("CLANSAGA_STORAGE_PROFILE", "durable")
+if storage_profile not in STORAGE_PROFILES:
+    raise ValueError(f"Unknown CLANSAGA_STORAGE_PROFILE {storage_profile!r}; expected one of {', '.join(STORAGE_PROFILES)}")
+
+storage_settings = {
+    name: os.getenv(f"CLANSAGA_DB_{name.upper()}", value)
+    for name, value in STORAGE_PROFILES[storage_profile].items()
+}
+
+# PRAGMAs for the pooled read connections; query_only makes any stray write fail loudly
+read_pragmas = {
+    "foreign_keys": "ON",
+    "query_only": "ON",
+    "cache_size": storage_settings["cache_size"],
+    "mmap_size": storage_settings["mmap_size"],
+    "busy_timeout": storage_settings["busy_timeout"],
+}
+
+# PRAGMAs for the single writer connection; journal_mode is persisted in the database file
+write_pragmas = {
+    "foreign_keys": "ON",
+    "journal_mode": storage_settings["journal_mode"],
+    "synchronous": storage_settings["synchronous"],
+    "cache_size": storage_settings["cache_size"],
+    "mmap_size": storage_settings["mmap_size"],
+    "busy_timeout": storage_settings["busy_timeout"],
+}
@@ -1,26 +1,35 @@
+"""Streams users from a CSV file (wallet_address, username, profile_image, created_at, updated_at)
+into the database in chunked transactions, generating a referral code for each new user.
+"""
+import argparse
 import csv
-from pydapper import connect
-from database.database_queries import fetch_user_by_email
-from services.referral_system import referral_code_handler
-from database.connection_string import connection_string
+from services.bulk_registration import register_users, bulk_chunk_size
 
-"""inserts list of users into database and calls referral_code_handler to generate referral codes"""
+CSV_COLUMNS = ("wallet_address", "username", "profile_image", "created_at", "updated_at")
 
 
-def insert_users_from_csv(csv_filename):
-    with open(csv_filename, 'r') as csvfile:
-        users = csv.DictReader(csvfile)
+def read_users(csvfile):
+    """Yield one user dict per CSV row"""
+    users = csv.DictReader(csvfile)
+    users.fieldnames = [name.strip() for name in users.fieldnames or []]
+    if "wallet_address" not in users.fieldnames:
+        raise ValueError(f"CSV must have a wallet_address column, got {users.fieldnames}")
+    for user in users:
+        yield {column: (user.get(column) or None) for column in CSV_COLUMNS}
 
-        for user in users:
-            with connect(connection_string) as commands:
-                commands.execute(
-                    "insert into users(first_name, last_name,phone, email,token, created_at, updated_at ) values("
-                    "?first_name?, ?last_name?, ?phone?, ?email?, ?token?, ?created_at?, ?updated_at?)",
-                    param={"first_name": user["first_name"], "last_name": user["last_name"], "phone": user["phone"],
-                           "email": user["email"], "token": user["token"], "created_at": user["created_at"],
-                           "updated_at": user["updated_at "]})
 
-            referral_code_handler(fetch_user_by_email(user["email"]))
+def print_progress(received: int, registered: int):
+    print(f"processed {received} rows, registered {registered} users", flush=True)
 
 
-insert_users_from_csv("dummy-data.csv")
+def insert_users_from_csv(csv_filename, chunk_size: int = bulk_chunk_size, progress=print_progress) -> dict:
+    with open(csv_filename, 'r', newline='') as csvfile:
+        return register_users(read_users(csvfile), chunk_size=chunk_size, progress=progress)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import users from a CSV file")
+    parser.add_argument("csv_filename")
+    parser.add_argument("--chunk-size", type=int, default=bulk_chunk_size)
+    args = parser.parse_args()
+    print(insert_users_from_csv(args.csv_filename, chunk_size=args.chunk_size))
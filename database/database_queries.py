@@ -1,120 +1,298 @@
 import datetime
+import json
 
-from pydapper import connect
-from database.connection_string import connection_string
+from database.connection_pool import connection_pool
+from database.statements import statement
+from database.write_queue import queued_write
+from services.metrics import timed_query
 from models.user_models import User
 
+USER_ID_BY_WALLET = statement(
+    "database_queries.user_exists",
+    "SELECT user_id FROM Users WHERE wallet_address = ?wallet_address?")
 
+INSERT_USER = statement(
+    "database_queries.insert_user",
+    """
+    INSERT INTO Users(wallet_address, username, profile_image, created_at, updated_at)
+    VALUES(?wallet_address?, ?username?, ?profile_image?, ?created_at?, ?updated_at?)
+    """)
+
+EXISTING_WALLETS = statement(
+    "database_queries.insert_users_batch.existing",
+    "SELECT wallet_address FROM Users WHERE wallet_address IN (SELECT value FROM json_each(?wallets?))")
+
+USER_IDS_BY_WALLETS = statement(
+    "database_queries.insert_users_batch.user_ids",
+    "SELECT user_id FROM Users WHERE wallet_address IN (SELECT value FROM json_each(?wallets?))")
+
+INSERT_REFERRAL_CODE = statement(
+    "database_queries.store_referral_code",
+    """
+    INSERT INTO Referrals (referral_code, created_at, user_id, is_active, expires_at)
+    VALUES(?referral_code?, ?created_at?, ?user_id?, ?is_active?, ?expires_at?)
+    """)
+
+ACTIVE_REFERRAL_CODES = statement(
+    "database_queries.fetch_referral_code",
+    """
+    SELECT referral_code
+    FROM Users INNER JOIN Referrals ON Users.user_id = Referrals.user_id
+    WHERE wallet_address = ?wallet_address? AND is_active = TRUE
+    AND (expires_at IS NULL OR expires_at > ?now?)
+    ORDER BY Referrals.created_at DESC
+    """)
+
+INACTIVATE_REFERRAL_CODE = statement(
+    "database_queries.inactivate_referral_token",
+    "UPDATE Referrals SET is_active = ?is_active? WHERE referral_code = ?referral_code?")
+
+# Compare-and-set: only a live personal code is redeemed, so a second redemption changes no
+# row. Clan invites are redeemed by joining the clan (clan_referral_system.redeem_clan_invite)
+REDEEM_REFERRAL_CODE = statement(
+    "database_queries.redeem_referral_code",
+    """
+    UPDATE Referrals SET is_active = FALSE, uses = uses + 1
+    WHERE referral_code = ?referral_code? AND clan_id IS NULL AND is_active = TRUE
+    AND (expires_at IS NULL OR expires_at > ?now?)
+    """)
+
+DEACTIVATE_EXPIRED_REFERRAL_CODES = statement(
+    "database_queries.deactivate_expired_referral_codes",
+    """
+    UPDATE Referrals SET is_active = FALSE
+    WHERE referral_code_id IN (
+        SELECT referral_code_id FROM Referrals
+        WHERE is_active = TRUE AND expires_at <= ?now?
+        LIMIT ?batch_size?
+    )
+    """)
+
+DELETE_REFERRAL_CODE = statement(
+    "database_queries.delete_referral_token",
+    "DELETE FROM Referrals WHERE referral_code = ?referral_code?")
+
+# Live codes and the ones archive_inactive_referral_codes has moved out of Referrals
+ALL_REFERRAL_CODES = statement(
+    "database_queries.fetch_all_referral_codes",
+    """
+    SELECT referral_code, created_at, is_active, clan_id FROM (
+        SELECT Referrals.referral_code, Referrals.created_at, Referrals.is_active, Referrals.clan_id
+        FROM Users INNER JOIN Referrals ON Users.user_id = Referrals.user_id
+        WHERE wallet_address = ?wallet_address?
+        UNION ALL
+        SELECT referrals_archive.referral_code, referrals_archive.created_at, referrals_archive.is_active,
+               referrals_archive.clan_id
+        FROM Users INNER JOIN referrals_archive ON Users.user_id = referrals_archive.user_id
+        WHERE wallet_address = ?wallet_address?
+    )
+    ORDER BY created_at DESC
+    """)
+
+INACTIVE_REFERRAL_CODE_IDS = statement(
+    "database_queries.archive_inactive_referral_codes",
+    "SELECT referral_code_id FROM Referrals WHERE is_active = FALSE ORDER BY referral_code_id LIMIT ?batch_size?")
+
+ARCHIVE_REFERRAL_CODES = statement(
+    "database_queries.archive_inactive_referral_codes.copy",
+    """
+    INSERT INTO referrals_archive (referral_code_id, referral_code, created_at, is_active, user_id, clan_id,
+                                   expires_at, uses, max_uses, archived_at)
+    SELECT referral_code_id, referral_code, created_at, is_active, user_id, clan_id,
+           expires_at, uses, max_uses, ?archived_at?
+    FROM Referrals
+    WHERE referral_code_id IN (SELECT value FROM json_each(?referral_code_ids?))
+    """)
+
+DELETE_ARCHIVED_REFERRAL_CODES = statement(
+    "database_queries.archive_inactive_referral_codes.delete",
+    "DELETE FROM Referrals WHERE referral_code_id IN (SELECT value FROM json_each(?referral_code_ids?))")
+
+REFERRALS_BATCH = statement(
+    "database_queries.get_referrals_batch",
+    """
+    SELECT referral_code_id, referral_code, created_at, expires_at, is_active, user_id, clan_id
+    FROM Referrals
+    WHERE referral_code_id > ?after_referral_code_id?
+    ORDER BY referral_code_id
+    LIMIT ?batch_size?
+    """)
+
+ARCHIVED_REFERRALS_BATCH = statement(
+    "database_queries.get_archived_referrals_batch",
+    """
+    SELECT referral_code_id, referral_code, created_at, expires_at, is_active, user_id, clan_id, archived_at
+    FROM referrals_archive
+    WHERE referral_code_id > ?after_referral_code_id?
+    ORDER BY referral_code_id
+    LIMIT ?batch_size?
+    """)
+
+
+@timed_query
 def fetch_user_by_wallet(wallet_address: str) -> int:
     """Get user_id from wallet address"""
-    try:
-        with connect(connection_string) as commands:
-            user_id_dict = commands.query_single(
-                "SELECT user_id FROM Users WHERE wallet_address = ?wallet_address?", 
-                param={"wallet_address": wallet_address})
-            return user_id_dict["user_id"]
-    except Exception as e:
-        print(f"Error fetching user by wallet: {str(e)}")
+    with connection_pool.connection() as conn:
+        user_id = USER_ID_BY_WALLET.scalar(conn, {"wallet_address": wallet_address})
+    if user_id is None:
         raise ValueError(f"User with wallet address {wallet_address} not found")
+    return user_id
+
+
+@queued_write
+def insert_user(conn, user_details: User) -> int:
+    """Insert a new user into the database and return their ID"""
+    return INSERT_USER.execute(conn, {
+        "wallet_address": user_details.wallet_address,
+        "username": user_details.username,
+        "profile_image": user_details.profile_image,
+        "created_at": user_details.created_at,
+        "updated_at": user_details.updated_at
+    }).lastrowid
 
 
-def insert_user(user_details: User):
-    """Insert a new user into the database"""
-    with connect(connection_string) as commands:
-        commands.execute(
-            """
-            INSERT INTO Users(wallet_address, username, profile_image, created_at, updated_at) 
-            VALUES(?wallet_address?, ?username?, ?profile_image?, ?created_at?, ?updated_at?)
-            """,
-            param={
-                "wallet_address": user_details.wallet_address,
-                "username": user_details.username,
-                "profile_image": user_details.profile_image,
-                "created_at": user_details.created_at,
-                "updated_at": user_details.updated_at
-            })
+@queued_write
+def insert_users_batch(conn, users: list, referral_code_factory, referral_expires_at: datetime.datetime) -> list:
+    """Insert a batch of users in one transaction, each with a fresh referral code.
 
+    users are dicts with the Users columns; wallets that already exist (or repeat
+    within the batch) are skipped. Returns the wallet addresses that were inserted.
+    """
+    wallets = json.dumps([user["wallet_address"] for user in users])
+    existing = {row[0] for row in EXISTING_WALLETS.rows(conn, {"wallets": wallets})}
+    new_users = {}
+    for user in users:
+        if user["wallet_address"] not in existing:
+            new_users.setdefault(user["wallet_address"], user)
+    if not new_users:
+        return []
 
+    now = datetime.datetime.now()
+    INSERT_USER.run_many(conn, [{
+        "wallet_address": user["wallet_address"],
+        "username": user.get("username"),
+        "profile_image": user.get("profile_image"),
+        "created_at": user.get("created_at") or now,
+        "updated_at": user.get("updated_at") or now
+    } for user in new_users.values()])
+
+    user_ids = USER_IDS_BY_WALLETS.rows(conn, {"wallets": json.dumps(list(new_users))})
+    INSERT_REFERRAL_CODE.run_many(conn, [{
+        "referral_code": referral_code_factory(),
+        "created_at": now,
+        "user_id": user_id,
+        "is_active": True,
+        "expires_at": referral_expires_at
+    } for user_id, in user_ids])
+    return list(new_users)
+
+
+@timed_query
 def user_exists(wallet_address: str) -> bool:
     """Check if a user with the given wallet address exists"""
-    with connect(connection_string) as commands:
-        result = commands.query(
-            "SELECT user_id FROM Users WHERE wallet_address = ?wallet_address?", 
-            param={"wallet_address": wallet_address})
-        return len(result) > 0
+    with connection_pool.connection() as conn:
+        return USER_ID_BY_WALLET.row(conn, {"wallet_address": wallet_address}) is not None
 
 
+@timed_query
 def fetch_referral_code(wallet_address: str) -> str:
     """Get the referral code for a user"""
     if user_exists(wallet_address):
-        with connect(connection_string) as commands:
-            # Modified to get the most recent referral code
-            referral_codes = commands.query(
-                """
-                SELECT referral_code 
-                FROM Users INNER JOIN Referrals ON Users.user_id = Referrals.user_id 
-                WHERE wallet_address = ?wallet_address? AND is_active = TRUE
-                ORDER BY Referrals.created_at DESC
-                """,
-                param={"wallet_address": wallet_address})
-            
-            if not referral_codes:
-                raise ValueError("No active referral codes found for this wallet")
-            
-            # Return the most recent referral code
-            return referral_codes[0]["referral_code"]
+        with connection_pool.connection() as conn:
+            # The most recent active code
+            referral_code = ACTIVE_REFERRAL_CODES.scalar(
+                conn, {"wallet_address": wallet_address, "now": datetime.datetime.now()})
+
+        if referral_code is None:
+            raise ValueError("No active referral codes found for this wallet")
+        return referral_code
     else:
         raise ValueError(f"User with wallet address {wallet_address} does not exist")
 
 
-def store_referral_code(referral_code, user_id: int):
+@queued_write
+def store_referral_code(conn, referral_code, user_id: int, expires_at: datetime.datetime = None):
     """Store a referral code for a user"""
-    with connect(connection_string) as commands:
-        commands.execute(
-            """
-            INSERT INTO Referrals (referral_code, created_at, user_id, is_active) 
-            VALUES(?referral_code?, ?created_at?, ?user_id?, ?is_active?)
-            """,
-            param={
-                "referral_code": referral_code, 
-                "created_at": datetime.datetime.now(), 
-                "user_id": user_id,
-                "is_active": True
-            })
-
-
-def inactivate_referral_token(code):
+    INSERT_REFERRAL_CODE.run(conn, {
+        "referral_code": referral_code,
+        "created_at": datetime.datetime.now(),
+        "user_id": user_id,
+        "is_active": True,
+        "expires_at": expires_at
+    })
+
+
+@queued_write
+def inactivate_referral_token(conn, code):
     """Mark a referral code as inactive"""
-    with connect(connection_string) as commands:
-        commands.execute(
-            "UPDATE Referrals SET is_active = ?is_active? WHERE referral_code = ?referral_code?",
-            param={"is_active": False, "referral_code": code})
+    INACTIVATE_REFERRAL_CODE.run(conn, {"is_active": False, "referral_code": code})
+
+
+@queued_write
+def redeem_referral_code(conn, code: str) -> bool:
+    """Use up a live personal referral code; returns False if it is unknown, a clan invite or no longer live"""
+    return REDEEM_REFERRAL_CODE.run(conn, {"referral_code": code, "now": datetime.datetime.now()}) == 1
+
 
+@queued_write
+def deactivate_expired_referral_codes(conn, now: datetime.datetime, batch_size: int) -> int:
+    """Mark up to batch_size expired referral codes as inactive and return how many were updated"""
+    return DEACTIVATE_EXPIRED_REFERRAL_CODES.run(conn, {"now": now, "batch_size": batch_size})
 
-def delete_referral_token(code):
+
+@queued_write
+def archive_inactive_referral_codes(conn, archived_at: datetime.datetime, batch_size: int) -> int:
+    """Move up to batch_size inactive referral codes into referrals_archive and return how many moved"""
+    ids = [row[0] for row in INACTIVE_REFERRAL_CODE_IDS.rows(conn, {"batch_size": batch_size})]
+    if ids:
+        param = {"referral_code_ids": json.dumps(ids)}
+        ARCHIVE_REFERRAL_CODES.run(conn, dict(param, archived_at=archived_at))
+        DELETE_ARCHIVED_REFERRAL_CODES.run(conn, param)
+    return len(ids)
+
+
+@queued_write
+def incremental_vacuum(conn, max_pages: int) -> int:
+    """Hand up to max_pages free pages back to the filesystem and return how many were freed.
+
+    Does nothing unless the database uses auto_vacuum=INCREMENTAL (see init_db --vacuum).
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    pages = min(conn.execute("PRAGMA freelist_count").fetchone()[0], max_pages)
+    for _ in range(pages):
+        # sqlite3 steps a PRAGMA only once per execute, and each step frees one page
+        conn.execute("PRAGMA incremental_vacuum(1)")
+    return pages
+
+
+@queued_write
+def delete_referral_token(conn, code):
     """Delete a referral code"""
-    with connect(connection_string) as commands:
-        commands.execute(
-            "DELETE FROM Referrals WHERE referral_code = ?referral_code?",
-            param={"referral_code": code})
-        
+    DELETE_REFERRAL_CODE.run(conn, {"referral_code": code})
+
+
+@timed_query
 def fetch_all_referral_codes(wallet_address: str) -> list:
     """Get all referral codes for a user"""
     if user_exists(wallet_address):
-        with connect(connection_string) as commands:
-            referral_codes = commands.query(
-                """
-                SELECT referral_code, created_at, is_active, clan_id 
-                FROM Users INNER JOIN Referrals ON Users.user_id = Referrals.user_id 
-                WHERE wallet_address = ?wallet_address?
-                ORDER BY Referrals.created_at DESC
-                """,
-                param={"wallet_address": wallet_address})
-            
-            return referral_codes
+        with connection_pool.connection() as conn:
+            return ALL_REFERRAL_CODES.records(conn, {"wallet_address": wallet_address})
     else:
         raise ValueError(f"User with wallet address {wallet_address} does not exist")
 
 
+@timed_query
+def get_referrals_batch(after_referral_code_id: int, batch_size: int) -> list:
+    """Get the next batch of Referrals rows after a referral_code_id, for exports"""
+    with connection_pool.connection() as conn:
+        return REFERRALS_BATCH.records(
+            conn, {"after_referral_code_id": after_referral_code_id, "batch_size": batch_size})
 
 
+@timed_query
+def get_archived_referrals_batch(after_referral_code_id: int, batch_size: int) -> list:
+    """Get the next batch of referrals_archive rows after a referral_code_id, for exports"""
+    with connection_pool.connection() as conn:
+        return ARCHIVED_REFERRALS_BATCH.records(
+            conn, {"after_referral_code_id": after_referral_code_id, "batch_size": batch_size})
@@ -0,0 +1,161 @@
+"""Fills the database with synthetic Users, Clans and Referrals for load and scaling tests.
+
+The same seed and as_of always produce the same data; rows are appended after
+whatever is already there.
+"""
+import argparse
+import base64
+import bisect
+import itertools
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from database.connection_pool import sqlite_path
+from database.connection_string import connection_string
+from init_db import migrate
+
+CHUNK_SIZE = 200000  # rows per transaction
+
+
+def zipf_cum_weights(count: int, exponent: float) -> list:
+    """Cumulative weights where rank r is chosen with probability proportional to 1 / r**exponent"""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def timestamp(rng: random.Random, now: datetime, days: int) -> str:
+    """A time in the last `days` days, in the format sqlite3 stores datetimes in"""
+    return (now - timedelta(seconds=rng.random() * days * 86400)).isoformat(" ")
+
+
+def referral_code(rng: random.Random) -> str:
+    return base64.urlsafe_b64encode(rng.getrandbits(64).to_bytes(8, "little")).rstrip(b"=").decode()
+
+
+def insert_chunked(conn: sqlite3.Connection, sql: str, rows, label: str, total: int):
+    """executemany in CHUNK_SIZE transactions, printing progress after each"""
+    done = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        with conn:
+            conn.executemany(sql, chunk)
+        done += len(chunk)
+        print(f"{label}: {done}/{total}", flush=True)
+
+
+def generate_dataset(database: str, users: int, clans: int, referrals: int, seed: int = 1,
+                     distribution: str = "zipf", zipf_exponent: float = 1.1, member_ratio: float = 0.6,
+                     invite_ratio: float = 0.2, active_ratio: float = 0.7, days: int = 365,
+                     as_of: datetime = None) -> dict:
+    """Append the requested number of rows; returns how many of each were written.
+
+    Every clan has a leader; member_ratio of the other users are spread over the clans
+    uniformly or by a Zipf distribution (a few huge clans, a long tail of small ones).
+    invite_ratio of the codes are clan invites, the rest personal referral codes, and
+    active_ratio of all codes are still valid while the rest expired and were swept.
+    Times are relative to as_of (default now); pass it too to reproduce a dataset exactly.
+    """
+    if clans > users:
+        raise ValueError("Every clan needs its own leader, so clans cannot exceed users")
+    migrate(database)
+    rng = random.Random(seed)
+    now = as_of or datetime.now()
+
+    conn = sqlite3.connect(database)
+    conn.execute("PRAGMA foreign_keys = ON")
+    # Bulk load settings for this connection only; a crash loses at most the open chunk
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    try:
+        first_user = conn.execute("SELECT COALESCE(MAX(user_id), 0) FROM Users").fetchone()[0] + 1
+        first_clan = conn.execute("SELECT COALESCE(MAX(clan_id), 0) FROM Clans").fetchone()[0] + 1
+        leaders = range(first_user, first_user + clans)
+        clan_ids = list(range(first_clan, first_clan + clans))
+
+        def user_row(user_id, clan_id):
+            created_at = timestamp(rng, now, days)
+            username = f"player{user_id}" if rng.random() < 0.5 else None
+            wallet = f"0x{rng.getrandbits(96):024x}{user_id:016x}"
+            return user_id, wallet, username, created_at, created_at, clan_id
+
+        # Ids are assigned here from MAX(id) + 1 rather than left to AUTOINCREMENT, so the
+        # leader and clan rows below know each other's ids before they are inserted
+        insert_user = ("INSERT INTO Users (user_id, wallet_address, username, created_at, updated_at, clan_id) "
+                       "VALUES (?, ?, ?, ?, ?, ?)")
+        # Leaders join their clan once it exists, so the member_count triggers see it
+        insert_chunked(conn, insert_user, (user_row(user_id, None) for user_id in leaders), "leaders", clans)
+        insert_chunked(conn, "INSERT INTO Clans (clan_id, clan_name, created_at, updated_at, clan_leader_id) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                       ((clan_id, f"Clan {clan_id}", created_at, created_at, leader)
+                        for clan_id, leader in zip(clan_ids, leaders)
+                        for created_at in (timestamp(rng, now, days),)),
+                       "clans", clans)
+        with conn:
+            conn.execute("UPDATE Users SET clan_id = user_id - ? WHERE user_id BETWEEN ? AND ?",
+                         (first_user - first_clan, first_user, first_user + clans - 1))
+
+        if clans and distribution == "zipf":
+            cum_weights = zipf_cum_weights(clans, zipf_exponent)
+        else:
+            cum_weights = list(range(1, clans + 1))
+
+        def pick_clan():
+            if not clans or rng.random() >= member_ratio:
+                return None
+            return clan_ids[bisect.bisect(cum_weights, rng.random() * cum_weights[-1])]
+
+        members = users - clans
+        insert_chunked(conn, insert_user,
+                       (user_row(user_id, pick_clan()) for user_id in range(first_user + clans, first_user + users)),
+                       "users", members)
+
+        def referral_row():
+            if clans and rng.random() < invite_ratio:
+                clan_index = rng.randrange(clans)
+                user_id, clan_id = first_user + clan_index, clan_ids[clan_index]
+            else:
+                user_id, clan_id = first_user + rng.randrange(users), None
+            created_at = now - timedelta(seconds=rng.random() * days * 86400)
+            if rng.random() < active_ratio:
+                is_active, expires_at = True, now + timedelta(seconds=rng.random() * 7 * 86400)
+            else:
+                is_active, expires_at = False, created_at + timedelta(days=7)
+            return (referral_code(rng), created_at.isoformat(" "), is_active, user_id, clan_id,
+                    expires_at.isoformat(" "))
+
+        insert_chunked(conn, "INSERT INTO Referrals "
+                             "(referral_code, created_at, is_active, user_id, clan_id, expires_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                       (referral_row() for _ in range(referrals)), "referrals", referrals)
+    finally:
+        conn.close()
+    return {"users": users, "clans": clans, "referrals": referrals}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill the database with synthetic users, clans and referral codes")
+    parser.add_argument("--database", default=sqlite_path(connection_string), help="SQLite file to fill")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--clans", type=int, default=1000)
+    parser.add_argument("--referrals", type=int, default=100000, help="referral codes and clan invites")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--distribution", choices=("zipf", "uniform"), default="zipf",
+                        help="how members are spread over clans")
+    parser.add_argument("--zipf-exponent", type=float, default=1.1)
+    parser.add_argument("--member-ratio", type=float, default=0.6, help="share of non-leaders that are in a clan")
+    parser.add_argument("--invite-ratio", type=float, default=0.2, help="share of codes that are clan invites")
+    parser.add_argument("--active-ratio", type=float, default=0.7, help="share of codes that have not expired")
+    parser.add_argument("--days", type=int, default=365, help="spread created_at over this many past days")
+    parser.add_argument("--as-of", type=datetime.fromisoformat, help="reference time instead of now, e.g. 2026-01-01")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    written = generate_dataset(args.database, args.users, args.clans, args.referrals, seed=args.seed,
+                               distribution=args.distribution, zipf_exponent=args.zipf_exponent,
+                               member_ratio=args.member_ratio, invite_ratio=args.invite_ratio,
+                               active_ratio=args.active_ratio, days=args.days, as_of=args.as_of)
+    print(f"{written} in {time.monotonic() - started:.1f}s")
@@ -0,0 +1,111 @@
+"""Slow-query log.
+
+Every registered statement is timed as it runs (see database.statements). A call
+that takes longer than slow_query_threshold is recorded along with its SQL, its
+parameters, the function that ran it and its EXPLAIN QUERY PLAN. Records go to an
+in-memory ring buffer, read through /api/admin/slow_queries, and optionally to a
+JSON-lines file. Fast calls only pay for two clock reads.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+from database.connection_string import (
+    slow_query_threshold,
+    slow_query_log_size,
+    slow_query_log_file,
+    slow_query_redact,
+)
+
+logger = logging.getLogger("slow_query_log")
+
+
+def is_full_scan(detail: str) -> bool:
+    """Whether one EXPLAIN QUERY PLAN line reads a whole table"""
+    # json_each is only a parameter list being unpacked, not a table
+    return (detail.startswith("SCAN") and "USING" not in detail
+            and "CONSTANT ROW" not in detail and "VIRTUAL TABLE" not in detail)
+
+
+def redact(param) -> object:
+    """Keep the parameter names but replace each value with its type"""
+    if isinstance(param, dict):
+        return {name: f"<{type(value).__name__}>" for name, value in param.items()}
+    return f"<{type(param).__name__}>"
+
+
+class SlowQueryLog:
+    """A bounded, thread-safe record of the slowest recent statement calls"""
+
+    def __init__(self, threshold: float, size: int, path: str = None, redact_params: bool = True):
+        self.threshold = threshold  # seconds
+        self.path = path
+        self.redact_params = redact_params
+        self._records = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._recorded = 0
+
+    def record(self, name: str, sql: str, conn: sqlite3.Connection, param, duration: float, caller: str):
+        """Store one slow call; the plan is explained on the connection the call ran on"""
+        if isinstance(param, (list, tuple)):
+            # run_many: explain the first row's parameters and log only how many rows there were
+            explained, param = (param[0] if param else {}), {"executions": len(param)}
+        else:
+            explained = param or {}
+        try:
+            plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", explained)]
+        except sqlite3.Error as e:
+            plan = [f"could not explain: {e}"]
+        entry = {
+            "recorded_at": datetime.now().isoformat(),
+            "statement": name,
+            "caller": caller,
+            "duration_ms": round(duration * 1000, 3),
+            "sql": " ".join(sql.split()),
+            "params": redact(param or {}) if self.redact_params else param,
+            "plan": plan,
+            "full_scan": any(is_full_scan(detail) for detail in plan),
+        }
+        with self._lock:
+            self._records.append(entry)
+            self._recorded += 1
+        logger.warning(f"Slow query {name} from {caller} took {entry['duration_ms']}ms")
+        if self.path:
+            self._append_to_file(entry)
+
+    def _append_to_file(self, entry: dict):
+        try:
+            line = json.dumps(entry, default=str)
+            with self._file_lock, open(self.path, "a") as log_file:
+                log_file.write(line + "\n")
+        except OSError as e:
+            logger.error(f"Could not write slow query log {self.path}: {str(e)}")
+
+    def records(self, limit: int = None) -> list:
+        """The most recent records, newest first"""
+        with self._lock:
+            records = list(reversed(self._records))
+        return records[:limit] if limit else records
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "recorded": self._recorded,
+                "buffered": len(self._records),
+                "threshold_ms": self.threshold * 1000,
+            }
+
+
+slow_query_log = SlowQueryLog(
+    slow_query_threshold,
+    slow_query_log_size,
+    path=slow_query_log_file,
+    redact_params=slow_query_redact,
+)
@@ -0,0 +1,111 @@
+"""Named SQL statements, compiled once at import.
+
+Queries are still written with pydapper's ?name? placeholders, but each one is
+rewritten to sqlite3's native :name style when it is registered. A call then goes
+straight to the driver: nothing is re-parsed, and the prepared statement is reused
+from the connection's statement cache. Rows come back as tuples, or as plain dicts
+for results that are returned to API clients.
+
+Each call is timed, and calls slower than the slow-query threshold are handed to
+database.slow_query_log together with the function that made them.
+"""
+import re
+import sqlite3
+import sys
+from functools import lru_cache
+from time import perf_counter
+from database.slow_query_log import slow_query_log
+
+PLACEHOLDER = re.compile(r"\?(\w+)\?")
+
+# name -> Statement for every registered query; init_db --check explains each of them
+STATEMENTS = {}
+
+
+class Statement:
+    """One SQL statement ready to run on a sqlite3 connection"""
+
+    __slots__ = ("name", "sql", "text")
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql  # as written, with ?name? placeholders
+        self.text = PLACEHOLDER.sub(r":\1", sql)
+
+    def execute(self, conn: sqlite3.Connection, param: dict = None) -> sqlite3.Cursor:
+        started = perf_counter()
+        cursor = conn.execute(self.text, param or {})
+        self._finished(conn, param, started)
+        return cursor
+
+    def rows(self, conn: sqlite3.Connection, param: dict = None) -> list:
+        """Every row as a tuple"""
+        started = perf_counter()
+        rows = conn.execute(self.text, param or {}).fetchall()
+        self._finished(conn, param, started)
+        return rows
+
+    def row(self, conn: sqlite3.Connection, param: dict = None):
+        """The first row as a tuple, or None"""
+        started = perf_counter()
+        row = conn.execute(self.text, param or {}).fetchone()
+        self._finished(conn, param, started)
+        return row
+
+    def scalar(self, conn: sqlite3.Connection, param: dict = None):
+        """The first column of the first row, or None"""
+        row = self.row(conn, param)
+        return row[0] if row is not None else None
+
+    def records(self, conn: sqlite3.Connection, param: dict = None) -> list:
+        """Every row as a dict keyed by column name"""
+        started = perf_counter()
+        cursor = conn.execute(self.text, param or {})
+        names = [column[0] for column in cursor.description]
+        records = [dict(zip(names, row)) for row in cursor]
+        self._finished(conn, param, started)
+        return records
+
+    def record(self, conn: sqlite3.Connection, param: dict = None):
+        """The first row as a dict, or None"""
+        started = perf_counter()
+        cursor = conn.execute(self.text, param or {})
+        row = cursor.fetchone()
+        self._finished(conn, param, started)
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def run(self, conn: sqlite3.Connection, param: dict = None) -> int:
+        """Execute a write and return the number of rows it changed"""
+        return self.execute(conn, param).rowcount
+
+    def run_many(self, conn: sqlite3.Connection, params: list) -> int:
+        """Execute a write once per parameter dict"""
+        started = perf_counter()
+        rowcount = conn.executemany(self.text, params).rowcount
+        self._finished(conn, params, started)
+        return rowcount
+
+    def _finished(self, conn: sqlite3.Connection, param, started: float):
+        duration = perf_counter() - started
+        if duration >= slow_query_log.threshold:
+            # Two frames up is whoever called the public method (scalar and run add one more)
+            caller = sys._getframe(2)
+            if caller.f_code.co_filename == __file__:
+                caller = caller.f_back
+            slow_query_log.record(self.name, self.text, conn, param, duration, caller.f_code.co_name)
+
+
+def statement(name: str, sql: str) -> Statement:
+    """Compile and register a named statement"""
+    if name in STATEMENTS:
+        raise ValueError(f"Statement {name} is already registered")
+    STATEMENTS[name] = Statement(name, sql)
+    return STATEMENTS[name]
+
+
+@lru_cache(maxsize=256)
+def compiled(sql: str) -> Statement:
+    """Compile SQL that is assembled at runtime, once per distinct shape"""
+    return Statement("dynamic", sql)
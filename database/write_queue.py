@@ -0,0 +1,162 @@
+"""Group commit for SQLite writes.
+
+SQLite only lets one connection write at a time, so writes made from many request
+threads queue on the database lock and each pays for its own commit. Functions
+decorated with queued_write instead run on a single writer thread that takes
+whatever writes are waiting (up to write_batch_size, or whatever arrives within
+write_max_latency of the first one) and applies them in one transaction with one
+commit. Each write runs in its own savepoint, so a write that fails is rolled back
+and reported to its caller without affecting the rest of the batch.
+"""
+import functools
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from database.connection_pool import sqlite_path
+from database.connection_string import connection_string, write_pragmas, write_batch_size, write_max_latency
+from services.metrics import timed_query
+
+logger = logging.getLogger("write_queue")
+
+_STOP = object()
+
+
+class WriteQueue:
+    """A single writer thread that commits queued writes in batches"""
+
+    def __init__(self, database: str, max_batch: int, max_latency: float, pragmas: dict = None):
+        self.database = database
+        self.max_batch = max_batch
+        self.max_latency = max_latency  # seconds to wait for more writes after the first
+        self.pragmas = dict(pragmas or {})
+        self._queue = queue.Queue()
+        self._thread = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stats = {"writes": 0, "failed_writes": 0, "batches": 0, "largest_batch": 0, "commit_time_total": 0.0}
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        """Queue func(conn, *args, **kwargs) and return a future resolved once it is committed"""
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Autocommit mode so the writer controls every transaction itself
+            self._conn = sqlite3.connect(self.database, isolation_level=None, check_same_thread=False)
+            for name, value in self.pragmas.items():
+                self._conn.execute(f"PRAGMA {name} = {value}")
+        return self._conn
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+            if stopping:
+                break
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _write_batch(self, batch: list):
+        outcomes = []
+        started = time.monotonic()
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            for future, func, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT queued_write")
+                try:
+                    outcomes.append((future, func(conn, *args, **kwargs), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO queued_write")
+                    outcomes.append((future, None, e))
+                conn.execute("RELEASE queued_write")
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Write batch of {len(batch)} failed: {str(e)}")
+            if self._conn is not None and self._conn.in_transaction:
+                self._conn.rollback()
+            for future, _, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["writes"] += len(outcomes)
+            self._stats["failed_writes"] += sum(1 for _, _, error in outcomes if error is not None)
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+            self._stats["commit_time_total"] += time.monotonic() - started
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        stats["max_batch"] = self.max_batch
+        stats["max_latency"] = self.max_latency
+        return stats
+
+    def close(self):
+        """Commit everything already queued and stop the writer; the next submit starts a new one"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(_STOP)
+        if thread is not None:
+            thread.join()
+
+
+write_queue = WriteQueue(
+    sqlite_path(connection_string),
+    max_batch=write_batch_size,
+    max_latency=write_max_latency,
+    pragmas=write_pragmas,
+)
+
+
+def queued_write(func):
+    """Run func(conn, ...) on the writer thread, where conn is the writer's sqlite3 connection.
+
+    Callers leave out the conn argument. A plain call blocks until the write is
+    committed and returns its result; func.submit(...) returns the future instead.
+    The time func takes on the writer thread is recorded like any other query.
+    """
+    func = timed_query(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return write_queue.submit(func, *args, **kwargs).result()
+
+    wrapper.submit = functools.partial(write_queue.submit, func)
+    return wrapper
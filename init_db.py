@@ -1,8 +1,23 @@
 #!/usr/bin/env python3
-import sqlite3
+import argparse
+import importlib
 import os
+import re
+import sqlite3
+from datetime import datetime
+from database.connection_string import connection_string, storage_settings
+from database.connection_pool import sqlite_path
+from database.slow_query_log import is_full_scan
+
+DATABASE_FILE = sqlite_path(connection_string)
 
-DATABASE_FILE = 'clansaga.db'
+# Modules whose registered statements are checked by --check
+QUERY_MODULES = [
+    "database.database_queries",
+    "database.clan_database_queries",
+    "services.referral_system",
+    "services.clan_referral_system",
+]
 
 # SQL to create the database schema
 CREATE_SCHEMA_SQL = """
@@ -41,29 +56,379 @@ CREATE TABLE IF NOT EXISTS Referrals(
 );
 """
 
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations(
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at DATE
+)
+"""
+
+# (version, description, upgrade function) in the order they must be applied.
+# Every step must be idempotent: databases created before the version table existed
+# replay all of them.
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    """Register an upgrade step"""
+    def register(upgrade):
+        MIGRATIONS.append((version, description, upgrade))
+        return upgrade
+    return register
+
+
+def run_script(cursor, script: str):
+    for statement in script.split(';'):
+        if statement.strip():
+            cursor.execute(statement)
+
+
+def column_exists(cursor, table: str, column: str) -> bool:
+    return column in {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+
+
+@migration(1, "Create Users, Clans and Referrals")
+def create_tables(cursor):
+    run_script(cursor, CREATE_SCHEMA_SQL)
+
+
+@migration(2, "Add Referrals.expires_at")
+def add_referral_expiry(cursor):
+    if not column_exists(cursor, "Referrals", "expires_at"):
+        cursor.execute("ALTER TABLE Referrals ADD COLUMN expires_at DATE")
+    cursor.execute("UPDATE Referrals SET expires_at = datetime(created_at, '+7 days') WHERE expires_at IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrals_active_expires ON Referrals(is_active, expires_at)")
+
+
+@migration(3, "Index Users.clan_id")
+def index_users_clan_id(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_clan_id ON Users(clan_id)")
+
+
+@migration(4, "Index Referrals.referral_code")
+def index_referral_code(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrals_code ON Referrals(referral_code)")
+
+
+@migration(5, "Index Referrals(user_id, created_at)")
+def index_referrals_user_created(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrals_user_created ON Referrals(user_id, created_at)")
+
+
+@migration(6, "Replace the expiry sweep index with a partial index on active codes")
+def partial_expiry_index(cursor):
+    # Keeps only live codes in the index, and stops the planner picking it over
+    # idx_referrals_code for "referral_code = ? AND is_active = TRUE" lookups
+    cursor.execute("DROP INDEX IF EXISTS idx_referrals_active_expires")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrals_expiry ON Referrals(expires_at) WHERE is_active = TRUE")
+
+
+# Keep Clans.member_count exact on every membership change, whichever code path makes it
+MEMBER_COUNT_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_users_member_count_insert
+    AFTER INSERT ON Users WHEN NEW.clan_id IS NOT NULL
+    BEGIN
+        UPDATE Clans SET member_count = member_count + 1 WHERE clan_id = NEW.clan_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_users_member_count_update
+    AFTER UPDATE OF clan_id ON Users WHEN OLD.clan_id IS NOT NEW.clan_id
+    BEGIN
+        UPDATE Clans SET member_count = member_count - 1 WHERE clan_id = OLD.clan_id;
+        UPDATE Clans SET member_count = member_count + 1 WHERE clan_id = NEW.clan_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_users_member_count_delete
+    AFTER DELETE ON Users WHEN OLD.clan_id IS NOT NULL
+    BEGIN
+        UPDATE Clans SET member_count = member_count - 1 WHERE clan_id = OLD.clan_id;
+    END
+    """,
+]
+
+RECONCILE_MEMBER_COUNTS_SQL = """
+UPDATE Clans SET member_count = (SELECT COUNT(*) FROM Users WHERE Users.clan_id = Clans.clan_id)
+WHERE member_count != (SELECT COUNT(*) FROM Users WHERE Users.clan_id = Clans.clan_id)
+"""
+
+
+@migration(7, "Add Clans.member_count maintained by triggers on Users")
+def add_member_count(cursor):
+    if not column_exists(cursor, "Clans", "member_count"):
+        cursor.execute("ALTER TABLE Clans ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0")
+    cursor.execute(RECONCILE_MEMBER_COUNTS_SQL)
+    for trigger in MEMBER_COUNT_TRIGGERS:
+        cursor.execute(trigger)
+
+
+@migration(8, "Index Clans.clan_leader_id")
+def index_clan_leader(cursor):
+    # With foreign_keys on, inserting a user probes Clans for children by clan_leader_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clans_leader ON Clans(clan_leader_id)")
+
+
+@migration(9, "Index Clans by created_at and member_count for keyset pagination")
+def index_clan_sort_orders(cursor):
+    # clan_id is the rowid, so each index already ends in the clan_id tiebreaker
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clans_created_at ON Clans(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clans_member_count ON Clans(member_count)")
+
+
+@migration(10, "Create cache_invalidations for cross-worker cache invalidation")
+def create_cache_invalidations(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_invalidations(
+            seq INTEGER PRIMARY KEY AutoIncrement,
+            scope TEXT NOT NULL,
+            cache_key TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            created_at DATE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_invalidations_created ON cache_invalidations(created_at)")
+
+
+@migration(11, "Index Referrals.clan_id")
+def index_referrals_clan(cursor):
+    # Disbanding deletes a clan's invite codes, and deleting the clan probes Referrals for children
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrals_clan ON Referrals(clan_id)")
+
+
+# Version counters behind the ETags of the clan read endpoints. Row 0 versions the clan
+# listing as a whole. Membership changes reach these through the member_count triggers,
+# which update Clans and so fire the Clans triggers too.
+CLAN_VERSION_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_clans_version_{event.lower()}
+    AFTER {event} ON Clans
+    BEGIN
+        INSERT INTO clan_versions (clan_id, version) VALUES ({row}.clan_id, 1), (0, 1)
+        ON CONFLICT(clan_id) DO UPDATE SET version = version + 1;
+    END
+    """
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))
+]
+
+
+@migration(12, "Create clan_versions maintained by triggers on Clans")
+def create_clan_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS clan_versions(
+            clan_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+    for trigger in CLAN_VERSION_TRIGGERS:
+        cursor.execute(trigger)
+
+
+@migration(13, "Add Clans.invites_redeemed")
+def add_invites_redeemed(cursor):
+    # Counted by redeem_clan_invite; redemptions made before this column existed were never recorded
+    if not column_exists(cursor, "Clans", "invites_redeemed"):
+        cursor.execute("ALTER TABLE Clans ADD COLUMN invites_redeemed INTEGER NOT NULL DEFAULT 0")
+
+
+@migration(14, "Index Referrals(clan_id, is_active) and add invite use counters")
+def index_active_clan_invites(cursor):
+    # Serves the reuse and per-clan cap lookups of generate_clan_invite_code, and every
+    # clan_id lookup idx_referrals_clan served before
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrals_clan_active ON Referrals(clan_id, is_active)")
+    cursor.execute("DROP INDEX IF EXISTS idx_referrals_clan")
+    if not column_exists(cursor, "Referrals", "uses"):
+        cursor.execute("ALTER TABLE Referrals ADD COLUMN uses INTEGER NOT NULL DEFAULT 0")
+    if not column_exists(cursor, "Referrals", "max_uses"):
+        # NULL means the code can be redeemed any number of times
+        cursor.execute("ALTER TABLE Referrals ADD COLUMN max_uses INTEGER")
+
+
+@migration(15, "Create referrals_archive for inactive codes")
+def create_referrals_archive(cursor):
+    # Inactive codes are moved here by the referral maintenance job so Referrals and its
+    # indexes only hold live codes. Ids are kept, and AUTOINCREMENT never reuses them
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS referrals_archive(
+            referral_code_id INTEGER PRIMARY KEY,
+            referral_code TEXT NOT NULL,
+            created_at DATE,
+            is_active boolean NOT NULL,
+            user_id INT NOT NULL,
+            clan_id INTEGER,
+            expires_at DATE,
+            uses INTEGER NOT NULL DEFAULT 0,
+            max_uses INTEGER,
+            archived_at DATE NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrals_archive_user_created "
+                   "ON referrals_archive(user_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrals_inactive ON Referrals(referral_code_id) "
+                   "WHERE is_active = FALSE")
+
+
+def connect(database: str) -> sqlite3.Connection:
+    # Autocommit mode so each migration controls its own transaction
+    conn = sqlite3.connect(database, isolation_level=None)
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA busy_timeout = 30000")
+    # Only takes effect on a new, empty database; --vacuum converts an existing one
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute(f"PRAGMA journal_mode = {storage_settings['journal_mode']}")
+    return conn
+
+
+def applied_versions(conn: sqlite3.Connection) -> set:
+    conn.execute(SCHEMA_VERSION_SQL)
+    return {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+
+
+def migrate(database: str = DATABASE_FILE) -> list:
+    """Apply every pending migration and return the versions that were applied.
+
+    Each step runs in its own short IMMEDIATE transaction, so on a live database an
+    index build only holds the write lock for that one index and readers keep going;
+    other writers wait on busy_timeout rather than failing. Every step re-checks
+    schema_migrations once it holds the lock, so workers migrating the same database at
+    startup apply each step exactly once between them.
+    """
+    conn = connect(database)
+    try:
+        done = applied_versions(conn)
+        applied = []
+        for version, description, upgrade in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version in done:
+                continue
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            # Another process may have applied this step while we waited for the write lock
+            if cursor.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone():
+                cursor.execute("COMMIT")
+                continue
+            try:
+                upgrade(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, datetime.now()))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            applied.append(version)
+            print(f"Applied migration {version}: {description}")
+        return applied
+    finally:
+        conn.close()
+
+
 def initialize_database():
     """Initialize the database with the required tables"""
     # Check if database file already exists
     db_exists = os.path.exists(DATABASE_FILE)
-    
-    # Connect to the database (creates the file if it doesn't exist)
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    
-    # Enable foreign keys
-    cursor.execute("PRAGMA foreign_keys = ON;")
-    
-    # Create tables
-    for statement in CREATE_SCHEMA_SQL.split(';'):
-        if statement.strip():
-            cursor.execute(statement)
-    
-    # Commit changes and close connection
-    conn.commit()
-    conn.close()
-    
+
+    migrate(DATABASE_FILE)
+
     print(f"{'Created' if not db_exists else 'Updated'} database: {DATABASE_FILE}")
 
 
+def reconcile_member_counts(database: str = DATABASE_FILE) -> int:
+    """Recount members for every clan whose member_count drifted and return how many were fixed"""
+    conn = connect(database)
+    try:
+        fixed = conn.execute(RECONCILE_MEMBER_COUNTS_SQL).rowcount
+    finally:
+        conn.close()
+    print(f"Repaired member_count for {fixed} clans")
+    return fixed
+
+
+def enable_incremental_vacuum(database: str = DATABASE_FILE) -> int:
+    """Switch the database to auto_vacuum=INCREMENTAL and return the size in bytes it shrank by.
+
+    The mode of an existing database only changes with a full VACUUM, which rewrites
+    the whole file and holds the write lock while it does, so run it in a quiet window.
+    Afterwards the referral maintenance job returns free pages in small steps.
+    """
+    size = os.path.getsize(database)
+    conn = connect(database)
+    try:
+        conn.execute("VACUUM")
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    finally:
+        conn.close()
+    shrunk = size - os.path.getsize(database)
+    print(f"auto_vacuum is {('NONE', 'FULL', 'INCREMENTAL')[mode]}; the file shrank by {shrunk} bytes")
+    return shrunk
+
+
+def collect_queries(modules=QUERY_MODULES) -> list:
+    """Every statement registered by the query modules.
+
+    Returns (name, sql) pairs where name is module.function.
+    """
+    from database.statements import STATEMENTS
+    for module in modules:
+        importlib.import_module(module)
+    queries = [(name, stmt.sql) for name, stmt in STATEMENTS.items()]
+
+    # Queries assembled at runtime are checked in each of their shapes
+    from database.clan_database_queries import CLAN_SORT_COLUMNS, available_clans_query
+    for sort in CLAN_SORT_COLUMNS:
+        sql, _ = available_clans_query(limit=50, sort=sort, after=(0, 0))
+        queries.append((f"clan_database_queries.get_available_clans[sort={sort}]", sql))
+    sql, _ = available_clans_query(limit=50, leader_wallet="")
+    queries.append(("clan_database_queries.get_available_clans[leader_wallet]", sql))
+    return queries
+
+
+def check_query_plans(database: str = DATABASE_FILE) -> int:
+    """Print EXPLAIN QUERY PLAN for every query and return how many contain a full table scan"""
+    conn = connect(database)
+    scans = 0
+    try:
+        for location, sql in collect_queries():
+            # pydapper ?name? placeholders become plain positional parameters bound to NULL
+            positional_sql = re.sub(r"\?(.*?)\?", "?", sql)
+            params = [None] * positional_sql.count("?")
+            print(location)
+            try:
+                plan = conn.execute(f"EXPLAIN QUERY PLAN {positional_sql}", params).fetchall()
+            except sqlite3.Error as e:
+                print(f"    could not explain: {e}")
+                continue
+            full_scan = False
+            for row in plan:
+                detail = row[-1]
+                is_scan = is_full_scan(detail)
+                full_scan = full_scan or is_scan
+                print(f"    {detail}{'    <-- full scan' if is_scan else ''}")
+            scans += full_scan
+    finally:
+        conn.close()
+    print(f"{scans} queries fall back to a full table scan")
+    return scans
+
+
 if __name__ == "__main__":
-    initialize_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create or upgrade the Clan Saga database")
+    parser.add_argument("--database", default=DATABASE_FILE, help="path to the sqlite database")
+    parser.add_argument("--check", action="store_true",
+                        help="report EXPLAIN QUERY PLAN for every query instead of migrating")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="recount Clans.member_count from Users and repair any drift")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="rebuild the file with auto_vacuum=INCREMENTAL so free pages can be returned")
+    args = parser.parse_args()
+
+    DATABASE_FILE = args.database
+    if args.check:
+        check_query_plans(args.database)
+    elif args.reconcile:
+        reconcile_member_counts(args.database)
+    elif args.vacuum:
+        enable_incremental_vacuum(args.database)
+    else:
+        initialize_database()
@@ -1,6 +1,6 @@
 from datetime import datetime
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 
 
 class User(BaseModel):
@@ -12,6 +12,10 @@ class User(BaseModel):
     clan_id: Optional[int] = None
 
 
+class BulkUserRegistration(BaseModel):
+    users: List[User]
+
+
 class Clan(BaseModel):
     clan_name: str
     clan_image: Optional[str] = None
@@ -26,6 +30,11 @@ class ClanCreation(BaseModel):
     creator_wallet: str
 
 
+class ClanMembersBatch(BaseModel):
+    leader_wallet: str
+    wallet_addresses: List[str]
+
+
 class JoinClan(BaseModel):
     wallet_address: str
     clan_id: Optional[int] = None
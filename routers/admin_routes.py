@@ -0,0 +1,36 @@
+import os
+import secrets
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header, Query, Depends
+from database.slow_query_log import slow_query_log
+
+# Every admin endpoint requires this in the X-Admin-Token header; while it is unset the
+# admin endpoints answer 404, since they expose SQL, query plans and callers
+ADMIN_TOKEN = os.getenv("CLANSAGA_ADMIN_TOKEN")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """FastAPI dependency: reject the request unless it carries the admin token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/slow_queries")
+async def slow_queries(limit: int = Query(50, ge=1, le=1000), full_scans_only: bool = False):
+    """The most recent slow statement calls, newest first, with their query plans"""
+    records = slow_query_log.records()
+    if full_scans_only:
+        records = [record for record in records if record["full_scan"]]
+    return {**slow_query_log.stats(), "slow_queries": records[:limit]}
+
+
+@router.delete("/slow_queries")
+async def clear_slow_queries():
+    """Empty the slow query buffer"""
+    slow_query_log.clear()
+    return {"message": "Slow query log cleared"}
@@ -1,44 +1,60 @@
-from fastapi import APIRouter, HTTPException, Response, Body
+import logging
+from fastapi import APIRouter, HTTPException, Request, Response, Body, Query, Depends
+from fastapi.responses import StreamingResponse
+from functools import partial
+from typing import Optional
 from datetime import datetime
-from models.user_models import Clan, ClanCreation, JoinClan
-from database.database_queries import (
-    user_exists, 
-    fetch_user_by_wallet
-)
-from database.clan_database_queries import (
-    is_user_in_clan, 
+from models.user_models import Clan, ClanCreation, JoinClan, ClanMembersBatch
+from database.async_queries import (
     insert_clan, 
-    get_clan_by_id,
     join_clan_by_id,
-    get_available_clans,
-    get_user_clan,
-    get_clan_id_by_invite_code,
     get_clan_members,
     remove_user_from_clan,
-    is_clan_leader,
+    generate_clan_invite_code,
+    redeem_clan_invite,
+    add_users_to_clan,
+    remove_users_from_clan,
+    disband_clan as disband_clan_by_id,
+    run_in_db_executor,
+)
+from routers.admin_routes import require_admin
+from services.pagination import encode_cursor, decode_cursor
+from services.export import stream_ndjson, NDJSON_MEDIA_TYPE
+from database.clan_database_queries import get_clans_batch, get_clan_members_batch
+from services.clan_cache import (
+    CACHE_TTL,
+    get_clan,
+    get_wallet_clan,
+    get_clans_page,
+    invalidate_membership,
+    listing_version,
+    clan_version,
+    cached_wallet_clan_version,
 )
-from services.referral_system import is_active_referral_code
-from services.clan_referral_system import generate_clan_invite_code
+from services.etags import make_etag, etag_matches, not_modified
+from services.leaderboard import leaderboard
+from services.json_response import FastJSONResponse, dumps, encoded_json_response
+from services.request_context import RequestContext, request_context
 from pydantic import BaseModel
-import time
 
 router = APIRouter()
+logger = logging.getLogger("clan_routes")
+
+MAX_BATCH_MEMBERS = 1000
 
-# Simple in-memory cache
-_cache = {}
-CACHE_TTL = 30  # seconds
 class LeaveClanRequest(BaseModel):
     wallet_address: str
 
 @router.post("/create_clan")
-async def create_clan(clan_details: ClanCreation):
+async def create_clan(clan_details: ClanCreation, context: RequestContext = Depends(request_context)):
     """Create a new clan with the user as the leader"""
-    if not user_exists(clan_details.creator_wallet):
+    creator = await context.wallet(clan_details.creator_wallet)
+    if not creator.exists:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user_id = fetch_user_by_wallet(clan_details.creator_wallet)
+    user_id = creator.user_id
     
-    if is_user_in_clan(user_id):
+    if creator.clan_id is not None:
         raise HTTPException(status_code=400, detail="User already belongs to a clan")
     
     clan = Clan(
@@ -49,11 +65,13 @@ async def create_clan(clan_details: ClanCreation):
         clan_leader_id=user_id
     )
     
-    clan_id = insert_clan(clan)
-    invite_code = generate_clan_invite_code(clan_id, user_id)
-    
-    # Update user to be part of the clan
-    join_clan_by_id(user_id, clan_id)
+    # The clan and the leader's membership are written together, or not at all
+    try:
+        clan_id = await insert_clan(clan)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await invalidate_membership([clan_details.creator_wallet], [clan_id])
+    invite_code = await generate_clan_invite_code(clan_id, user_id)
     
     return {
         "message": "Clan created successfully",
@@ -63,33 +81,39 @@ async def create_clan(clan_details: ClanCreation):
 
 
 @router.post("/join_clan")
-async def join_clan(join_details: JoinClan):
+async def join_clan(join_details: JoinClan, context: RequestContext = Depends(request_context)):
     """Join a clan using either an invite code or clan ID"""
-    if not user_exists(join_details.wallet_address):
+    user = await context.wallet(join_details.wallet_address)
+    if not user.exists:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user_id = fetch_user_by_wallet(join_details.wallet_address)
+    user_id = user.user_id
     
-    if is_user_in_clan(user_id):
+    if user.clan_id is not None:
         raise HTTPException(status_code=400, detail="User already belongs to a clan")
     
-    # Join by invite code
+    # Join by invite code; the invite, membership and clan size are checked in the same write
     if join_details.invite_code:
-        if not is_active_referral_code(join_details.invite_code):
-            raise HTTPException(status_code=400, detail="Invalid invite code")
-        
-        clan_id = get_clan_id_by_invite_code(join_details.invite_code)
-        join_clan_by_id(user_id, clan_id)
+        try:
+            clan_id = await redeem_clan_invite(join_details.invite_code, user_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        await invalidate_membership([join_details.wallet_address], [clan_id])
         
         return {"message": "Joined clan successfully via invite code"}
     
     # Join by clan_id (direct join)
     elif join_details.clan_id:
-        clan = get_clan_by_id(join_details.clan_id)
-        if not clan:
+        outcome = await join_clan_by_id(user_id, join_details.clan_id)
+        if outcome == "user_not_found":
+            raise HTTPException(status_code=404, detail="User not found")
+        if outcome == "clan_not_found":
             raise HTTPException(status_code=404, detail="Clan not found")
-        
-        join_clan_by_id(user_id, join_details.clan_id)
+        if outcome == "already_in_clan":
+            raise HTTPException(status_code=400, detail="User already belongs to a clan")
+        if outcome == "clan_full":
+            raise HTTPException(status_code=400, detail="Clan is full")
+        await invalidate_membership([join_details.wallet_address], [join_details.clan_id])
         
         return {"message": "Joined clan successfully"}
     
@@ -98,82 +122,156 @@ async def join_clan(join_details: JoinClan):
 
 
 @router.get("/available_clans")
-async def available_clans():
-    """Get all available clans"""
-    clans = get_available_clans()
-    return {"clans": clans}
+async def available_clans(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    sort: str = Query("clan_id", regex="^(clan_id|created_at|member_count)$"),
+    order: str = Query("asc", regex="^(asc|desc)$"),
+    cursor: Optional[str] = None,
+    min_members: Optional[int] = Query(None, ge=0),
+    max_members: Optional[int] = Query(None, ge=0),
+    leader_wallet: Optional[str] = None,
+):
+    """Get available clans one page at a time; pass next_cursor back to get the following page"""
+    descending = order == "desc"
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, sort, descending)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {str(e)}")
+
+    # A poll that names the current listing version is answered from clan_versions alone
+    if request.headers.get("if-none-match"):
+        etag = make_etag(await listing_version())
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    # Fetch one extra row to find out whether there is another page
+    page = await get_clans_page(
+        limit=limit + 1,
+        sort=sort,
+        descending=descending,
+        after=after,
+        min_members=min_members,
+        max_members=max_members,
+        leader_wallet=leader_wallet,
+    )
+    # The page is fully determined by its cache key, so it is encoded once and reused
+    if page.body is None:
+        clans, next_cursor = page.clans, None
+        if len(clans) > limit:
+            clans = clans[:limit]
+            next_cursor = encode_cursor(sort, descending, clans[-1])
+        page.body = dumps({"clans": clans, "next_cursor": next_cursor})
+    return encoded_json_response(page.body, {"ETag": make_etag(page.version)})
+
+
+@router.get("/leaderboard")
+async def clan_leaderboard(
+    by: str = Query("members", regex="^(members|invites)$"),
+    limit: int = Query(10, ge=1, le=100),
+    clan_id: Optional[int] = None,
+):
+    """The top clans by member count or by invites redeemed, plus one clan's own rank if clan_id is given"""
+    clans = await run_in_db_executor(leaderboard.top, by, limit)
+    result = {"by": by, "clans": clans}
+    if clan_id is not None:
+        result["clan"] = await run_in_db_executor(leaderboard.position, by, clan_id)
+        if result["clan"] is None:
+            raise HTTPException(status_code=404, detail="Clan not found")
+    return result
 
 
 @router.get("/user_clan/{wallet_address}")
-async def user_clan(wallet_address: str, response: Response):
+async def user_clan(wallet_address: str, request: Request, response: Response):
     """Get the clan a user belongs to with caching"""
-    cache_key = f"clan_{wallet_address}"
-    current_time = time.time()
-    
-    # Check cache first
-    if cache_key in _cache and (current_time - _cache[cache_key]["timestamp"] < CACHE_TTL):
-        return _cache[cache_key]["data"]
-    
-    # Not in cache, process normally
-    if not user_exists(wallet_address):
+    cache_headers = {"Cache-Control": f"max-age={CACHE_TTL}"}
+    if request.headers.get("if-none-match"):
+        current = await cached_wallet_clan_version(wallet_address)
+        if current is not None and etag_matches(request, make_etag(*current)):
+            return not_modified(make_etag(*current), cache_headers)
+
+    exists, clan = await get_wallet_clan(wallet_address)
+    if not exists:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user_id = fetch_user_by_wallet(wallet_address)
-    clan = get_user_clan(user_id)
-    
     if not clan:
         result = {"message": "User is not part of any clan"}
+        etag = make_etag(None, 0)
     else:
         result = {"clan": clan}
-    
-    # Store in cache
-    _cache[cache_key] = {
-        "data": result,
-        "timestamp": current_time
-    }
+        # The version comes from the same row as the clan, so it always describes this payload
+        etag = make_etag(clan["clan_id"], clan["version"])
     
     # Add cache control headers
-    response.headers["Cache-Control"] = f"max-age={CACHE_TTL}"
+    response.headers.update(cache_headers)
+    response.headers["ETag"] = etag
     return result
 
 
 @router.get("/clan/{clan_id}/members")
-async def clan_members(clan_id: int):
+async def clan_members(clan_id: int, request: Request):
     """Get all members of a clan"""
-    clan = get_clan_by_id(clan_id)
+    # Resolved first, so a version left behind by a deleted clan never answers 304
+    clan = await get_clan(clan_id)
     if not clan:
         raise HTTPException(status_code=404, detail="Clan not found")
+
+    # Read before the members, so the ETag is never newer than the list it labels
+    etag = make_etag(clan_id, await clan_version(clan_id))
+    if etag_matches(request, etag):
+        return not_modified(etag)
     
-    members = get_clan_members(clan_id)
-    return {"members": members, "count": len(members)}
+    members = await get_clan_members(clan_id)
+    return FastJSONResponse({"members": members, "count": len(members)}, headers={"ETag": etag})
+
+
+@router.get("/export/clans", dependencies=[Depends(require_admin)])
+async def export_clans():
+    """Stream every clan as newline-delimited JSON"""
+    return StreamingResponse(stream_ndjson(get_clans_batch, "clan_id"), media_type=NDJSON_MEDIA_TYPE)
+
+
+@router.get("/export/clan/{clan_id}/members", dependencies=[Depends(require_admin)])
+async def export_clan_members(clan_id: int):
+    """Stream every member of a clan as newline-delimited JSON"""
+    clan = await get_clan(clan_id)
+    if not clan:
+        raise HTTPException(status_code=404, detail="Clan not found")
+
+    return StreamingResponse(
+        stream_ndjson(partial(get_clan_members_batch, clan_id), "user_id"),
+        media_type=NDJSON_MEDIA_TYPE
+    )
 
 
 @router.post("/generate_invite/{wallet_address}")
-async def generate_invite(wallet_address: str):
-    """Generate a new invite code for the user's clan (if they are the leader)"""
-    print(f"Generating invite code for wallet address: {wallet_address}")
+async def generate_invite(wallet_address: str, context: RequestContext = Depends(request_context)):
+    """Return an invite code for the user's clan (if they are the leader), reusing a valid one when allowed"""
+    logger.debug(f"Generating invite code for wallet address: {wallet_address}")
     
     try:
         # Check if user exists
-        if not user_exists(wallet_address):
-            print(f"User not found for wallet address: {wallet_address}")
+        user = await context.wallet(wallet_address)
+        if not user.exists:
+            logger.debug(f"User not found for wallet address: {wallet_address}")
             return {"error": "User not found", "status": 404}
         
-        # Get user ID from wallet address
-        user_id = fetch_user_by_wallet(wallet_address)
-        print(f"Found user ID: {user_id}")
+        user_id = user.user_id
+        logger.debug(f"Found user ID: {user_id}")
         
         # Get user's clan
-        clan = get_user_clan(user_id)
+        clan = user.clan
         if not clan:
-            print(f"User {user_id} is not part of any clan")
+            logger.debug(f"User {user_id} is not part of any clan")
             return {"error": "User is not part of any clan", "status": 404}
         
-        print(f"Found clan: {clan['clan_id']} for user {user_id}")
+        logger.debug(f"Found clan: {clan['clan_id']} for user {user_id}")
         
         # Check if user is clan leader
-        if str(clan["clan_leader_id"]) != str(user_id):
-            print(f"User {user_id} is not the leader of clan {clan['clan_id']}")
+        if not user.is_clan_leader:
+            logger.debug(f"User {user_id} is not the leader of clan {clan['clan_id']}")
             return {
                 "error": "Only clan leaders can generate invite codes",
                 "status": 403,
@@ -182,9 +280,9 @@ async def generate_invite(wallet_address: str):
                 "clan_id": clan.get("clan_id")
             }
         
-        # Generate new invite code
-        invite_code = generate_clan_invite_code(clan["clan_id"], user_id)
-        print(f"Generated invite code: {invite_code} for clan {clan['clan_id']}")
+        # Reuse the clan's current invite code or issue a new one
+        invite_code = await generate_clan_invite_code(clan["clan_id"], user_id)
+        logger.debug(f"Generated invite code: {invite_code} for clan {clan['clan_id']}")
         
         return {
             "message": "Invite code generated successfully",
@@ -194,7 +292,7 @@ async def generate_invite(wallet_address: str):
             "clan_name": clan.get("clan_name", "Unknown clan")
         }
     except Exception as e:
-        print(f"Error generating invite code: {str(e)}")
+        logger.error(f"Error generating invite code: {str(e)}")
         # Only create a 500 error for unexpected exceptions, not for normal validation failures
         if isinstance(e, HTTPException):
             # Re-raise HTTP exceptions as-is
@@ -205,47 +303,48 @@ async def generate_invite(wallet_address: str):
         
 
 @router.post("/leave_clan")
-async def leave_clan(request: LeaveClanRequest):
+async def leave_clan(request: LeaveClanRequest, context: RequestContext = Depends(request_context)):
     """Allow a user to leave their current clan"""
-    if not user_exists(request.wallet_address):
+    user = await context.wallet(request.wallet_address)
+    if not user.exists:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user_id = fetch_user_by_wallet(request.wallet_address)
-    clan = get_user_clan(user_id)
+    user_id = user.user_id
+    clan = user.clan
     
     if not clan:
         raise HTTPException(status_code=400, detail="User is not part of any clan")
     
     # Check if user is the clan leader
-    if clan["clan_leader_id"] == user_id:
+    if user.is_clan_leader:
         raise HTTPException(status_code=400, detail="Clan leader cannot leave the clan. You must transfer leadership or disband the clan.")
     
     # Remove user from clan
-    remove_user_from_clan(user_id)
-    
-    # Clear user clan cache
-    cache_key = f"clan_{request.wallet_address}"
-    if cache_key in _cache:
-        del _cache[cache_key]
+    await remove_user_from_clan(user_id)
+    await invalidate_membership([request.wallet_address], [clan["clan_id"]])
     
     return {"message": "Successfully left the clan"}
 
 @router.post("/remove_member")
-async def remove_clan_member(leader_wallet: str = Body(...), member_wallet: str = Body(...)):
+async def remove_clan_member(leader_wallet: str = Body(...), member_wallet: str = Body(...),
+                             context: RequestContext = Depends(request_context)):
     """Allow a clan leader to remove a member from their clan"""
+    leader = await context.wallet(leader_wallet)
+    member = await context.wallet(member_wallet)
+    
     # Verify both users exist
-    if not user_exists(leader_wallet):
+    if not leader.exists:
         raise HTTPException(status_code=404, detail="Leader not found")
     
-    if not user_exists(member_wallet):
+    if not member.exists:
         raise HTTPException(status_code=404, detail="Member not found")
     
-    leader_id = fetch_user_by_wallet(leader_wallet)
-    member_id = fetch_user_by_wallet(member_wallet)
+    leader_id = leader.user_id
+    member_id = member.user_id
     
     # Get clan info
-    leader_clan = get_user_clan(leader_id)
-    member_clan = get_user_clan(member_id)
+    leader_clan = leader.clan
+    member_clan = member.clan
     
     if not leader_clan:
         raise HTTPException(status_code=400, detail="Leader is not part of any clan")
@@ -258,7 +357,7 @@ async def remove_clan_member(leader_wallet: str = Body(...), member_wallet: str
         raise HTTPException(status_code=400, detail="Leader and member are not in the same clan")
     
     # Verify the leader is actually the clan leader
-    if leader_clan["clan_leader_id"] != leader_id:
+    if not leader.is_clan_leader:
         raise HTTPException(status_code=403, detail="Only clan leaders can remove members")
     
     # Cannot remove yourself
@@ -266,11 +365,60 @@ async def remove_clan_member(leader_wallet: str = Body(...), member_wallet: str
         raise HTTPException(status_code=400, detail="Leader cannot remove themselves from the clan")
     
     # Remove member from clan
-    remove_user_from_clan(member_id)
-    
-    # Clear member's clan cache
-    cache_key = f"clan_{member_wallet}"
-    if cache_key in _cache:
-        del _cache[cache_key]
+    await remove_user_from_clan(member_id)
+    await invalidate_membership([member_wallet], [member_clan["clan_id"]])
     
-    return {"message": "Successfully removed member from clan"}
\ No newline at end of file
+    return {"message": "Successfully removed member from clan"}
+
+
+async def clan_led_by(leader_wallet: str, context: RequestContext):
+    """The leader's wallet context, after checking that they lead a clan"""
+    leader = await context.wallet(leader_wallet)
+    if not leader.exists:
+        raise HTTPException(status_code=404, detail="Leader not found")
+    if not leader.clan:
+        raise HTTPException(status_code=400, detail="Leader is not part of any clan")
+    if not leader.is_clan_leader:
+        raise HTTPException(status_code=403, detail="Only clan leaders can manage members")
+    return leader
+
+
+@router.post("/add_members")
+async def add_clan_members(batch: ClanMembersBatch, context: RequestContext = Depends(request_context)):
+    """Allow a clan leader to add many users to their clan in one transaction"""
+    if len(batch.wallet_addresses) > MAX_BATCH_MEMBERS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_MEMBERS} wallets per request")
+    leader = await clan_led_by(batch.leader_wallet, context)
+
+    results = await add_users_to_clan(leader.clan_id, batch.wallet_addresses)
+    added = [wallet for wallet, status in results.items() if status == "added"]
+    if added:
+        await invalidate_membership(added, [leader.clan_id])
+
+    return {"clan_id": leader.clan_id, "added": len(added), "results": results}
+
+
+@router.post("/remove_members")
+async def remove_clan_members(batch: ClanMembersBatch, context: RequestContext = Depends(request_context)):
+    """Allow a clan leader to remove many members from their clan in one transaction"""
+    if len(batch.wallet_addresses) > MAX_BATCH_MEMBERS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_MEMBERS} wallets per request")
+    leader = await clan_led_by(batch.leader_wallet, context)
+
+    results = await remove_users_from_clan(leader.clan_id, batch.wallet_addresses)
+    removed = [wallet for wallet, status in results.items() if status == "removed"]
+    if removed:
+        await invalidate_membership(removed, [leader.clan_id])
+
+    return {"clan_id": leader.clan_id, "removed": len(removed), "results": results}
+
+
+@router.post("/disband_clan")
+async def disband_clan(leader_wallet: str = Body(..., embed=True), context: RequestContext = Depends(request_context)):
+    """Allow a clan leader to disband their clan, removing every member and invite code"""
+    leader = await clan_led_by(leader_wallet, context)
+
+    former_members = await disband_clan_by_id(leader.clan_id)
+    await invalidate_membership(former_members, [leader.clan_id])
+
+    return {"message": "Clan disbanded", "clan_id": leader.clan_id, "removed": len(former_members)}
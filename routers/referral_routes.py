@@ -1,8 +1,14 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
-from services.referral_system import is_active_referral_code, redeem_referral
-from database.database_queries import fetch_referral_code, fetch_all_referral_codes
+from database.async_queries import (
+    is_active_referral_code,
+    redeem_referral,
+)
+from database.database_queries import get_referrals_batch, get_archived_referrals_batch
+from routers.admin_routes import require_admin
+from services.export import stream_ndjson, NDJSON_MEDIA_TYPE
 
 router = APIRouter()
 
@@ -29,7 +35,7 @@ async def check_referral_code_validity(request_data: Optional[ReferralCodeReques
         else:
             raise HTTPException(status_code=400, detail="Referral code is required")
             
-        return is_active_referral_code(code)
+        return await is_active_referral_code(code)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Referral code is not valid: {str(e)}")
 
@@ -48,8 +54,25 @@ async def redeem_referral_code(request_data: Optional[ReferralCodeRequest] = Non
         else:
             raise HTTPException(status_code=400, detail="Referral code is required")
             
-        redeem_referral(code)
+        await redeem_referral(code)
         return {"message": "Referral code redeemed successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to redeem: {str(e)}")
 
+
+@router.get("/export", dependencies=[Depends(require_admin)])
+async def export_referral_codes():
+    """Stream the whole Referrals table as newline-delimited JSON"""
+    return StreamingResponse(
+        stream_ndjson(get_referrals_batch, "referral_code_id"),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
+
+@router.get("/export/archive", dependencies=[Depends(require_admin)])
+async def export_archived_referral_codes():
+    """Stream the codes the maintenance job moved to referrals_archive as newline-delimited JSON"""
+    return StreamingResponse(
+        stream_ndjson(get_archived_referrals_batch, "referral_code_id"),
+        media_type=NDJSON_MEDIA_TYPE
+    )
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException
-from models.user_models import User
-from services.referral_system import referral_code_handler
-from database.database_queries import user_exists, insert_user, fetch_user_by_wallet
+from models.user_models import User, BulkUserRegistration
+from database.async_queries import user_exists, insert_user, referral_code_handler, run_in_db_executor
+from services.bulk_registration import register_users as register_users_in_bulk
+
+MAX_BULK_REGISTRATION = 10000
 
 
 router = APIRouter()
@@ -10,17 +12,30 @@ router = APIRouter()
 @router.post("/register_user")
 async def register_user(user_details: User):
     """Register a new user with a wallet address"""
-    if user_exists(user_details.wallet_address):
+    if await user_exists(user_details.wallet_address):
         raise HTTPException(status_code=400, detail="User already exists")
     else:
-        insert_user(user_details)
-        user_id = fetch_user_by_wallet(user_details.wallet_address)
-        referral_code_handler(user_id)
+        user_id = await insert_user(user_details)
+        await referral_code_handler(user_id)
         return {"message": "User registered successfully", "wallet_address": user_details.wallet_address}
 
 
+@router.post("/register_users")
+async def register_users(registration: BulkUserRegistration):
+    """Register many users at once; wallets that already exist are skipped"""
+    if len(registration.users) > MAX_BULK_REGISTRATION:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_REGISTRATION} users per request")
+
+    result = await run_in_db_executor(
+        register_users_in_bulk,
+        [user.dict() for user in registration.users],
+        collect_wallets=True
+    )
+    return {"message": "Users registered successfully", **result}
+
+
 @router.get("/user_exists/{wallet_address}")
 async def check_user_exists(wallet_address: str):
     """Check if a user with the given wallet address exists"""
-    exists = user_exists(wallet_address)
+    exists = await user_exists(wallet_address)
     return {"exists": exists}
\ No newline at end of file
@@ -0,0 +1,36 @@
+import logging
+from itertools import islice
+from database.database_queries import insert_users_batch
+from services.referral_system import generate_referral_code, referral_code_expiry
+
+logger = logging.getLogger("bulk_registration")
+
+bulk_chunk_size = 5000  # users per transaction
+
+
+def register_users(users, chunk_size: int = bulk_chunk_size, progress=None, collect_wallets: bool = False) -> dict:
+    """Register users from any iterable of dicts, one transaction per chunk.
+
+    The iterable is consumed lazily, so a file can be streamed through without
+    loading it. progress(received, registered) is called after every chunk.
+    With collect_wallets the result also lists the wallets that were registered.
+    """
+    totals = {"received": 0, "registered": 0, "skipped": 0}
+    registered_wallets = [] if collect_wallets else None
+    users = iter(users)
+    while True:
+        chunk = list(islice(users, chunk_size))
+        if not chunk:
+            break
+        inserted = insert_users_batch(chunk, generate_referral_code, referral_code_expiry())
+        totals["received"] += len(chunk)
+        totals["registered"] += len(inserted)
+        totals["skipped"] += len(chunk) - len(inserted)
+        if collect_wallets:
+            registered_wallets.extend(inserted)
+        if progress:
+            progress(totals["received"], totals["registered"])
+    logger.info(f"Bulk registration: {totals}")
+    if collect_wallets:
+        totals["registered_wallets"] = registered_wallets
+    return totals
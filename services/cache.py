@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by LRUCache.get on a miss, so None can be cached as a real value
+MISSING = object()
+
+
+class LRUCache:
+    """A thread-safe, size-bounded cache with least-recently-used eviction and per-entry TTL"""
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key, default=MISSING):
+        """Return the cached value, or default if it is missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def generation(self) -> int:
+        """Token to read before loading a value; pass it to set() to drop loads that raced an invalidation"""
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, ttl: float = None, generation: int = None):
+        """Cache a value, evicting the least recently used entries beyond max_size"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, *keys):
+        """Drop the given keys"""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        stats["max_size"] = self.max_size
+        return stats
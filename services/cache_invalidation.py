@@ -0,0 +1,75 @@
+import os
+import secrets
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+
+class InvalidationChannel:
+    """Share cache invalidations between worker processes through the SQLite database itself.
+
+    Writers append (scope, key) rows to the cache_invalidations table. Each worker keeps
+    one dedicated connection and checks PRAGMA data_version, which only changes when
+    another connection has committed; only then does it read the rows it has not seen.
+    """
+
+    def __init__(self, database: str, retention: float, prune_every: int = 500):
+        self.database = database
+        self.retention = retention  # seconds of log to keep; must outlive every cache TTL
+        self.prune_every = prune_every
+        self.origin = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._conn = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._last_seq = None
+        self._published = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.database, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA busy_timeout = 5000")
+        return self._conn
+
+    def publish(self, entries):
+        """Record invalidations so the other workers drop them too"""
+        now = datetime.now()
+        rows = [(scope, str(key), self.origin, now) for scope, key in entries]
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT INTO cache_invalidations (scope, cache_key, origin, created_at) VALUES (?, ?, ?, ?)",
+                    rows)
+                self._published += 1
+                if self._published % self.prune_every == 0:
+                    conn.execute("DELETE FROM cache_invalidations WHERE created_at < ?",
+                                 (now - timedelta(seconds=self.retention),))
+
+    def poll(self) -> list:
+        """Return (scope, key) invalidations published by other workers since the last poll"""
+        with self._lock:
+            conn = self._connection()
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._last_seq is not None and data_version == self._data_version:
+                return []
+            self._data_version = data_version
+
+            if self._last_seq is None:
+                # Nothing is cached yet, so only later invalidations matter
+                self._last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM cache_invalidations").fetchone()[0]
+                return []
+            rows = conn.execute(
+                "SELECT seq, scope, cache_key, origin FROM cache_invalidations WHERE seq > ? ORDER BY seq",
+                (self._last_seq,)).fetchall()
+            if rows:
+                self._last_seq = rows[-1][0]
+            return [(scope, key) for _, scope, key, origin in rows if origin != self.origin]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
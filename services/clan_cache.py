@@ -0,0 +1,158 @@
+import logging
+from services.cache import LRUCache, MISSING
+from services.cache_invalidation import InvalidationChannel
+from services.request_context import WalletContext
+from services.leaderboard import leaderboard
+from database.connection_pool import connection_pool
+from database.async_queries import (
+    run_in_db_executor,
+    get_wallet_context,
+    get_clan_by_id,
+    get_available_clans,
+    get_clan_versions,
+)
+
+CACHE_TTL = 30  # seconds
+
+# wallet -> clan_id the user belongs to (None when they are in no clan)
+membership_cache = LRUCache("user_clan", max_size=50000, ttl=CACHE_TTL)
+# clan_id -> clan row as returned by get_clan_by_id
+clan_cache = LRUCache("clan", max_size=10000, ttl=CACHE_TTL)
+# listing arguments -> ClanPage holding one page of get_available_clans
+clan_list_cache = LRUCache("available_clans", max_size=1000, ttl=CACHE_TTL)
+
+caches = (membership_cache, clan_cache, clan_list_cache)
+
+# Invalidations made by other worker processes reach this one through the database
+invalidation_channel = InvalidationChannel(connection_pool.database, retention=CACHE_TTL * 10)
+
+logger = logging.getLogger("clan_cache")
+
+
+def drop_entries(entries):
+    """Invalidate (scope, key) pairs locally; scope is "wallet" or "clan"."""
+    wallets = [key for scope, key in entries if scope == "wallet"]
+    clan_ids = [int(key) for scope, key in entries if scope == "clan"]
+    membership_cache.invalidate(*wallets)
+    clan_cache.invalidate(*clan_ids)
+    clan_list_cache.clear()
+    leaderboard.mark(clan_ids)
+
+
+async def sync_invalidations():
+    """Apply invalidations published by other workers before serving from the caches"""
+    try:
+        entries = await run_in_db_executor(invalidation_channel.poll)
+    except Exception as e:
+        logger.error(f"Could not read cache invalidations: {str(e)}")
+        return
+    if entries:
+        drop_entries(entries)
+
+
+async def get_clan(clan_id: int):
+    """get_clan_by_id through the clan cache"""
+    await sync_invalidations()
+    return await _get_clan(clan_id)
+
+
+async def _get_clan(clan_id: int):
+    clan = clan_cache.get(clan_id)
+    if clan is MISSING:
+        generation = clan_cache.generation()
+        clan = await get_clan_by_id(clan_id)
+        if clan:
+            clan_cache.set(clan_id, clan, generation=generation)
+    return clan
+
+
+async def get_wallet_clan(wallet_address: str):
+    """The clan a wallet belongs to through the membership and clan caches.
+
+    Returns (exists, clan): exists is False for unknown wallets, clan is None when
+    the user is in no clan.
+    """
+    await sync_invalidations()
+    clan_id = membership_cache.get(wallet_address)
+    if clan_id is not MISSING:
+        return True, (await _get_clan(clan_id) if clan_id is not None else None)
+
+    membership_generation = membership_cache.generation()
+    clan_generation = clan_cache.generation()
+    row = await get_wallet_context(wallet_address)
+    if row is None:
+        return False, None
+    clan = WalletContext(wallet_address, row).clan
+
+    membership_cache.set(wallet_address, clan["clan_id"] if clan else None, generation=membership_generation)
+    if clan:
+        clan_cache.set(clan["clan_id"], clan, generation=clan_generation)
+    return True, clan
+
+
+class ClanPage:
+    """One cached result of get_available_clans.
+
+    version is the listing version read before the rows, so a page is never labelled
+    with a version newer than its rows. body holds the encoded response once a route
+    has built it, so later hits on the same page skip serialization entirely.
+    """
+
+    __slots__ = ("version", "clans", "body")
+
+    def __init__(self, version: int, clans: list):
+        self.version = version
+        self.clans = clans
+        self.body = None
+
+
+async def get_clans_page(**listing) -> ClanPage:
+    """get_available_clans through the listing cache, keyed by its arguments"""
+    await sync_invalidations()
+    key = tuple(sorted(listing.items()))
+    page = clan_list_cache.get(key)
+    if page is MISSING:
+        generation = clan_list_cache.generation()
+        version = await listing_version()
+        page = ClanPage(version, await get_available_clans(**listing))
+        clan_list_cache.set(key, page, generation=generation)
+    return page
+
+
+async def listing_version() -> int:
+    """The current version of the clan listing as a whole"""
+    return (await get_clan_versions([0]))[0]
+
+
+async def clan_version(clan_id: int) -> int:
+    """The current version of one clan and its member list"""
+    return (await get_clan_versions([clan_id]))[clan_id]
+
+
+async def cached_wallet_clan_version(wallet_address: str):
+    """(clan_id, version) for a wallet whose membership is cached, else None.
+
+    Only reads the membership cache and clan_versions, so a poll that turns out
+    unchanged never touches Users or Clans. clan_id is None for users in no clan.
+    """
+    await sync_invalidations()
+    clan_id = membership_cache.get(wallet_address)
+    if clan_id is MISSING:
+        return None
+    if clan_id is None:
+        return None, 0
+    return clan_id, await clan_version(clan_id)
+
+
+async def invalidate_membership(wallet_addresses=(), clan_ids=()):
+    """Call after any write that changes who is in which clan, or creates a clan"""
+    entries = [("wallet", wallet) for wallet in wallet_addresses] + [("clan", clan_id) for clan_id in clan_ids]
+    drop_entries(entries)
+    try:
+        await run_in_db_executor(invalidation_channel.publish, entries)
+    except Exception as e:
+        logger.error(f"Could not publish cache invalidations: {str(e)}")
+
+
+def cache_stats() -> dict:
+    return {cache.name: cache.stats() for cache in caches}
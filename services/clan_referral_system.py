@@ -1,10 +1,12 @@
+import os
 import secrets
-import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
-from pydapper import connect
-from database.connection_string import connection_string
-from services.referral_system import expire_referral_code
+from database.connection_pool import connection_pool
+from database import clan_database_queries
+from database.statements import statement
+from database.write_queue import queued_write
+from services.referral_system import referral_code_expiry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
@@ -14,72 +16,185 @@ logger = logging.getLogger("clan_referral_system")
 stale_time = 60 * 60 * 24 * 7  # 7 days for clan invites
 
 
+def optional_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+# Invite issuance policy. With reuse on, generating an invite hands back the clan's newest
+# active code as long as it stays valid for at least invite_min_remaining more seconds,
+# so repeated calls are reads instead of new rows. invite_max_active caps the active codes
+# a clan holds (the oldest are retired first) and invite_max_uses caps the redemptions of
+# each new code; unset means no limit.
+invite_reuse = os.getenv("CLANSAGA_INVITE_REUSE", "1") not in ("0", "false", "False")
+invite_min_remaining = int(os.getenv("CLANSAGA_INVITE_MIN_REMAINING", str(60 * 60 * 24)))
+invite_max_active = optional_int("CLANSAGA_INVITE_MAX_ACTIVE")
+invite_max_uses = optional_int("CLANSAGA_INVITE_MAX_USES")
+
+REUSABLE_CLAN_INVITE = statement(
+    "clan_referral_system.find_reusable_clan_invite",
+    """
+    SELECT referral_code FROM Referrals
+    WHERE clan_id = ?clan_id? AND is_active = TRUE
+    AND (expires_at IS NULL OR expires_at > ?valid_until?)
+    AND (max_uses IS NULL OR uses < max_uses)
+    ORDER BY created_at DESC
+    LIMIT 1
+    """)
+
+RETIRE_EXTRA_CLAN_INVITES = statement(
+    "clan_referral_system.issue_clan_invite_code.retire",
+    """
+    UPDATE Referrals SET is_active = FALSE
+    WHERE referral_code IN (
+        SELECT referral_code FROM Referrals
+        WHERE clan_id = ?clan_id? AND is_active = TRUE
+        ORDER BY created_at DESC
+        LIMIT -1 OFFSET ?keep?
+    )
+    """)
+
+INSERT_CLAN_INVITE_CODE = statement(
+    "clan_referral_system.issue_clan_invite_code",
+    """
+    INSERT INTO Referrals (referral_code, created_at, is_active, user_id, clan_id, expires_at, max_uses)
+    VALUES (?referral_code?, ?created_at?, ?is_active?, ?user_id?, ?clan_id?, ?expires_at?, ?max_uses?)
+    """)
+
+ACTIVE_CLAN_INVITE = statement(
+    "clan_referral_system.is_active_clan_invite",
+    """
+    SELECT is_active FROM Referrals
+    WHERE referral_code = ?referral_code? AND clan_id IS NOT NULL
+    AND (expires_at IS NULL OR expires_at > ?now?)
+    AND (max_uses IS NULL OR uses < max_uses)
+    """)
+
+# The clan of a live invite code that still has room, or NULL
+LIVE_INVITE_CLAN = """
+    SELECT Referrals.clan_id FROM Referrals
+    JOIN Clans ON Clans.clan_id = Referrals.clan_id
+    WHERE Referrals.referral_code = ?referral_code? AND Referrals.is_active = TRUE
+    AND (Referrals.expires_at IS NULL OR Referrals.expires_at > ?now?)
+    AND (?max_members? IS NULL OR Clans.member_count < ?max_members?)
+"""
+
+# Compare-and-set: joins only if the code is a live clan invite, the user is in no clan
+# and the clan has room, all checked by this one statement
+JOIN_BY_INVITE = statement(
+    "clan_referral_system.redeem_clan_invite",
+    f"""
+    UPDATE Users SET clan_id = ({LIVE_INVITE_CLAN}), updated_at = ?updated_at?
+    WHERE user_id = ?user_id? AND clan_id IS NULL AND ({LIVE_INVITE_CLAN}) IS NOT NULL
+    RETURNING clan_id
+    """)
+
+INVITE_REFUSAL = statement(
+    "clan_referral_system.redeem_clan_invite.refused",
+    """
+    SELECT
+        EXISTS (SELECT 1 FROM Users WHERE user_id = ?user_id?),
+        (SELECT clan_id FROM Users WHERE user_id = ?user_id?),
+        (SELECT Referrals.clan_id FROM Referrals JOIN Clans ON Clans.clan_id = Referrals.clan_id
+         WHERE Referrals.referral_code = ?referral_code? AND Referrals.is_active = TRUE
+         AND (Referrals.expires_at IS NULL OR Referrals.expires_at > ?now?)),
+        (SELECT Clans.member_count FROM Referrals JOIN Clans ON Clans.clan_id = Referrals.clan_id
+         WHERE Referrals.referral_code = ?referral_code?)
+    """)
+
+COUNT_INVITE_USE = statement(
+    "clan_referral_system.redeem_clan_invite.use",
+    """
+    UPDATE Referrals
+    SET uses = uses + 1, is_active = (max_uses IS NULL OR uses + 1 < max_uses)
+    WHERE referral_code = ?referral_code?
+    """)
+
+COUNT_INVITE_REDEMPTION = statement(
+    "clan_referral_system.redeem_clan_invite.count",
+    "UPDATE Clans SET invites_redeemed = invites_redeemed + 1 WHERE clan_id = ?clan_id?")
+
+
 def generate_clan_invite_code(clan_id: int, leader_id: int) -> str:
-    """Generate an invite code for a clan and store it in the database"""
-    logger.info(f"Generating clan invite code for clan_id={clan_id}, leader_id={leader_id}")
+    """Return an invite code for a clan, reusing a valid one when the policy allows"""
+    if invite_reuse:
+        with connection_pool.connection() as conn:
+            code = find_reusable_clan_invite(conn, clan_id)
+        if code is not None:
+            logger.debug(f"Reusing clan invite code {code} for clan_id={clan_id}")
+            return code
     try:
-        code = secrets.token_urlsafe(8)
-        logger.info(f"Generated code: {code}")
-        
-        store_clan_invite_code(code, clan_id, leader_id)
-        expire_referral_code(code)
-        
-        logger.info(f"Successfully stored and set expiration for code: {code}")
-        return code
+        return issue_clan_invite_code(secrets.token_urlsafe(8), clan_id, leader_id)
     except Exception as e:
         logger.error(f"Error generating clan invite code: {str(e)}")
         raise
 
 
-def store_clan_invite_code(code: str, clan_id: int, leader_id: int):
-    """Store an invite code for a clan in the database"""
-    logger.info(f"Storing clan invite code: {code} for clan_id={clan_id}, leader_id={leader_id}")
-    try:
-        with connect(connection_string) as commands:
-            commands.execute(
-                """
-                INSERT INTO Referrals (referral_code, created_at, is_active, user_id, clan_id)
-                VALUES (?referral_code?, ?created_at?, ?is_active?, ?user_id?, ?clan_id?)
-                """,
-                param={
-                    "referral_code": code,
-                    "created_at": datetime.now(),
-                    "is_active": True,
-                    "user_id": leader_id,
-                    "clan_id": clan_id
-                }
-            )
-        logger.info(f"Successfully stored invite code in database")
-    except Exception as e:
-        logger.error(f"Error storing clan invite code: {str(e)}")
-        raise
+def find_reusable_clan_invite(conn, clan_id: int):
+    """The clan's newest code that is active, has uses left and stays valid for invite_min_remaining"""
+    valid_until = datetime.now() + timedelta(seconds=invite_min_remaining)
+    return REUSABLE_CLAN_INVITE.scalar(conn, {"clan_id": clan_id, "valid_until": valid_until})
+
+
+@queued_write
+def issue_clan_invite_code(conn, code: str, clan_id: int, leader_id: int) -> str:
+    """Store a new invite code for a clan and return it.
+
+    Reuse is checked again here, in the write transaction, so concurrent generate calls for
+    one clan return the same code instead of each inserting one.
+    """
+    if invite_reuse:
+        existing = find_reusable_clan_invite(conn, clan_id)
+        if existing is not None:
+            return existing
+    if invite_max_active is not None:
+        RETIRE_EXTRA_CLAN_INVITES.run(conn, {"clan_id": clan_id, "keep": max(invite_max_active - 1, 0)})
+    INSERT_CLAN_INVITE_CODE.run(conn, {
+        "referral_code": code,
+        "created_at": datetime.now(),
+        "is_active": True,
+        "user_id": leader_id,
+        "clan_id": clan_id,
+        "expires_at": referral_code_expiry(stale_time),
+        "max_uses": invite_max_uses,
+    })
+    logger.debug(f"Stored clan invite code {code} for clan_id={clan_id}, leader_id={leader_id}")
+    return code
 
 
 def is_active_clan_invite(code: str) -> bool:
     """Check if a clan invite code is active"""
-    with connect(connection_string) as commands:
-        result = commands.query_single(
-            """
-            SELECT is_active FROM Referrals 
-            WHERE referral_code = ?referral_code? AND clan_id IS NOT NULL
-            """,
-            param={"referral_code": code}
-        )
-        return result and result.get("is_active")
-
-
-def redeem_clan_invite(code: str, user_id: int):
-    """Redeem a clan invite code by adding the user to the clan"""
-    with connect(connection_string) as commands:
-        clan_id = commands.query_single(
-            "SELECT clan_id FROM Referrals WHERE referral_code = ?referral_code?",
-            param={"referral_code": code}
-        )["clan_id"]
-        
-        commands.execute(
-            "UPDATE Users SET clan_id = ?clan_id? WHERE user_id = ?user_id?",
-            param={
-                "clan_id": clan_id,
-                "user_id": user_id
-            }
-        )
\ No newline at end of file
+    with connection_pool.connection() as conn:
+        return bool(ACTIVE_CLAN_INVITE.scalar(conn, {"referral_code": code, "now": datetime.now()}))
+
+
+@queued_write
+def redeem_clan_invite(conn, code: str, user_id: int) -> int:
+    """Redeem a clan invite code by adding the user to the clan; returns the clan ID.
+
+    The join is one conditional UPDATE, so two redemptions cannot both add the same user
+    or push a clan past max_clan_members. Each redemption counts one use of the code, and
+    the code is deactivated by the use that reaches its max_uses. Raises ValueError, and
+    nothing is written, when the join is refused.
+    """
+    now = datetime.now()
+    joined = JOIN_BY_INVITE.rows(conn, {"referral_code": code, "user_id": user_id, "now": now,
+                                        "updated_at": now, "max_members": clan_database_queries.max_clan_members})
+    if not joined:
+        user_exists, user_clan_id, invite_clan_id, member_count = INVITE_REFUSAL.row(
+            conn, {"referral_code": code, "user_id": user_id, "now": now})
+        max_members = clan_database_queries.max_clan_members
+        if not user_exists:
+            raise ValueError("User not found")
+        if user_clan_id is not None:
+            raise ValueError("User already belongs to a clan")
+        if invite_clan_id is None:
+            raise ValueError("Invalid invite code")
+        if max_members is not None and member_count >= max_members:
+            raise ValueError("Clan is full")
+        raise RuntimeError(f"Redemption of {code} by user {user_id} was refused for no known reason")
+
+    clan_id = joined[0][0]
+    COUNT_INVITE_USE.run(conn, {"referral_code": code})
+    COUNT_INVITE_REDEMPTION.run(conn, {"clan_id": clan_id})
+    return clan_id
@@ -0,0 +1,21 @@
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    """A weak ETag built from version counters and ids, e.g. W/"12-7" """
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match already names this ETag, compared weakly"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    opaque = etag.removeprefix("W/")
+    return any(candidate == "*" or candidate.removeprefix("W/") == opaque
+               for candidate in (part.strip() for part in header.split(",")))
+
+
+def not_modified(etag: str, headers: dict = None) -> Response:
+    """The empty 304 answer to a conditional GET whose ETag still matches"""
+    return Response(status_code=304, headers={"ETag": etag, **(headers or {})})
@@ -0,0 +1,25 @@
+from database.async_queries import run_in_db_executor
+from services.json_response import dumps
+
+export_batch_size = 1000
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+async def stream_ndjson(fetch_batch, key: str, batch_size: int = None):
+    """Yield newline-delimited JSON for every row, fetching one keyset batch at a time.
+
+    fetch_batch(after, batch_size) must return rows ordered by `key`. Each batch is a
+    short query of its own, so memory stays at one batch and no read lock is held
+    across the whole export.
+    """
+    batch_size = batch_size or export_batch_size
+    after = 0
+    while True:
+        rows = await run_in_db_executor(fetch_batch, after, batch_size)
+        if not rows:
+            return
+        yield b"".join(dumps(row) + b"\n" for row in rows)
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][key]
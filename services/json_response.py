@@ -0,0 +1,42 @@
+"""Fast JSON responses.
+
+FastAPI passes whatever a route returns through jsonable_encoder, which walks and
+copies every value, before the response class serializes it. Routes that return
+long lists of row dicts build a FastJSONResponse themselves instead, so the rows go
+straight to orjson, which encodes datetimes natively and writes bytes directly.
+FastJSONResponse is also the app's default response class, so every other route
+is at least serialized by orjson.
+"""
+from decimal import Decimal
+import orjson
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def _default(value):
+    """Types orjson does not encode natively, converted the way jsonable_encoder would"""
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """A JSONResponse rendered by orjson"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def encoded_json_response(body: bytes, headers: dict = None) -> Response:
+    """Send a payload that was already encoded with dumps, e.g. one kept in a cache"""
+    return Response(body, media_type=JSON_MEDIA_TYPE, headers=headers)
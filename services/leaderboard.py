@@ -0,0 +1,281 @@
+"""Clan leaderboards, ranked in memory.
+
+The rankings are built once from Clans.member_count and Clans.invites_redeemed
+(counters the database already keeps exact), so no request ever groups Users or
+Referrals. After that, every clan named in a membership invalidation, local or
+from another worker, is marked dirty; the next leaderboard read re-reads just
+those clans by primary key and moves them to their new place. A background thread
+rebuilds everything every reconcile_interval seconds to catch writes that bypass
+the invalidation channel (bulk loads, manual SQL).
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from database.clan_database_queries import get_clan_scores_batch, get_clan_scores
+
+logger = logging.getLogger("leaderboard")
+
+reconcile_interval = 60 * 10  # seconds between full rebuilds
+build_batch_size = 5000
+
+# Leaderboard name -> column of the get_clan_scores rows it ranks by
+BOARDS = {"members": 2, "invites": 3}
+
+
+class Ranking:
+    """Clans ordered by score, highest first, ties broken by clan_id.
+
+    Keys are kept in sorted buckets of up to 2 * bucket_size, with a Fenwick tree over
+    the bucket sizes, so a score change costs O(log n + bucket_size) and rank and top-k
+    lookups cost O(log n) and O(log n + k).
+    """
+
+    def __init__(self, scores: dict = None, bucket_size: int = 512):
+        self.bucket_size = bucket_size
+        self._scores = dict(scores or {})
+        keys = sorted((-score, clan_id) for clan_id, score in self._scores.items())
+        self._buckets = [keys[i:i + bucket_size] for i in range(0, len(keys), bucket_size)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._tree = None  # Fenwick tree of bucket sizes, rebuilt after a bucket is split or dropped
+
+    def __len__(self):
+        return len(self._scores)
+
+    def score(self, clan_id: int):
+        return self._scores.get(clan_id)
+
+    def set(self, clan_id: int, score: int):
+        old = self._scores.get(clan_id)
+        if old == score:
+            return
+        if old is not None:
+            self._remove((-old, clan_id))
+        self._scores[clan_id] = score
+        self._insert((-score, clan_id))
+
+    def remove(self, clan_id: int):
+        old = self._scores.pop(clan_id, None)
+        if old is not None:
+            self._remove((-old, clan_id))
+
+    def rank(self, clan_id: int):
+        """1-based position of a clan, or None if it is not ranked"""
+        score = self._scores.get(clan_id)
+        if score is None:
+            return None
+        key = (-score, clan_id)
+        index = bisect_left(self._maxes, key)
+        return self._keys_before(index) + bisect_left(self._buckets[index], key) + 1
+
+    def top(self, k: int) -> list:
+        """The first k (clan_id, score) pairs"""
+        entries = []
+        for bucket in self._buckets:
+            for negative_score, clan_id in bucket[:k - len(entries)]:
+                entries.append((clan_id, -negative_score))
+            if len(entries) >= k:
+                break
+        return entries
+
+    def _keys_before(self, index: int) -> int:
+        """How many keys the buckets before this one hold"""
+        if self._tree is None:
+            tree = [0] + [len(bucket) for bucket in self._buckets]
+            for i in range(1, len(tree)):
+                parent = i + (i & -i)
+                if parent < len(tree):
+                    tree[parent] += tree[i]
+            self._tree = tree
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _resized(self, index: int, delta: int):
+        """Record that one bucket gained or lost a key"""
+        if self._tree is not None:
+            index += 1
+            while index < len(self._tree):
+                self._tree[index] += delta
+                index += index & -index
+
+    def _insert(self, key: tuple):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._tree = None
+            return
+        index = min(bisect_left(self._maxes, key), len(self._buckets) - 1)
+        bucket = self._buckets[index]
+        insort(bucket, key)
+        self._maxes[index] = bucket[-1]
+        if len(bucket) > 2 * self.bucket_size:
+            half = len(bucket) // 2
+            self._buckets[index:index + 1] = [bucket[:half], bucket[half:]]
+            self._maxes[index:index + 1] = [bucket[half - 1], bucket[-1]]
+            self._tree = None
+        else:
+            self._resized(index, 1)
+
+    def _remove(self, key: tuple):
+        index = bisect_left(self._maxes, key)
+        bucket = self._buckets[index]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self._maxes[index] = bucket[-1]
+            self._resized(index, -1)
+        else:
+            del self._buckets[index]
+            del self._maxes[index]
+            self._tree = None
+
+
+class Leaderboard:
+    """Every board in BOARDS plus clan names, kept current by mark() and rebuilt by build()"""
+
+    def __init__(self):
+        self._rankings = {board: Ranking() for board in BOARDS}
+        self._names = {}
+        self._dirty = set()
+        self._built_at = None
+        self._lock = threading.Lock()  # guards the rankings, names and dirty set
+        self._refresh_lock = threading.RLock()  # one database read applied at a time, in order
+        self._stats = {"builds": 0, "refreshes": 0, "refreshed_clans": 0, "corrections": 0}
+
+    def mark(self, clan_ids):
+        """Note clans whose counters may have changed; they are re-read on the next lookup"""
+        with self._lock:
+            self._dirty.update(clan_ids)
+
+    def build(self) -> int:
+        """Rank every clan from scratch and return how many there are"""
+        with self._refresh_lock:
+            started = time.monotonic()
+            with self._lock:
+                # Marks made from here on may not be in the rows read below, so they stay
+                self._dirty.clear()
+            rows = []
+            after = 0
+            while True:
+                batch = get_clan_scores_batch(after, build_batch_size)
+                rows += batch
+                if len(batch) < build_batch_size:
+                    break
+                after = batch[-1][0]
+
+            rankings = {board: Ranking({row[0]: row[column] for row in rows}) for board, column in BOARDS.items()}
+            with self._lock:
+                corrections = 0
+                if self._built_at is not None:
+                    old = self._rankings["members"]
+                    corrections = sum(1 for row in rows if old.score(row[0]) != row[BOARDS["members"]])
+                self._rankings = rankings
+                self._names = {row[0]: row[1] for row in rows}
+                self._built_at = time.time()
+                self._stats["builds"] += 1
+                self._stats["corrections"] += corrections
+        if corrections:
+            logger.info(f"Leaderboard rebuild corrected {corrections} clans")
+        logger.debug(f"Ranked {len(rows)} clans in {time.monotonic() - started:.2f}s")
+        return len(rows)
+
+    def refresh(self):
+        """Re-read the clans marked since the last refresh and move them to their new rank"""
+        if self._built_at is None:
+            self._refresh_lock.acquire()
+        elif not self._dirty or not self._refresh_lock.acquire(blocking=False):
+            # Nothing changed, or a rebuild is running: serve the ranking as it stands
+            return
+        try:
+            if self._built_at is None:
+                self.build()
+                return
+            with self._lock:
+                clan_ids, self._dirty = list(self._dirty), set()
+            if not clan_ids:
+                return
+            rows = {row[0]: row for row in get_clan_scores(clan_ids)}
+            with self._lock:
+                for clan_id in clan_ids:
+                    row = rows.get(clan_id)
+                    for board, column in BOARDS.items():
+                        if row is None:
+                            self._rankings[board].remove(clan_id)
+                        else:
+                            self._rankings[board].set(clan_id, row[column])
+                    if row is None:
+                        self._names.pop(clan_id, None)
+                    else:
+                        self._names[clan_id] = row[1]
+                self._stats["refreshes"] += 1
+                self._stats["refreshed_clans"] += len(clan_ids)
+        finally:
+            self._refresh_lock.release()
+
+    def top(self, board: str, k: int) -> list:
+        """The k highest ranked clans on a board"""
+        self.refresh()
+        with self._lock:
+            return [
+                {"rank": position, "clan_id": clan_id, "clan_name": self._names.get(clan_id), "score": score}
+                for position, (clan_id, score) in enumerate(self._rankings[board].top(k), start=1)
+            ]
+
+    def position(self, board: str, clan_id: int):
+        """One clan's rank and score on a board, or None if the clan does not exist"""
+        self.refresh()
+        with self._lock:
+            ranking = self._rankings[board]
+            rank = ranking.rank(clan_id)
+            if rank is None:
+                return None
+            return {"rank": rank, "clan_id": clan_id, "clan_name": self._names.get(clan_id),
+                    "score": ranking.score(clan_id), "ranked_clans": len(ranking)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["clans"] = len(self._rankings["members"])
+            stats["dirty"] = len(self._dirty)
+            stats["built_at"] = self._built_at
+        return stats
+
+
+leaderboard = Leaderboard()
+
+_reconciler_thread = None
+_reconciler_stop = threading.Event()
+_reconciler_lock = threading.Lock()
+
+
+def _reconciler_loop(interval: float):
+    while not _reconciler_stop.is_set():
+        try:
+            leaderboard.build()
+        except Exception as e:
+            logger.error(f"Leaderboard rebuild failed: {str(e)}")
+        _reconciler_stop.wait(interval)
+
+
+def start_leaderboard_reconciler(interval: float = reconcile_interval):
+    """Build the leaderboard in the background now and again every interval seconds"""
+    global _reconciler_thread
+    with _reconciler_lock:
+        if _reconciler_thread is not None and _reconciler_thread.is_alive():
+            return
+        _reconciler_stop.clear()
+        _reconciler_thread = threading.Thread(target=_reconciler_loop, args=(interval,),
+                                              name="leaderboard-reconciler", daemon=True)
+        _reconciler_thread.start()
+
+
+def stop_leaderboard_reconciler(timeout: float = 5):
+    """Signal the reconciler to stop and wait for it to exit"""
+    global _reconciler_thread
+    with _reconciler_lock:
+        _reconciler_stop.set()
+        if _reconciler_thread is not None:
+            _reconciler_thread.join(timeout)
+        _reconciler_thread = None
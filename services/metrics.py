@@ -0,0 +1,194 @@
+"""In-process metrics, rendered in the Prometheus text exposition format.
+
+Counters and histograms are updated on the request and query paths, so an update
+is a bisect and a couple of additions under a lock. Numbers that are already kept
+elsewhere (pool, write queue and cache stats, thread counts) are not copied here;
+/api/metrics reads them when it is scraped and renders them with stats_family.
+"""
+import bisect
+import functools
+import math
+import threading
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # Starlette appends the utf-8 charset
+
+# Upper bounds in seconds, shared by request latencies and query timings
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every Counter and Histogram, in creation order
+_metrics = []
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra: str = None) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(int(value))
+
+
+class Counter:
+    """A monotonically increasing count per combination of label values"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    """Observations counted into fixed buckets per combination of label values"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *label_values) -> int:
+        with self._lock:
+            series = self._series.get(label_values)
+            return sum(series[:-1]) if series else 0
+
+    def render(self) -> list:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values[:-1]):
+                cumulative += count
+                le = 'le="' + format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(values[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+def stats_family(name: str, documentation: str, samples: dict, labels: tuple = (), kind: str = "gauge") -> list:
+    """Render values read at scrape time; samples maps a tuple of label values to a number"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{format_labels(labels, key)} {format_value(value)}" for key, value in samples.items()]
+    return lines
+
+
+def render(*families) -> str:
+    """Every registered metric followed by the given stats_family blocks"""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    for family in families:
+        lines += family
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram("clansaga_http_request_duration_seconds", "Time to serve an HTTP request, by route",
+                            ("method", "route"))
+REQUESTS = Counter("clansaga_http_requests_total", "HTTP responses by route and status", ("method", "route", "status"))
+QUERY_SECONDS = Histogram("clansaga_db_query_duration_seconds", "Time spent in a database query function",
+                          ("query",))
+QUERY_ERRORS = Counter("clansaga_db_query_errors_total", "Database query functions that raised", ("query",))
+
+
+def timed_query(func):
+    """Record the duration, call count and failures of a database query function"""
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            QUERY_ERRORS.inc(name)
+            raise
+        finally:
+            QUERY_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times every HTTP request.
+
+    Requests are labelled with the route's path template (/api/clans/clan/{clan_id}/members)
+    rather than the raw path, so the number of series stays bounded; requests that
+    match no route share the "unmatched" label.
+    """
+
+    def __init__(self, app, routes: list):
+        self.app = app
+        self.routes = routes
+        self._paths = {}  # endpoint -> path template
+
+    def route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._paths.get(endpoint)
+        if path is None:
+            path = next((route.path for route in self.routes if getattr(route, "endpoint", None) is endpoint),
+                        "unmatched")
+            self._paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = self.route_path(scope)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], route)
+            REQUESTS.inc(scope["method"], route, str(status))
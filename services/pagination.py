@@ -0,0 +1,28 @@
+import base64
+import json
+
+
+def encode_cursor(sort: str, descending: bool, last_row: dict) -> str:
+    """Build the opaque next-page token from the last clan row of a page"""
+    payload = {"s": sort, "d": descending, "v": last_row[sort], "id": last_row["clan_id"]}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, descending: bool) -> tuple:
+    """Turn a next-page token back into (sort value, clan_id); raises ValueError if it is invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        value, clan_id = payload["v"], int(payload["id"])
+        cursor_sort, cursor_descending = payload["s"], payload["d"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Malformed cursor: {str(e)}")
+    # Sort values are bound as query parameters and become part of the page cache key
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+        raise ValueError("Malformed cursor: sort value must be a string, a number or null")
+    if not isinstance(cursor_descending, bool):
+        raise ValueError("Malformed cursor: direction must be a boolean")
+    if cursor_sort != sort or cursor_descending != descending:
+        raise ValueError("Cursor was issued for a different sort order")
+    return value, clan_id
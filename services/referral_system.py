@@ -1,74 +1,130 @@
-# services/referral_system.py - Fix the threading issue
+# services/referral_system.py
+import logging
 import secrets
 import threading
-import time
-from datetime import datetime
-from pydapper import connect
-from database.connection_string import connection_string
-from database.database_queries import store_referral_code, inactivate_referral_token
+from datetime import datetime, timedelta
+from database.connection_pool import connection_pool
+from database.statements import statement
+from database.database_queries import (
+    store_referral_code,
+    inactivate_referral_token,
+    redeem_referral_code,
+    deactivate_expired_referral_codes,
+    archive_inactive_referral_codes,
+    incremental_vacuum,
+)
+
+logger = logging.getLogger("referral_system")
 
-# Increase stale time to reduce thread creation frequency
 stale_time = 60 * 60 * 24 * 7  # 7 days
 
-# Track existing expiry threads
-_expiry_threads = {}
-_thread_lock = threading.Lock()
+# A single sweeper thread deactivates expired codes, moves inactive ones to
+# referrals_archive and returns the freed pages, all in bounded batches
+sweep_interval = 60 * 5  # seconds between sweeps
+sweep_batch_size = 1000
+archive_batch_size = 1000
+vacuum_pages = 2000  # free pages handed back per batch
+
+ACTIVE_REFERRAL_CODE = statement(
+    "referral_system.is_active_referral_code",
+    """
+    SELECT is_active FROM Referrals
+    WHERE referral_code = ?referral_code?
+    AND (expires_at IS NULL OR expires_at > ?now?)
+    """)
+
+_sweeper_thread = None
+_sweeper_stop = threading.Event()
+_sweeper_lock = threading.Lock()
 
 def referral_code_handler(user_id: int):
-    store_referral_code(generate_referral_code(), user_id)
+    store_referral_code(generate_referral_code(), user_id, referral_code_expiry())
 
 def generate_referral_code() -> str:
-    code = secrets.token_urlsafe(8)
-    expire_referral_code(code)
-    return code
+    return secrets.token_urlsafe(8)
+
+def referral_code_expiry(lifetime: int = stale_time) -> datetime:
+    """When a code issued now stops being valid"""
+    return datetime.now() + timedelta(seconds=lifetime)
 
 def is_active_referral_code(code: str) -> bool:
     try:
-        with connect(connection_string) as commands:
-            result = commands.query_single(
-                "SELECT is_active FROM Referrals WHERE referral_code = ?referral_code?",
-                param={"referral_code": code})
-            
-            if result and result.get("is_active") is not None:
-                return bool(result["is_active"])
-            return False
+        with connection_pool.connection() as conn:
+            return bool(ACTIVE_REFERRAL_CODE.scalar(conn, {"referral_code": code, "now": datetime.now()}))
     except Exception as e:
-        print(f"Error checking referral code: {e}")
+        logger.error(f"Error checking referral code: {str(e)}")
         return False
 
 def redeem_referral(code: str):
-    invalidate_referral_code(code)
+    """Redeem a personal referral code once; raises ValueError if it is unknown, a clan invite or no longer live"""
+    if not redeem_referral_code(code):
+        raise ValueError("Referral code is invalid, expired or already redeemed")
 
 def invalidate_referral_code(code: str):
     try:
         inactivate_referral_token(code)
-        
-        # Remove thread from tracking if exists
-        with _thread_lock:
-            if code in _expiry_threads:
-                del _expiry_threads[code]
     except Exception as e:
-        print(f"Error invalidating code: {e}")
+        logger.error(f"Error invalidating code: {str(e)}")
+
+def sweep_expired_referral_codes(batch_size: int = sweep_batch_size) -> int:
+    """Deactivate every expired code, one bounded batch per transaction; returns how many were flipped"""
+    total = 0
+    while True:
+        swept = deactivate_expired_referral_codes(datetime.now(), batch_size)
+        total += swept
+        if swept < batch_size or _sweeper_stop.is_set():
+            return total
 
-def expire_referral_code(code: str):
-    """Schedule code to expire after stale_time"""
-    with _thread_lock:
-        # Don't create a new thread if one already exists for this code
-        if code in _expiry_threads:
+def archive_dead_referral_codes(batch_size: int = archive_batch_size) -> int:
+    """Move every inactive code to referrals_archive, one bounded batch per transaction; returns how many moved"""
+    total = 0
+    while True:
+        archived = archive_inactive_referral_codes(datetime.now(), batch_size)
+        total += archived
+        if archived < batch_size or _sweeper_stop.is_set():
+            return total
+
+def compact_database(max_pages: int = vacuum_pages) -> int:
+    """Return free pages to the filesystem, max_pages per transaction; returns how many were freed"""
+    total = 0
+    while True:
+        freed = incremental_vacuum(max_pages)
+        total += freed
+        if freed < max_pages or _sweeper_stop.is_set():
+            return total
+
+def _sweeper_loop(interval: float):
+    while not _sweeper_stop.is_set():
+        try:
+            swept = sweep_expired_referral_codes()
+            if swept:
+                logger.info(f"Deactivated {swept} expired referral codes")
+            archived = archive_dead_referral_codes()
+            if archived:
+                logger.info(f"Archived {archived} inactive referral codes")
+            freed = compact_database()
+            if freed:
+                logger.debug(f"Returned {freed} free pages to the filesystem")
+        except Exception as e:
+            logger.error(f"Referral expiry sweep failed: {str(e)}")
+        _sweeper_stop.wait(interval)
+
+def start_expiry_sweeper(interval: float = sweep_interval):
+    """Start the background expiry sweeper (no-op if it is already running)"""
+    global _sweeper_thread
+    with _sweeper_lock:
+        if _sweeper_thread is not None and _sweeper_thread.is_alive():
             return
-            
-        def expire_task():
-            time.sleep(stale_time)
-            invalidate_referral_code(code)
-            
-            # Remove from tracking when done
-            with _thread_lock:
-                if code in _expiry_threads:
-                    del _expiry_threads[code]
-        
-        # Create and start the thread
-        t = threading.Thread(target=expire_task, daemon=True)
-        t.start()
-        
-        # Track the thread
-        _expiry_threads[code] = t
\ No newline at end of file
+        _sweeper_stop.clear()
+        _sweeper_thread = threading.Thread(target=_sweeper_loop, args=(interval,),
+                                           name="referral-expiry-sweeper", daemon=True)
+        _sweeper_thread.start()
+
+def stop_expiry_sweeper(timeout: float = 5):
+    """Signal the sweeper to stop and wait for it to exit"""
+    global _sweeper_thread
+    with _sweeper_lock:
+        _sweeper_stop.set()
+        if _sweeper_thread is not None:
+            _sweeper_thread.join(timeout)
+        _sweeper_thread = None
@@ -0,0 +1,51 @@
+from database.async_queries import get_wallet_context
+
+
+class WalletContext:
+    """What the routes need to know about one wallet, resolved by a single query"""
+
+    __slots__ = ("wallet_address", "user_id", "clan")
+
+    def __init__(self, wallet_address: str, row: dict = None):
+        self.wallet_address = wallet_address
+        self.user_id = row["user_id"] if row else None
+        # Same shape as get_user_clan: the clan row plus leader_name / leader_wallet
+        if row and row.get("clan_id") is not None:
+            self.clan = {key: value for key, value in row.items() if key != "user_id"}
+        else:
+            self.clan = None
+
+    @property
+    def exists(self) -> bool:
+        return self.user_id is not None
+
+    @property
+    def clan_id(self):
+        return self.clan["clan_id"] if self.clan else None
+
+    @property
+    def is_clan_leader(self) -> bool:
+        return bool(self.clan) and self.clan["clan_leader_id"] == self.user_id
+
+    @property
+    def member_count(self) -> int:
+        return self.clan["member_count"] if self.clan else 0
+
+
+class RequestContext:
+    """Per-request memo of wallet lookups, so each wallet costs one query per request"""
+
+    def __init__(self):
+        self._wallets = {}
+
+    async def wallet(self, wallet_address: str) -> WalletContext:
+        context = self._wallets.get(wallet_address)
+        if context is None:
+            context = WalletContext(wallet_address, await get_wallet_context(wallet_address))
+            self._wallets[wallet_address] = context
+        return context
+
+
+def request_context() -> RequestContext:
+    """FastAPI dependency: one RequestContext per request"""
+    return RequestContext()
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Point the app at a scratch database before any test module imports it
+os.environ.setdefault("CLANSAGA_DATABASE_URL", f"sqlite://{os.path.join(tempfile.mkdtemp(), 'test.db')}")
@@ -0,0 +1,60 @@
+import time
+from services.cache import LRUCache, MISSING
+
+# least recently used entries are evicted once the cache is full
+
+
+def test_lru_eviction():
+    cache = LRUCache("test", max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+# entries expire after their TTL and None is a cacheable value
+
+
+def test_ttl_and_none_values():
+    cache = LRUCache("test", max_size=10, ttl=60)
+    cache.set("none", None)
+    cache.set("short", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("none") is None
+    assert cache.get("short") is MISSING
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["expirations"] == 1
+
+# a load that started before an invalidation is not stored
+
+
+def test_stale_load_is_dropped_after_invalidation():
+    cache = LRUCache("test", max_size=10, ttl=60)
+    generation = cache.generation()
+    cache.invalidate("key")
+    cache.set("key", "stale", generation=generation)
+    assert cache.get("key") is MISSING
+
+# invalidations published by one worker are seen by the others, not by itself
+
+
+def test_invalidation_channel_between_workers(tmp_path):
+    from init_db import migrate
+    from services.cache_invalidation import InvalidationChannel
+
+    database = str(tmp_path / "channel.db")
+    migrate(database)
+    worker_a = InvalidationChannel(database, retention=60)
+    worker_b = InvalidationChannel(database, retention=60)
+    assert worker_a.poll() == [] and worker_b.poll() == []
+
+    worker_a.publish([("wallet", "0xabc"), ("clan", 7)])
+    assert worker_b.poll() == [("wallet", "0xabc"), ("clan", "7")]
+    assert worker_b.poll() == []
+    assert worker_a.poll() == []
+    worker_a.close()
+    worker_b.close()
@@ -0,0 +1,44 @@
+import pytest
+from database.connection_pool import ConnectionPool, PoolTimeoutError
+
+
+def make_pool(tmp_path, size=2, timeout=0.1):
+    return ConnectionPool(f"sqlite://{tmp_path / 'pool.db'}", size=size, timeout=timeout,
+                          health_check_interval=0, pragmas={"busy_timeout": 1000})
+
+# connections are reused instead of reopened per call
+
+
+def test_pool_reuses_connections(tmp_path):
+    pool = make_pool(tmp_path)
+    for _ in range(5):
+        with pool.connection() as conn:
+            assert conn.execute("SELECT 1").fetchone()[0] == 1
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["checkouts"] == 5
+    assert stats["in_use"] == 0
+
+# the pool never hands out more than `size` connections
+
+
+def test_pool_is_bounded(tmp_path):
+    pool = make_pool(tmp_path, size=1)
+    with pool.connection():
+        with pytest.raises(PoolTimeoutError):
+            pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+
+# failed blocks are rolled back before the connection goes back to the pool
+
+
+def test_pool_rolls_back_on_error(tmp_path):
+    pool = make_pool(tmp_path)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t(x INTEGER)")
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError("boom")
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
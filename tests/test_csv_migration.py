@@ -0,0 +1,70 @@
+import sqlite3
+import uuid
+import pytest
+from database.connection_pool import sqlite_path
+from database.connection_string import connection_string
+from database.csv_migration import insert_users_from_csv
+from services.bulk_registration import register_users
+from init_db import migrate
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    migrate(sqlite_path(connection_string))
+
+
+def referral_counts(wallets: list) -> dict:
+    """wallet_address -> number of referral codes, for the listed wallets"""
+    conn = sqlite3.connect(sqlite_path(connection_string))
+    try:
+        return {wallet: conn.execute(
+            "SELECT COUNT(*) FROM Referrals JOIN Users USING (user_id) WHERE wallet_address = ?", (wallet,)
+        ).fetchone()[0] for wallet in wallets}
+    finally:
+        conn.close()
+
+# existing wallets and wallets repeated within a chunk or across chunks are skipped
+
+
+def test_register_users_skips_duplicates():
+    existing, new = f"0x{uuid.uuid4().hex}", [f"0x{uuid.uuid4().hex}" for _ in range(4)]
+    register_users([{"wallet_address": existing}])
+
+    users = [{"wallet_address": wallet} for wallet in [existing, new[0], new[1], new[0], new[2], new[3], new[1]]]
+    totals = register_users(users, chunk_size=4, collect_wallets=True)
+    assert totals["received"] == 7 and totals["registered"] == 4 and totals["skipped"] == 3
+    assert sorted(totals["registered_wallets"]) == sorted(new)
+    # every new user gets exactly one referral code, and the existing user no second one
+    assert referral_counts(new + [existing]) == {wallet: 1 for wallet in new + [existing]}
+
+# the CSV importer streams rows through register_users and keeps the optional columns
+
+
+def test_insert_users_from_csv(tmp_path):
+    wallets = [f"0x{uuid.uuid4().hex}" for _ in range(3)]
+    csv_file = tmp_path / "users.csv"
+    csv_file.write_text("wallet_address, username, profile_image, created_at, updated_at\n"
+                        f"{wallets[0]},alice,,2025-01-01 00:00:00,2025-01-01 00:00:00\n"
+                        f"{wallets[1]},,,,\n"
+                        f"{wallets[0]},again,,,\n"
+                        f"{wallets[2]},carol,img.png,,\n")
+    progress = []
+    totals = insert_users_from_csv(str(csv_file), chunk_size=2, progress=lambda *counts: progress.append(counts))
+    assert totals == {"received": 4, "registered": 3, "skipped": 1}
+    assert progress == [(2, 2), (4, 3)]
+    assert referral_counts(wallets) == {wallet: 1 for wallet in wallets}
+
+    conn = sqlite3.connect(sqlite_path(connection_string))
+    row = conn.execute("SELECT username, profile_image FROM Users WHERE wallet_address = ?", (wallets[2],)).fetchone()
+    username = conn.execute("SELECT username FROM Users WHERE wallet_address = ?", (wallets[0],)).fetchone()[0]
+    conn.close()
+    assert row == ("carol", "img.png") and username == "alice"
+
+# a CSV without a wallet_address column is rejected
+
+
+def test_csv_requires_wallet_address(tmp_path):
+    csv_file = tmp_path / "bad.csv"
+    csv_file.write_text("username\nbob\n")
+    with pytest.raises(ValueError):
+        insert_users_from_csv(str(csv_file))
@@ -1,54 +1,370 @@
-from http import client
+import base64
+import json
+import sqlite3
+import uuid
+import pytest
 from fastapi.testclient import TestClient
 from app import app
+from database.connection_pool import sqlite_path
+from database.connection_string import connection_string
+from database.database_queries import fetch_referral_code
 
+wallet_address = f"0x{uuid.uuid4().hex}"
 
-client = TestClient(app)
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def code(client):
+    client.post("/api/users/register_user", json={"wallet_address": wallet_address})
+    return fetch_referral_code(wallet_address)
 
 # test index route for 200 status code
 
 
-def test_index_route():
+def test_index_route(client):
     response = client.get("/")
     assert response.status_code == 200
 
 # test register user route for 200 status code
 
 
-def test_register_user_route():
-    response = client.post("/register_user", json={
-        "first_name": "jerry",
-        "last_name": "buaba",
-        "phone": "504782862",
-        "email": "jerrytest@example.com",
-        "token": "1234567890",
+def test_register_user_route(client):
+    response = client.post("/api/users/register_user", json={
+        "wallet_address": f"0x{uuid.uuid4().hex}",
+        "username": "jerry",
         "created_at": "2022-03-25T08:27:07.703Z",
         "updated_at": "2022-03-25T08:27:07.703Z"
     })
     assert response.status_code == 200
 
-# test get referral code route for 200 status code
+# test registering the same wallet twice is rejected
 
 
-def test_get_referral_code_route():
-    response = client.post("/get_referral_code", json={
-        "email": "jerrytest@example.com"})
-    assert response.status_code == 200
-    code = response.json()
-    return code
+def test_register_existing_user_route(client, code):
+    response = client.post("/api/users/register_user", json={"wallet_address": wallet_address})
+    assert response.status_code == 400
 
 # test check referral code validity route for 200 status code
 
 
-def test_check_referral_code_validity_route(code):
-    response = client.post("/check_referral_code_validity", json={
-        "referral_code": test_get_referral_code_route()})
+def test_check_referral_code_validity_route(client, code):
+    response = client.post("/api/referrals/check_referral_code_validity", json={"referral_code": code})
     assert response.status_code == 200
+    assert response.json() is True
 
 # test redeem referral code route for 200 status code
 
 
-def test_redeem_referral_code_route(code):
-    response = client.post("/redeem_referral_code", json={
-        "referral_code": test_get_referral_code_route()})
+def test_redeem_referral_code_route(client, code):
+    response = client.post("/api/referrals/redeem_referral_code", json={"referral_code": code})
+    assert response.status_code == 200
+    response = client.post("/api/referrals/check_referral_code_validity", json={"referral_code": code})
+    assert response.json() is False
+
+# test a clan invite cannot be redeemed as a personal referral code
+
+
+def test_redeem_referral_code_rejects_clan_invite(client):
+    leader, member = f"0x{uuid.uuid4().hex}", f"0x{uuid.uuid4().hex}"
+    for wallet in (leader, member):
+        client.post("/api/users/register_user", json={"wallet_address": wallet})
+    invite = client.post("/api/clans/create_clan", json={"clan_name": "invite", "creator_wallet": leader}).json()
+
+    response = client.post("/api/referrals/redeem_referral_code", json={"referral_code": invite["invite_code"]})
+    assert response.status_code == 400
+    response = client.post("/api/referrals/check_referral_code_validity", json={"referral_code": invite["invite_code"]})
+    assert response.json() is True
+    assert client.post("/api/clans/join_clan",
+                       json={"wallet_address": member, "invite_code": invite["invite_code"]}).status_code == 200
+
+# test the metrics endpoint reports request latency by route template and query timings
+
+
+def test_metrics_route(client):
+    client.get(f"/api/clans/user_clan/{wallet_address}")
+    response = client.get("/api/metrics")
     assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'clansaga_http_request_duration_seconds_count{method="GET",route="/api/clans/user_clan/{wallet_address}"}' in body
+    assert 'clansaga_db_query_duration_seconds_count{query="clan_database_queries.get_wallet_context"}' in body
+    assert 'clansaga_cache_hits_total{cache="user_clan"}' in body
+
+# test the admin endpoint lists slow queries only for the admin token, and is hidden without one
+
+
+def test_slow_queries_route(client, monkeypatch):
+    from routers import admin_routes
+    monkeypatch.setattr(admin_routes, "ADMIN_TOKEN", None)
+    assert client.get("/api/admin/slow_queries").status_code == 404
+
+    monkeypatch.setattr(admin_routes, "ADMIN_TOKEN", "secret")
+    assert client.get("/api/admin/slow_queries", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = client.get("/api/admin/slow_queries", params={"limit": 5}, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert "slow_queries" in response.json()
+
+# test clan reads answer a matching If-None-Match with 304 until membership changes
+
+
+def test_clan_etags(client):
+    leader, member = f"0x{uuid.uuid4().hex}", f"0x{uuid.uuid4().hex}"
+    for wallet in (leader, member):
+        client.post("/api/users/register_user", json={"wallet_address": wallet})
+    clan_id = client.post("/api/clans/create_clan", json={"clan_name": "etags", "creator_wallet": leader}).json()["clan_id"]
+
+    urls = [f"/api/clans/user_clan/{leader}", f"/api/clans/clan/{clan_id}/members", "/api/clans/available_clans"]
+    etags = {url: client.get(url).headers["ETag"] for url in urls}
+    for url, etag in etags.items():
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/api/clans/join_clan", json={"wallet_address": member, "clan_id": clan_id})
+    for url, etag in etags.items():
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    missing = client.get("/api/clans/clan/999999999/members", headers={"If-None-Match": 'W/"999999999-0"'})
+    assert missing.status_code == 404
+
+# test the leaderboard follows joins and invite redemptions
+
+
+def test_clan_leaderboard(client):
+    leader, member = f"0x{uuid.uuid4().hex}", f"0x{uuid.uuid4().hex}"
+    for wallet in (leader, member):
+        client.post("/api/users/register_user", json={"wallet_address": wallet})
+    created = client.post("/api/clans/create_clan", json={"clan_name": "ranked", "creator_wallet": leader}).json()
+    client.post("/api/clans/join_clan", json={"wallet_address": member, "invite_code": created["invite_code"]})
+
+    for by, score in (("members", 2), ("invites", 1)):
+        response = client.get("/api/clans/leaderboard", params={"by": by, "clan_id": created["clan_id"]})
+        assert response.status_code == 200
+        assert response.json()["clan"]["score"] == score
+    assert client.get("/api/clans/leaderboard", params={"clan_id": 10 ** 9}).status_code == 404
+
+# test generating invites reuses the clan's code until its last use deactivates it
+
+
+def test_generate_invite_reuse(client, monkeypatch):
+    from services import clan_referral_system
+    monkeypatch.setattr(clan_referral_system, "invite_max_uses", 1)
+    leader, member = f"0x{uuid.uuid4().hex}", f"0x{uuid.uuid4().hex}"
+    for wallet in (leader, member):
+        client.post("/api/users/register_user", json={"wallet_address": wallet})
+    created = client.post("/api/clans/create_clan", json={"clan_name": "reuse", "creator_wallet": leader}).json()
+
+    codes = [client.post(f"/api/clans/generate_invite/{leader}").json()["invite_code"] for _ in range(3)]
+    assert codes == [created["invite_code"]] * 3
+    assert client.post("/api/clans/join_clan",
+                       json={"wallet_address": member, "invite_code": created["invite_code"]}).status_code == 200
+    assert client.post(f"/api/clans/generate_invite/{leader}").json()["invite_code"] != created["invite_code"]
+
+# test archived referral codes leave Referrals but are still listed
+
+
+def test_archived_referral_codes_listed(client):
+    from database.database_queries import inactivate_referral_token, fetch_all_referral_codes
+    from services.referral_system import archive_dead_referral_codes
+
+    wallet = f"0x{uuid.uuid4().hex}"
+    client.post("/api/users/register_user", json={"wallet_address": wallet})
+    code = fetch_referral_code(wallet)
+    inactivate_referral_token(code)
+    assert archive_dead_referral_codes(batch_size=2) >= 1
+
+    conn = sqlite3.connect(sqlite_path(connection_string))
+    assert conn.execute("SELECT COUNT(*) FROM Referrals WHERE is_active = FALSE").fetchone()[0] == 0
+    conn.close()
+    codes = fetch_all_referral_codes(wallet)
+    assert [(row["referral_code"], row["is_active"]) for row in codes] == [(code, 0)]
+
+# test concurrent joins never put a user in two clans or a clan past its member limit
+
+
+def test_concurrent_joins(client, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from database import clan_database_queries
+    monkeypatch.setattr(clan_database_queries, "max_clan_members", 3)
+    wallets = [f"0x{uuid.uuid4().hex}" for _ in range(8)]
+    for wallet in wallets:
+        client.post("/api/users/register_user", json={"wallet_address": wallet})
+    first = client.post("/api/clans/create_clan", json={"clan_name": "cas1", "creator_wallet": wallets[0]}).json()
+    second = client.post("/api/clans/create_clan", json={"clan_name": "cas2", "creator_wallet": wallets[1]}).json()
+
+    def join(args):
+        wallet, body = args
+        return client.post("/api/clans/join_clan", json=dict(body, wallet_address=wallet)).status_code
+
+    attempts = [(wallets[2], {"invite_code": first["invite_code"]}), (wallets[2], {"clan_id": second["clan_id"]})] * 4
+    attempts += [(wallet, {"invite_code": first["invite_code"]}) for wallet in wallets[3:]]
+    with ThreadPoolExecutor(8) as pool:
+        statuses = list(pool.map(join, attempts))
+    assert statuses[:8].count(200) == 1
+
+    counts = {clan["clan_id"]: clan["member_count"]
+              for clan in client.get("/api/clans/available_clans", params={"limit": 200}).json()["clans"]}
+    assert counts[first["clan_id"]] == 3
+    assert counts[first["clan_id"]] + counts[second["clan_id"]] == 2 + statuses.count(200)
+
+# test a refused join reports the reason it was refused
+
+
+def test_join_refusal_reasons(client, monkeypatch):
+    from database import clan_database_queries
+    from database.clan_database_queries import join_clan_by_id
+    from database.database_queries import fetch_user_by_wallet
+    leader, member = f"0x{uuid.uuid4().hex}", f"0x{uuid.uuid4().hex}"
+    for wallet in (leader, member):
+        client.post("/api/users/register_user", json={"wallet_address": wallet})
+    created = client.post("/api/clans/create_clan", json={"clan_name": "refusals", "creator_wallet": leader}).json()
+    clan_id = created["clan_id"]
+    member_id = fetch_user_by_wallet(member)
+
+    assert join_clan_by_id(10 ** 9, clan_id) == "user_not_found"
+    assert join_clan_by_id(member_id, 10 ** 9) == "clan_not_found"
+    monkeypatch.setattr(clan_database_queries, "max_clan_members", 1)
+    assert join_clan_by_id(member_id, clan_id) == "clan_full"
+    monkeypatch.setattr(clan_database_queries, "max_clan_members", None)
+    assert join_clan_by_id(member_id, clan_id) == "joined"
+    assert join_clan_by_id(member_id, clan_id) == "already_in_clan"
+
+# test available_clans pages through every clan once and rejects crafted cursors with 400
+
+
+def test_available_clans_pagination(client):
+    leaders = [f"0x{uuid.uuid4().hex}" for _ in range(3)]
+    for wallet in leaders:
+        client.post("/api/users/register_user", json={"wallet_address": wallet})
+        client.post("/api/clans/create_clan", json={"clan_name": "paged", "creator_wallet": wallet})
+
+    listing = client.get("/api/clans/available_clans", params={"limit": 200}).json()["clans"]
+    everything = [clan["clan_id"] for clan in listing]
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/clans/available_clans", params=params).json()
+        seen += [clan["clan_id"] for clan in page["clans"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == everything
+
+    for value in ([1, 2], {"a": 1}):
+        payload = json.dumps({"s": "clan_id", "d": False, "v": value, "id": 1}).encode()
+        cursor = base64.urlsafe_b64encode(payload).decode()
+        assert client.get("/api/clans/available_clans", params={"cursor": cursor}).status_code == 400
+
+# test batch add and remove report per wallet, and a disbanded clan takes no new members
+
+
+def test_batch_members_and_disband(client):
+    from database.clan_database_queries import add_users_to_clan
+    leader, other_leader = f"0x{uuid.uuid4().hex}", f"0x{uuid.uuid4().hex}"
+    members = [f"0x{uuid.uuid4().hex}" for _ in range(3)]
+    for wallet in [leader, other_leader] + members:
+        client.post("/api/users/register_user", json={"wallet_address": wallet})
+    created = client.post("/api/clans/create_clan", json={"clan_name": "batch", "creator_wallet": leader}).json()
+    clan_id = created["clan_id"]
+    client.post("/api/clans/create_clan", json={"clan_name": "other", "creator_wallet": other_leader})
+
+    added = client.post("/api/clans/add_members", json={
+        "leader_wallet": leader, "wallet_addresses": members + [other_leader, "0xmissing"]}).json()
+    assert added["added"] == 3
+    assert added["results"][other_leader] == "in_another_clan" and added["results"]["0xmissing"] == "not_found"
+    again = client.post("/api/clans/add_members",
+                        json={"leader_wallet": leader, "wallet_addresses": members[:1]}).json()
+    assert again["results"][members[0]] == "already_member"
+
+    removed = client.post("/api/clans/remove_members", json={
+        "leader_wallet": leader, "wallet_addresses": [members[0], leader, other_leader]}).json()
+    assert removed["results"] == {members[0]: "removed", leader: "is_leader", other_leader: "not_member"}
+
+    disbanded = client.post("/api/clans/disband_clan", json={"leader_wallet": leader}).json()
+    assert disbanded["removed"] == 3  # the leader and the two members left
+    assert add_users_to_clan(clan_id, [members[0]]) == {members[0]: "clan_not_found"}
+    conn = sqlite3.connect(sqlite_path(connection_string))
+    assert conn.execute("SELECT clan_id FROM Users WHERE wallet_address = ?", (members[0],)).fetchone() == (None,)
+    conn.close()
+
+# test exports stream every row once, in key order, across many small keyset batches
+
+
+def test_exports_continue_across_batches(client, monkeypatch):
+    from services import export
+    from routers import admin_routes
+    from database.database_queries import inactivate_referral_token
+    from services.referral_system import archive_dead_referral_codes
+    monkeypatch.setattr(export, "export_batch_size", 2)
+    monkeypatch.setattr(admin_routes, "ADMIN_TOKEN", "secret")
+
+    leader, archived = f"0x{uuid.uuid4().hex}", f"0x{uuid.uuid4().hex}"
+    members = [f"0x{uuid.uuid4().hex}" for _ in range(4)]
+    for wallet in [leader, archived] + members:
+        client.post("/api/users/register_user", json={"wallet_address": wallet})
+    created = client.post("/api/clans/create_clan", json={"clan_name": "export", "creator_wallet": leader}).json()
+    clan_id = created["clan_id"]
+    client.post("/api/clans/add_members", json={"leader_wallet": leader, "wallet_addresses": members})
+    archived_code = fetch_referral_code(archived)
+    inactivate_referral_token(archived_code)
+    archive_dead_referral_codes()
+
+    def streamed(url: str) -> list:
+        response = client.get(url, headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200 and response.headers["content-type"].startswith("application/x-ndjson")
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    conn = sqlite3.connect(sqlite_path(connection_string))
+    totals = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("Clans", "Referrals", "referrals_archive")}
+    conn.close()
+
+    def ascending(rows: list, key: str) -> list:
+        keys = [row[key] for row in rows]
+        assert keys == sorted(set(keys))
+        return keys
+
+    for url in ("/api/clans/export/clans", f"/api/clans/export/clan/{clan_id}/members",
+                "/api/referrals/export", "/api/referrals/export/archive"):
+        assert client.get(url).status_code == 403
+    assert len(ascending(streamed("/api/clans/export/clans"), "clan_id")) == totals["Clans"]
+    assert len(ascending(streamed(f"/api/clans/export/clan/{clan_id}/members"), "user_id")) == 5
+    live = ascending(streamed("/api/referrals/export"), "referral_code_id")
+    archive = streamed("/api/referrals/export/archive")
+    assert len(live) == totals["Referrals"] and len(archive) == totals["referrals_archive"]
+    assert not set(live) & set(ascending(archive, "referral_code_id"))
+    assert archived_code in [row["referral_code"] for row in archive]
+
+# test the expiry sweep deactivates expired codes in bounded batches and leaves live codes active
+
+
+def test_expiry_sweep_batches(client):
+    import datetime
+    from database.database_queries import store_referral_code, deactivate_expired_referral_codes, fetch_user_by_wallet
+    from services.referral_system import sweep_expired_referral_codes, is_active_referral_code
+    wallet = f"0x{uuid.uuid4().hex}"
+    client.post("/api/users/register_user", json={"wallet_address": wallet})
+    user_id = fetch_user_by_wallet(wallet)
+    now = datetime.datetime.now()
+    expired = [f"expired-{uuid.uuid4().hex}" for _ in range(5)]
+    live = [f"live-{uuid.uuid4().hex}" for _ in range(2)]
+    for code in expired:
+        store_referral_code(code, user_id, now - datetime.timedelta(minutes=1))
+    for code in live:
+        store_referral_code(code, user_id, now + datetime.timedelta(days=1))
+
+    assert deactivate_expired_referral_codes(datetime.datetime.now(), 2) == 2
+    assert sweep_expired_referral_codes(batch_size=2) >= 3
+    assert deactivate_expired_referral_codes(datetime.datetime.now(), 2) == 0
+
+    conn = sqlite3.connect(sqlite_path(connection_string))
+    active = {code for code, in conn.execute(
+        "SELECT referral_code FROM Referrals WHERE is_active = TRUE AND user_id = ?", (user_id,))}
+    conn.close()
+    assert not active & set(expired) and set(live) <= active
+    assert all(is_active_referral_code(code) for code in live)
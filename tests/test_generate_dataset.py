@@ -0,0 +1,32 @@
+import sqlite3
+from datetime import datetime
+from database.generate_dataset import generate_dataset
+
+
+def dump(database: str) -> dict:
+    conn = sqlite3.connect(database)
+    try:
+        return {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall()
+                for table in ("Users", "Clans", "Referrals")}
+    finally:
+        conn.close()
+
+# the same seed and reference time produce the same rows, and member_count matches Users
+
+
+def test_same_seed_same_dataset(tmp_path):
+    as_of = datetime(2026, 1, 1)
+    databases = [str(tmp_path / f"dataset{i}.db") for i in range(3)]
+    for database, seed in zip(databases, (7, 7, 8)):
+        generate_dataset(database, users=300, clans=10, referrals=200, seed=seed, as_of=as_of)
+
+    first, second, other = (dump(database) for database in databases)
+    assert first == second
+    assert first != other
+    assert [len(first[table]) for table in ("Users", "Clans", "Referrals")] == [300, 10, 200]
+
+    conn = sqlite3.connect(databases[0])
+    drift = conn.execute("SELECT COUNT(*) FROM Clans c WHERE member_count != "
+                         "(SELECT COUNT(*) FROM Users u WHERE u.clan_id = c.clan_id)").fetchone()[0]
+    conn.close()
+    assert drift == 0
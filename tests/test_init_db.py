@@ -0,0 +1,89 @@
+import sqlite3
+from init_db import MIGRATIONS, migrate, collect_queries, reconcile_member_counts
+
+# migrations are applied once and recorded in schema_migrations
+
+
+def test_migrate_is_idempotent(tmp_path):
+    database = str(tmp_path / "migrate.db")
+    assert migrate(database) == sorted(version for version, _, _ in MIGRATIONS)
+    assert migrate(database) == []
+
+    conn = sqlite3.connect(database)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.close()
+    assert {"idx_users_clan_id", "idx_referrals_code", "idx_referrals_user_created"} <= indexes
+    assert auto_vacuum == 2  # INCREMENTAL, set before the first table was created
+
+# workers migrating a fresh database at the same time apply each step exactly once between them
+
+
+def test_concurrent_migrate_applies_each_step_once(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    versions = sorted(version for version, _, _ in MIGRATIONS)
+    for attempt in range(5):
+        database = str(tmp_path / f"concurrent-{attempt}.db")
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            applied = [version for result in pool.map(migrate, [database] * 4) for version in result]
+        assert sorted(applied) == versions
+
+# databases created before the version table existed are upgraded in place
+
+
+def test_migrate_upgrades_unversioned_database(tmp_path):
+    database = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(database)
+    conn.execute("""
+        CREATE TABLE Referrals(
+            referral_code_id INTEGER PRIMARY KEY AutoIncrement,
+            referral_code TEXT NOT NULL,
+            created_at DATE,
+            is_active boolean NOT NULL,
+            user_id INT NOT NULL,
+            clan_id INTEGER
+        )""")
+    conn.execute("INSERT INTO Referrals (referral_code, created_at, is_active, user_id) "
+                 "VALUES ('abc', '2025-04-02 13:29:13', 1, 1)")
+    conn.commit()
+    conn.close()
+
+    migrate(database)
+
+    conn = sqlite3.connect(database)
+    expires_at = conn.execute("SELECT expires_at FROM Referrals WHERE referral_code = 'abc'").fetchone()[0]
+    conn.close()
+    assert expires_at == "2025-04-09 13:29:13"
+
+# --check finds the SQL in every query module
+
+
+def test_collect_queries_finds_query_functions():
+    locations = {location for location, _ in collect_queries()}
+    assert "database_queries.user_exists" in locations
+    assert "clan_database_queries.get_available_clans[sort=member_count]" in locations
+
+# Clans.member_count follows every membership change and --reconcile repairs drift
+
+
+def test_member_count_triggers_and_reconcile(tmp_path):
+    database = str(tmp_path / "counts.db")
+    migrate(database)
+    conn = sqlite3.connect(database)
+    conn.execute("INSERT INTO Users (user_id, wallet_address) VALUES (1, 'a'), (2, 'b')")
+    conn.execute("INSERT INTO Clans (clan_id, clan_name, clan_leader_id) VALUES (1, 'one', 1), (2, 'two', 2)")
+    conn.execute("UPDATE Users SET clan_id = 1")
+    conn.execute("UPDATE Users SET clan_id = 2 WHERE user_id = 2")
+    conn.execute("INSERT INTO Users (wallet_address, clan_id) VALUES ('c', 2)")
+    conn.execute("DELETE FROM Users WHERE wallet_address = 'c'")
+    conn.commit()
+    counts = dict(conn.execute("SELECT clan_id, member_count FROM Clans"))
+    assert counts == {1: 1, 2: 1}
+
+    conn.execute("UPDATE Clans SET member_count = 42 WHERE clan_id = 1")
+    conn.commit()
+    conn.close()
+    assert reconcile_member_counts(database) == 1
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT member_count FROM Clans WHERE clan_id = 1").fetchone()[0] == 1
+    conn.close()
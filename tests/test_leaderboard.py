@@ -0,0 +1,27 @@
+import random
+from services.leaderboard import Ranking
+
+# ranks and top-k match a full sort after many score changes, including bucket splits and merges
+
+
+def test_ranking_matches_full_sort():
+    rng = random.Random(7)
+    ranking = Ranking(bucket_size=4)
+    scores = {}
+    for _ in range(2000):
+        clan_id = rng.randrange(60)
+        if rng.random() < 0.1:
+            ranking.remove(clan_id)
+            scores.pop(clan_id, None)
+        else:
+            score = max(0, scores.get(clan_id, 0) + rng.choice((-1, 1, 1, 5)))
+            ranking.set(clan_id, score)
+            scores[clan_id] = score
+
+    expected = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    assert ranking.top(10) == expected[:10]
+    assert ranking.top(1000) == expected
+    for position, (clan_id, score) in enumerate(expected, start=1):
+        assert ranking.rank(clan_id) == position
+        assert ranking.score(clan_id) == score
+    assert ranking.rank(1000) is None
@@ -0,0 +1,34 @@
+import base64
+import json
+import pytest
+from services.pagination import encode_cursor, decode_cursor
+
+
+def crafted(payload: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+# a cursor decodes back to the sort value and clan_id of the row it was built from
+
+
+def test_cursor_round_trip():
+    row = {"clan_id": 7, "member_count": 12, "created_at": "2026-01-01 00:00:00"}
+    assert decode_cursor(encode_cursor("member_count", True, row), "member_count", True) == (12, 7)
+    assert decode_cursor(encode_cursor("created_at", False, row), "created_at", False) == ("2026-01-01 00:00:00", 7)
+
+# cursors that are not ours, or were issued for another sort order, are rejected with ValueError
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    crafted({"s": "clan_id", "d": False, "id": 1}),
+    crafted({"s": "clan_id", "d": False, "v": [1, 2], "id": 1}),
+    crafted({"s": "clan_id", "d": False, "v": {"a": 1}, "id": 1}),
+    crafted({"s": "clan_id", "d": False, "v": True, "id": 1}),
+    crafted({"s": "clan_id", "d": "false", "v": 1, "id": 1}),
+    crafted({"s": "clan_id", "d": False, "v": 1, "id": [1]}),
+    crafted({"s": "member_count", "d": False, "v": 1, "id": 1}),
+    crafted({"s": "clan_id", "d": True, "v": 1, "id": 1}),
+])
+def test_invalid_cursors(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, "clan_id", False)
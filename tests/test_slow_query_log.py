@@ -0,0 +1,29 @@
+import sqlite3
+from database.statements import Statement
+from database.slow_query_log import slow_query_log
+
+
+def count_rows(conn, stmt, name):
+    return stmt.scalar(conn, {"name": name})
+
+# statements over the threshold are recorded with their caller, redacted parameters and query plan
+
+
+def test_slow_statement_is_recorded(monkeypatch):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t(name TEXT)")
+    stmt = Statement("test.count_rows", "SELECT COUNT(*) FROM t WHERE name = ?name?")
+    monkeypatch.setattr(slow_query_log, "threshold", 0)
+    monkeypatch.setattr(slow_query_log, "redact_params", True)
+    slow_query_log.clear()
+
+    assert count_rows(conn, stmt, "secret") == 0
+
+    record = slow_query_log.records()[0]
+    assert record["statement"] == "test.count_rows"
+    assert record["caller"] == "count_rows"
+    assert record["params"] == {"name": "<str>"}
+    assert record["full_scan"] is True
+    assert any(detail.startswith("SCAN") for detail in record["plan"])
+    slow_query_log.clear()
+    conn.close()
@@ -0,0 +1,59 @@
+import sqlite3
+import threading
+import pytest
+from database.write_queue import WriteQueue
+
+
+def insert(conn, x):
+    conn.execute("INSERT INTO t VALUES (?)", (x,))
+    return x
+
+
+def make_queue(tmp_path, max_batch=100, max_latency=0.05):
+    database = str(tmp_path / "writes.db")
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE t(x INTEGER UNIQUE)")
+    conn.close()
+    return database, WriteQueue(database, max_batch=max_batch, max_latency=max_latency)
+
+# concurrent writes are committed together, and each caller gets its own result
+
+
+def test_writes_are_grouped_into_batches(tmp_path):
+    database, writes = make_queue(tmp_path)
+    barrier = threading.Barrier(20)
+    results = []
+
+    def write(x):
+        barrier.wait()
+        results.append(writes.submit(insert, x).result())
+
+    threads = [threading.Thread(target=write, args=(x,)) for x in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writes.close()
+
+    assert sorted(results) == list(range(20))
+    stats = writes.stats()
+    assert stats["writes"] == 20
+    assert stats["batches"] < 20
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 20
+    conn.close()
+
+# a failing write is rolled back on its own and the rest of its batch still commits
+
+
+def test_failed_write_does_not_affect_batch(tmp_path):
+    database, writes = make_queue(tmp_path)
+    futures = [writes.submit(insert, x) for x in (1, 2, 1, 3)]
+    writes.close()
+
+    assert [future.result() for future in (futures[0], futures[1], futures[3])] == [1, 2, 3]
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[2].result()
+    conn = sqlite3.connect(database)
+    assert sorted(row[0] for row in conn.execute("SELECT x FROM t")) == [1, 2, 3]
+    conn.close()